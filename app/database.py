@@ -1,10 +1,27 @@
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
+from app.utils.mongo_monitoring import CommandTimingListener
 
 load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI")
 
-client = AsyncIOMotorClient(MONGO_URI)
-db = client.sop_database  
+client = AsyncIOMotorClient(MONGO_URI, event_listeners=[CommandTimingListener()])
+db = client.sop_database
+
+async def ensure_indexes():
+    """Create the indexes hot queries rely on; a no-op when they already exist"""
+    # Task lookups and conditional status updates by id
+    await db.tasks.create_index([("id", 1)])
+    # Status counts and per-day statistics
+    await db.tasks.create_index([("status", 1), ("created_at", 1)])
+    # Per-day statistics across every status, including ones outside TASK_TRANSITIONS
+    await db.tasks.create_index([("created_at", 1)])
+    # Version reconstruction walks parent links by sop_id
+    await db.sops.create_index([("sop_id", 1)])
+    # Metadata reads of new similarity index rows by sop_id
+    await db.sop_documents.create_index([("sop_id", 1)])
+    await db.edited_sop_details.create_index([("old_sop_id", 1)])
+    # Incremental reads of score updates by the similarity index
+    await db.sop_documents.create_index([("effectiveness_updated_at", 1)], sparse=True)
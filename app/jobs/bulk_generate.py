@@ -0,0 +1,53 @@
+"""Generate SOPs in bulk from a CSV or JSONL file of topic/description rows.
+
+    python -m app.jobs.bulk_generate rows.csv --concurrency 8
+    python -m app.jobs.bulk_generate --resume <job_id>
+
+Progress is kept in the tasks collection, so an interrupted run can be resumed
+without regenerating rows that already finished.
+"""
+import argparse
+import asyncio
+import logging
+from app.services.bulk_service import (
+    parse_bulk_rows, create_bulk_job, requeue_bulk_job, run_bulk_job, get_bulk_job_progress,
+    BULK_GENERATION_CONCURRENCY
+)
+
+async def main(path: str, resume: str, concurrency: int):
+    if resume:
+        job_id = resume
+        await requeue_bulk_job(job_id)
+    else:
+        with open(path, encoding="utf-8-sig") as f:
+            rows = parse_bulk_rows(f.read(), path)
+        job_id = await create_bulk_job(rows)
+        print(f"Created bulk job {job_id} with {len(rows)} rows")
+
+    async def report():
+        while True:
+            await asyncio.sleep(10)
+            progress = await get_bulk_job_progress(job_id)
+            print(f"{job_id}: {progress['status_counts']}")
+
+    reporter = asyncio.create_task(report())
+    try:
+        await run_bulk_job(job_id, concurrency)
+    finally:
+        reporter.cancel()
+
+    progress = await get_bulk_job_progress(job_id)
+    print(f"{job_id} finished: {progress['status_counts']}")
+    for failure in progress["failures"]:
+        print(f"  row {failure['row']} ({failure['topic']}): {failure.get('error')}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?")
+    parser.add_argument("--resume", help="id of an interrupted job to continue")
+    parser.add_argument("--concurrency", type=int, default=BULK_GENERATION_CONCURRENCY)
+    args = parser.parse_args()
+    if not args.path and not args.resume:
+        parser.error("a file path or --resume is required")
+    asyncio.run(main(args.path, args.resume, args.concurrency))
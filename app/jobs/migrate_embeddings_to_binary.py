@@ -0,0 +1,48 @@
+import asyncio
+import logging
+from pymongo import UpdateOne
+from app.database import db
+from app.utils.vector_codec import encode_vector
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+# Legacy documents store at least one vector as a BSON array of doubles
+LEGACY_QUERY = {
+    "$or": [
+        {"topic_embedding": {"$type": "array"}},
+        {"summary_embedding": {"$type": "array"}}
+    ]
+}
+
+async def migrate_embeddings_to_binary(batch_size: int = BATCH_SIZE) -> int:
+    """Rewrite legacy embedding documents as float32 binary. Safe to re-run."""
+    migrated = 0
+    operations = []
+
+    cursor = db.embeddings.find(LEGACY_QUERY, {"topic_embedding": 1, "summary_embedding": 1})
+    async for doc in cursor.batch_size(batch_size):
+        operations.append(UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {
+                "topic_embedding": encode_vector(doc["topic_embedding"]),
+                "summary_embedding": encode_vector(doc["summary_embedding"])
+            }}
+        ))
+        if len(operations) >= batch_size:
+            result = await db.embeddings.bulk_write(operations, ordered=False)
+            migrated += result.modified_count
+            operations = []
+            logger.info(f"Migrated {migrated} embedding documents")
+
+    if operations:
+        result = await db.embeddings.bulk_write(operations, ordered=False)
+        migrated += result.modified_count
+
+    logger.info(f"Embedding migration finished: {migrated} documents converted")
+    return migrated
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate_embeddings_to_binary())
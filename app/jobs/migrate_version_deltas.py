@@ -0,0 +1,86 @@
+"""Convert stored SOP versions to delta storage.
+
+    python -m app.jobs.migrate_version_deltas
+
+Edited versions in db.sops are rewritten as a delta against their parent (or
+kept in full every VERSION_CHECKPOINT_INTERVAL versions), and the duplicated
+original_details / edited_details texts are dropped from edited_sop_details.
+Every delta is checked to reproduce the stored text before it is written.
+Versions already converted are skipped, so the job is safe to re-run.
+"""
+import asyncio
+import logging
+from pymongo import UpdateOne
+from app.database import db
+from app.utils.sop_versions import version_store, version_fields, apply_delta, delta_size, DETAILS_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+async def _flush(sop_operations: list, edit_operations: list):
+    if sop_operations:
+        await db.sops.bulk_write(sop_operations, ordered=False)
+    if edit_operations:
+        await db.edited_sop_details.bulk_write(edit_operations, ordered=False)
+
+async def migrate_version_deltas(batch_size: int = BATCH_SIZE) -> dict:
+    stats = {"converted": 0, "checkpoints": 0, "bytes_before": 0, "bytes_after": 0}
+    # Depths assigned in this run; parents are converted before their children
+    depths = {}
+    sop_operations = []
+    edit_operations = []
+    projection = {"depth": 1, **DETAILS_PROJECTION}
+
+    # A child always has a higher version number than its parent
+    cursor = db.edited_sop_details.find({}, {"new_sop_id": 1, "old_sop_id": 1, "original_details": 1, "edited_details": 1})
+    async for edit in cursor.sort("version", 1).batch_size(batch_size):
+        child = await db.sops.find_one({"sop_id": edit["new_sop_id"]}, projection)
+        if not child:
+            continue
+        if "depth" in child:
+            depths[child["sop_id"]] = child["depth"]
+            if "original_details" in edit or "edited_details" in edit:
+                edit_operations.append(UpdateOne({"_id": edit["_id"]}, {"$unset": {"original_details": "", "edited_details": ""}}))
+            continue
+
+        parent = await db.sops.find_one({"sop_id": edit["old_sop_id"]}, projection)
+        if not parent:
+            logger.warning(f"Skipping {edit['new_sop_id']}: parent {edit['old_sop_id']} not found")
+            continue
+        parent_details = await version_store.details_of(parent)
+        details = child["details"]
+
+        fields = version_fields(parent["sop_id"], depths.get(parent["sop_id"], parent.get("depth", 0)), parent_details, details)
+        update = {"$set": fields}
+        if "delta" in fields:
+            if apply_delta(parent_details, fields["delta"]) != details:
+                raise RuntimeError(f"Delta for {child['sop_id']} does not reproduce its details")
+            update["$unset"] = {"details": ""}
+            stats["bytes_after"] += delta_size(fields["delta"])
+        else:
+            stats["checkpoints"] += 1
+            stats["bytes_after"] += len(details)
+        stats["bytes_before"] += len(details) + len(edit.get("original_details", "")) + len(edit.get("edited_details", ""))
+
+        sop_operations.append(UpdateOne({"sop_id": child["sop_id"]}, update))
+        edit_operations.append(UpdateOne({"_id": edit["_id"]}, {"$unset": {"original_details": "", "edited_details": ""}}))
+        depths[child["sop_id"]] = fields["depth"]
+        version_store.remember(child["sop_id"], details)
+        stats["converted"] += 1
+
+        if len(edit_operations) >= batch_size:
+            await _flush(sop_operations, edit_operations)
+            sop_operations, edit_operations = [], []
+            logger.info(f"Converted {stats['converted']} versions")
+
+    await _flush(sop_operations, edit_operations)
+    logger.info(
+        f"Version migration finished: {stats['converted']} versions converted ({stats['checkpoints']} kept in full), "
+        f"{stats['bytes_before']} bytes of details stored as {stats['bytes_after']}"
+    )
+    return stats
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate_version_deltas())
@@ -0,0 +1,183 @@
+"""Find near-duplicate SOPs across the whole library.
+
+    python -m app.jobs.near_duplicates --threshold 0.95 --block-size 2048
+
+Every pair of SOPs is scored with the search similarity (0.6 * topic cosine +
+0.4 * summary cosine, without version boosts), one block x block float32 tile
+at a time, so memory stays at the vectors (memory-mapped when a snapshot
+exists) plus one tile. Pairs at or above the threshold are merged into
+clusters with union-find, and one document per cluster is written to
+near_duplicate_clusters:
+
+    {run_id, cluster_id, size, max_score, members: [{sop_id, topic, version, ...}], pairs: [{a, b, score}]}
+
+Clusters are numbered largest first. Look a SOP up with
+{"members.sop_id": ...}. Only the newest run is kept; run statistics go to
+near_duplicate_runs. Versions superseded by an edit are skipped unless
+--include-superseded is given, since every edit is by design close to its parent.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+import uuid
+import numpy as np
+from datetime import datetime, timezone
+from typing import List, Tuple
+from app.database import db
+from app.utils.embedding_index import EmbeddingIndex, TOPIC_WEIGHT, SUMMARY_WEIGHT
+
+logger = logging.getLogger(__name__)
+
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.95"))
+# Rows per tile side; a tile holds block_size^2 float32 scores (16 MB at 2048)
+NEAR_DUPLICATE_BLOCK_SIZE = int(os.getenv("NEAR_DUPLICATE_BLOCK_SIZE", "2048"))
+# Highest-scoring pairs stored with each cluster
+MAX_PAIRS_PER_CLUSTER = 100
+REPORT_BATCH_SIZE = 500
+
+class UnionFind:
+    def __init__(self, size: int):
+        self.parent = np.arange(size, dtype=np.int64)
+
+    def find(self, item: int) -> int:
+        parent = self.parent
+        while parent[item] != item:
+            # Path halving keeps the trees flat without recursion
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a: int, b: int):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+def _weighted(block: np.ndarray, dim: int) -> np.ndarray:
+    # Weighting one side of the product turns the dot product of combined rows into the search similarity
+    block = block.copy()
+    block[:, :dim] *= TOPIC_WEIGHT
+    block[:, dim:] *= SUMMARY_WEIGHT
+    return block
+
+def blocked_pairs(index: EmbeddingIndex, rows: np.ndarray, threshold: float,
+                  block_size: int = NEAR_DUPLICATE_BLOCK_SIZE) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(a, b, score) arrays of every pair of the given rows scoring at or above the threshold, a < b"""
+    found_a, found_b, found_scores = [], [], []
+    starts = range(0, len(rows), block_size)
+    for i in starts:
+        left = _weighted(index.vectors.take(rows[i:i + block_size]), index.dim)
+        for j in starts:
+            # Each unordered pair is scored once: only tiles on or above the diagonal
+            if j < i:
+                continue
+            right = index.vectors.take(rows[j:j + block_size])
+            scores = left @ right.T
+            if j == i:
+                # Drop the diagonal and the mirrored lower half of the tile
+                scores[np.tri(*scores.shape, dtype=bool)] = -np.inf
+            a, b = np.nonzero(scores >= threshold)
+            if len(a):
+                found_a.append(rows[i + a])
+                found_b.append(rows[j + b])
+                found_scores.append(scores[a, b])
+        logger.info(f"Scored rows {i}-{min(i + block_size, len(rows))} of {len(rows)} against the library")
+
+    if not found_a:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float32)
+    return np.concatenate(found_a), np.concatenate(found_b), np.concatenate(found_scores)
+
+def cluster_pairs(size: int, a: np.ndarray, b: np.ndarray) -> List[List[int]]:
+    """Connected components of the pair graph that have at least two rows, largest first"""
+    union_find = UnionFind(size)
+    for left, right in zip(a.tolist(), b.tolist()):
+        union_find.union(left, right)
+    clusters = {}
+    for row in set(a.tolist()) | set(b.tolist()):
+        clusters.setdefault(union_find.find(row), []).append(row)
+    return sorted((sorted(members) for members in clusters.values()), key=len, reverse=True)
+
+async def _members(sop_ids: List[str]) -> dict:
+    projection = {"_id": 0, "sop_id": 1, "topic": 1, "version": 1, "effectiveness_score": 1, "created_at": 1}
+    documents = {}
+    async for doc in db.sop_documents.find({"sop_id": {"$in": sop_ids}}, projection):
+        documents[doc["sop_id"]] = doc
+    return documents
+
+async def find_near_duplicates(threshold: float = NEAR_DUPLICATE_THRESHOLD, block_size: int = NEAR_DUPLICATE_BLOCK_SIZE,
+                               include_superseded: bool = False) -> dict:
+    start = time.perf_counter()
+    # Only the full vectors are needed, so neither the first-pass prefix matrix nor the ANN graph is loaded
+    index = EmbeddingIndex(prefix_dim=0, use_ann=False)
+    await index.load()
+    rows = np.arange(len(index)) if include_superseded else np.flatnonzero(index.latest)
+    logger.info(f"Comparing {len(rows)} SOPs pairwise in blocks of {block_size}")
+
+    a, b, scores = blocked_pairs(index, rows, threshold, block_size)
+    clusters = cluster_pairs(len(index), a, b)
+
+    # Group each pair under its cluster, best pairs first
+    cluster_of = {row: cluster_id for cluster_id, members in enumerate(clusters) for row in members}
+    pairs_of = {}
+    for i in np.argsort(-scores, kind="stable"):
+        pairs = pairs_of.setdefault(cluster_of[int(a[i])], [])
+        if len(pairs) < MAX_PAIRS_PER_CLUSTER:
+            pairs.append((int(a[i]), int(b[i]), float(scores[i])))
+
+    run_id = str(uuid.uuid4())
+    for batch_start in range(0, len(clusters), REPORT_BATCH_SIZE):
+        batch = clusters[batch_start:batch_start + REPORT_BATCH_SIZE]
+        documents = await _members([index.sop_ids[row] for members in batch for row in members])
+        reports = []
+        for offset, members in enumerate(batch):
+            cluster_id = batch_start + offset
+            pairs = pairs_of.get(cluster_id, [])
+            reports.append({
+                "run_id": run_id,
+                "cluster_id": cluster_id,
+                "size": len(members),
+                "max_score": pairs[0][2] if pairs else None,
+                "members": [
+                    documents.get(index.sop_ids[row], {"sop_id": index.sop_ids[row]}) for row in members
+                ],
+                "pairs": [
+                    {"a": index.sop_ids[left], "b": index.sop_ids[right], "score": score} for left, right, score in pairs
+                ]
+            })
+        await db.near_duplicate_clusters.insert_many(reports)
+
+    await db.near_duplicate_clusters.create_index([("run_id", 1), ("cluster_id", 1)])
+    await db.near_duplicate_clusters.create_index([("members.sop_id", 1)])
+    # The new report is complete; drop the previous ones
+    await db.near_duplicate_clusters.delete_many({"run_id": {"$ne": run_id}})
+
+    run = {
+        "_id": run_id,
+        "model": index.model,
+        "threshold": threshold,
+        "block_size": block_size,
+        "include_superseded": include_superseded,
+        "sops": int(len(rows)),
+        "pairs": int(len(a)),
+        "clusters": len(clusters),
+        "duplicate_sops": sum(len(members) for members in clusters),
+        "seconds": time.perf_counter() - start,
+        "created_at": datetime.now(timezone.utc)
+    }
+    await db.near_duplicate_runs.insert_one(run)
+    logger.info(
+        f"Near-duplicate run {run_id}: {run['pairs']} pairs in {run['clusters']} clusters "
+        f"among {run['sops']} SOPs in {run['seconds']:.1f}s"
+    )
+    return run
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threshold", type=float, default=NEAR_DUPLICATE_THRESHOLD)
+    parser.add_argument("--block-size", type=int, default=NEAR_DUPLICATE_BLOCK_SIZE)
+    parser.add_argument("--include-superseded", action="store_true", help="also compare versions replaced by an edit")
+    args = parser.parse_args()
+    asyncio.run(find_near_duplicates(args.threshold, args.block_size, args.include_superseded))
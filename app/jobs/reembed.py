@@ -0,0 +1,175 @@
+"""Re-embed every SOP with a new embedding model and switch search over once done.
+
+    python -m app.jobs.reembed text-embedding-3-large --batch-size 500
+
+New vectors are written next to the existing ones (one embeddings document per
+SOP and model). Progress is checkpointed in the embedding_jobs collection, so a
+rerun continues where the last one stopped. Search keeps using the old vectors
+until every SOP has a vector for the new model. While the job runs, new SOPs
+are embedded with both models; after switching, the job waits one model check
+interval for every worker to follow and embeds anything still missing.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import List
+from pymongo import UpdateOne
+from app.database import db
+from app.utils.embedding_models import (
+    active_embedding_model, set_active_embedding_model, embedding_model_filter, LEGACY_EMBEDDING_MODEL
+)
+from app.utils.embedding_index import MODEL_CHECK_INTERVAL
+from app.utils.openai_embeddings import get_embeddings
+from app.utils.openai_scheduler import BULK
+from app.utils.vector_codec import encode_vector
+
+logger = logging.getLogger(__name__)
+
+# SOPs embedded per request; each contributes a topic and a summary text
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", "500"))
+
+# Jobs running in this process, by target model
+_running_jobs = {}
+
+async def _embed_batch(model: str, sops: List[dict]):
+    summaries = {}
+    async for doc in db.summaries.find({"sop_id": {"$in": [sop["sop_id"] for sop in sops]}}, {"_id": 0, "sop_id": 1, "summary": 1}):
+        summaries[doc["sop_id"]] = doc["summary"]
+    # SOPs without a summary cannot be searched and are skipped, as they are today
+    sops = [sop for sop in sops if sop["sop_id"] in summaries]
+    if not sops:
+        return 0
+
+    embeddings = await get_embeddings(
+        [sop["topic"] for sop in sops] + [summaries[sop["sop_id"]] for sop in sops],
+        priority=BULK,
+        model=model
+    )
+    await db.embeddings.bulk_write([
+        UpdateOne(
+            {"sop_id": sop["sop_id"], "model": model},
+            {"$set": {
+                "topic_embedding": encode_vector(embeddings[i]),
+                "summary_embedding": encode_vector(embeddings[len(sops) + i])
+            }},
+            upsert=True
+        )
+        for i, sop in enumerate(sops)
+    ], ordered=False)
+    return len(sops)
+
+def _missing_sops(model: str, batch_size: int):
+    """Cursor over SOPs without a vector for the model, e.g. created since the job passed them.
+
+    An anti-join on the (sop_id, model) index, streamed, so no id set is built in memory.
+    """
+    return db.sops.aggregate([
+        {"$project": {"_id": 0, "sop_id": 1, "topic": 1}},
+        {"$lookup": {
+            "from": "embeddings",
+            "localField": "sop_id",
+            "foreignField": "sop_id",
+            "pipeline": [{"$match": embedding_model_filter(model)}, {"$limit": 1}, {"$project": {"_id": 1}}],
+            "as": "embedding"
+        }},
+        {"$match": {"embedding": []}},
+        {"$project": {"embedding": 0}}
+    ], batch_size=batch_size)
+
+async def _embed_missing(model: str, batch_size: int) -> int:
+    processed = 0
+    while True:
+        embedded = 0
+        batch = []
+        async for sop in _missing_sops(model, batch_size):
+            batch.append(sop)
+            if len(batch) >= batch_size:
+                embedded += await _embed_batch(model, batch)
+                batch = []
+        if batch:
+            embedded += await _embed_batch(model, batch)
+        processed += embedded
+        # Whatever a pass leaves behind has no summary and is never searchable
+        if not embedded:
+            return processed
+
+async def run_reembed_job(model: str, batch_size: int = REEMBED_BATCH_SIZE) -> dict:
+    await db.embeddings.create_index([("sop_id", 1), ("model", 1)])
+    # Tag untagged legacy vectors so the per-model upserts below never duplicate them
+    await db.embeddings.update_many({"model": {"$exists": False}}, {"$set": {"model": LEGACY_EMBEDDING_MODEL}})
+    job = await db.embedding_jobs.find_one_and_update(
+        {"_id": model},
+        {"$set": {"status": "running"}, "$setOnInsert": {"processed": 0, "last_id": None, "started_at": datetime.utcnow()}},
+        upsert=True,
+        return_document=True
+    )
+    if active_embedding_model() == model and job.get("completed_at"):
+        return job
+
+    # Stream SOPs in _id order from the last checkpoint
+    query = {"_id": {"$gt": job["last_id"]}} if job["last_id"] is not None else {}
+    processed = job["processed"]
+    batch = []
+    async for sop in db.sops.find(query, {"sop_id": 1, "topic": 1}).sort("_id", 1).batch_size(batch_size):
+        batch.append(sop)
+        if len(batch) >= batch_size:
+            processed += await _embed_batch(model, batch)
+            await db.embedding_jobs.update_one(
+                {"_id": model}, {"$set": {"last_id": batch[-1]["_id"], "processed": processed}}
+            )
+            logger.info(f"Re-embedded {processed} SOPs with {model}")
+            batch = []
+    if batch:
+        processed += await _embed_batch(model, batch)
+        await db.embedding_jobs.update_one(
+            {"_id": model}, {"$set": {"last_id": batch[-1]["_id"], "processed": processed}}
+        )
+
+    # Catch up on SOPs created during the backfill before switching search over
+    processed += await _embed_missing(model, batch_size)
+
+    await set_active_embedding_model(model)
+    # Workers still on the old model keep dual-writing until they notice the switch; once they
+    # all have, embed whatever a worker stored with only the old model in the meantime
+    await asyncio.sleep(MODEL_CHECK_INTERVAL)
+    processed += await _embed_missing(model, batch_size)
+    await db.embedding_jobs.update_one(
+        {"_id": model},
+        {"$set": {"status": "completed", "processed": processed, "completed_at": datetime.utcnow()}}
+    )
+    logger.info(f"Re-embedding with {model} complete ({processed} SOPs); search now uses it")
+    return await db.embedding_jobs.find_one({"_id": model})
+
+def start_reembed_job(model: str, batch_size: int = REEMBED_BATCH_SIZE) -> bool:
+    """Run the backfill in the background of this process; False if it is already running here"""
+    if model in _running_jobs:
+        return False
+
+    async def run():
+        try:
+            await run_reembed_job(model, batch_size)
+        except Exception as e:
+            logger.error(f"Re-embedding with {model} failed: {str(e)}")
+            await db.embedding_jobs.update_one({"_id": model}, {"$set": {"status": "failed", "error": str(e)}})
+
+    task = asyncio.create_task(run())
+    _running_jobs[model] = task
+    task.add_done_callback(lambda _: _running_jobs.pop(model, None))
+    return True
+
+async def get_reembed_job(model: str):
+    job = await db.embedding_jobs.find_one({"_id": model}, {"last_id": 0})
+    if job:
+        job["model"] = job.pop("_id")
+        job["running_here"] = model in _running_jobs
+    return job
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model")
+    parser.add_argument("--batch-size", type=int, default=REEMBED_BATCH_SIZE)
+    args = parser.parse_args()
+    asyncio.run(run_reembed_job(args.model, args.batch_size))
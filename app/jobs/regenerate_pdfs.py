@@ -0,0 +1,131 @@
+"""Re-render every SOP PDF after a template or branding change.
+
+    python -m app.jobs.regenerate_pdfs --workers 8 --batch-size 64
+
+SOPs are streamed from db.sops in _id order, and those with a PDF on disk are
+re-rendered across a process pool (one process per core by default). Each PDF
+is written to a temporary file and renamed over the old one, so downloads
+never see a partial file. Progress is
+checkpointed in the pdf_jobs collection under PDF_TEMPLATE_VERSION, so a rerun
+with the same version continues where the last one stopped.
+
+PDFs are served with immutable caching only to URLs carrying ?v=<template
+version>; bump PDF_TEMPLATE_VERSION with the template so those URLs change too.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List
+from app.database import db
+from app.services.sop_service import pdf_path_for, PDF_COMPANY_NAME, PDF_TEMPLATE_VERSION
+from app.utils.sop_versions import version_store, DETAILS_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+# SOPs handed to the pool between checkpoints
+PDF_REGENERATION_BATCH_SIZE = int(os.getenv("PDF_REGENERATION_BATCH_SIZE", "64"))
+
+_PAGE_OBJECT = re.compile(rb"/Type\s*/Page\b(?!s)")
+
+def _render(sop_id: str, topic: str, details: str, pdf_path: str, company_name: str) -> int:
+    """Render one PDF in a pool process and return its page count"""
+    from app.utils.pdf_generator import create_pdf
+    if not create_pdf(sop_id, topic, details, company_name, pdf_path=pdf_path):
+        raise RuntimeError("PDF generation failed")
+    with open(pdf_path, "rb") as f:
+        return len(_PAGE_OBJECT.findall(f.read()))
+
+async def _render_batch(pool: ProcessPoolExecutor, sops: List[dict], company_name: str):
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*(
+        loop.run_in_executor(pool, _render, sop["sop_id"], sop["topic"], sop["details"], pdf_path_for(sop["sop_id"]), company_name)
+        for sop in sops
+    ), return_exceptions=True)
+    pages = 0
+    failed = 0
+    for sop, result in zip(sops, results):
+        if isinstance(result, Exception):
+            failed += 1
+            logger.warning(f"Could not regenerate PDF for {sop['sop_id']}: {str(result)}")
+        else:
+            pages += result
+    return len(sops) - failed, failed, pages
+
+async def run_regeneration(workers: int = None, batch_size: int = PDF_REGENERATION_BATCH_SIZE,
+                           version: str = PDF_TEMPLATE_VERSION, company_name: str = PDF_COMPANY_NAME) -> dict:
+    job = await db.pdf_jobs.find_one_and_update(
+        {"_id": version},
+        {"$set": {"status": "running"}, "$setOnInsert": {
+            "last_id": None, "rendered": 0, "failed": 0, "pages": 0, "seconds": 0.0, "started_at": datetime.utcnow()
+        }},
+        upsert=True,
+        return_document=True
+    )
+    if job.get("completed_at"):
+        return job
+
+    workers = workers or os.cpu_count() or 1
+    query = {"_id": {"$gt": job["last_id"]}} if job["last_id"] is not None else {}
+    projection = {"topic": 1, **DETAILS_PROJECTION}
+    totals = {key: job[key] for key in ("rendered", "failed", "pages", "seconds")}
+
+    async def flush(batch: List[dict]):
+        start = time.perf_counter()
+        rendered, failed, pages = await _render_batch(pool, batch, company_name)
+        elapsed = time.perf_counter() - start
+        totals["rendered"] += rendered
+        totals["failed"] += failed
+        totals["pages"] += pages
+        totals["seconds"] += elapsed
+        await db.pdf_jobs.update_one({"_id": version}, {"$set": {"last_id": batch[-1]["_id"], **totals}})
+        logger.info(
+            f"Regenerated {totals['rendered']} PDFs ({totals['failed']} failed): "
+            f"{pages / elapsed if elapsed else 0:.1f} pages/s in this batch, "
+            f"{totals['pages'] / totals['seconds'] if totals['seconds'] else 0:.1f} pages/s overall"
+        )
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batch = []
+        async for sop in db.sops.find(query, projection).sort("_id", 1).batch_size(batch_size):
+            # PDFs never downloaded are rendered with the new template on first export
+            if not os.path.exists(pdf_path_for(sop["sop_id"])):
+                continue
+            try:
+                sop["details"] = await version_store.details_of(sop)
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Could not reconstruct details of {sop['sop_id']}: {str(e)}")
+                continue
+            if not sop["details"]:
+                continue
+            batch.append(sop)
+            if len(batch) >= batch_size:
+                await flush(batch)
+                batch = []
+        if batch:
+            await flush(batch)
+
+    await db.pdf_jobs.update_one(
+        {"_id": version}, {"$set": {"status": "completed", "completed_at": datetime.utcnow()}}
+    )
+    job = await db.pdf_jobs.find_one({"_id": version}, {"last_id": 0})
+    job["pages_per_second"] = job["pages"] / job["seconds"] if job["seconds"] else 0.0
+    return job
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=None, help="pool size (default: one per core)")
+    parser.add_argument("--batch-size", type=int, default=PDF_REGENERATION_BATCH_SIZE)
+    parser.add_argument("--version", default=PDF_TEMPLATE_VERSION, help="template version the run is checkpointed under")
+    parser.add_argument("--company-name", default=PDF_COMPANY_NAME)
+    args = parser.parse_args()
+    job = asyncio.run(run_regeneration(args.workers, args.batch_size, args.version, args.company_name))
+    print(
+        f"Template {job['_id']}: {job['rendered']} PDFs, {job['failed']} failed, "
+        f"{job['pages']} pages at {job['pages'] / job['seconds'] if job['seconds'] else 0:.1f} pages/s"
+    )
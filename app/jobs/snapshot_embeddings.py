@@ -0,0 +1,23 @@
+"""Write a fresh shared embedding snapshot (and ANN graph for large libraries).
+
+    python -m app.jobs.snapshot_embeddings
+
+Run after a deploy or a bulk import so worker startup maps the snapshot instead
+of scanning db.embeddings. Running workers switch to it on their next check.
+"""
+import asyncio
+import logging
+from app.utils.embedding_index import EmbeddingIndex
+from app.utils.embedding_snapshot import refresh_snapshot
+
+logger = logging.getLogger(__name__)
+
+async def run_snapshot():
+    index = EmbeddingIndex()
+    manifest = await refresh_snapshot(index)
+    if manifest is None:
+        logger.info("Nothing written: another process holds the snapshot lock or there are no embeddings")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_snapshot())
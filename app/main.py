@@ -1,12 +1,21 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from app.routes.sop_routes import router as sop_router
+from app.routes.admin_routes import router as admin_router
+from app.database import ensure_indexes
+from app.utils.embedding_index import embedding_index
+from app.utils.embedding_snapshot import index_maintenance_loop, SNAPSHOT_INTERVAL
+from app.utils.metrics import registry, REQUEST_SECONDS, start_request_timings, format_server_timing
+from app.utils.profiling import should_profile, start_profile, finish_profile
+from app.utils.mongo_monitoring import start_query_tracking, report_query_patterns
+from app.utils.compression import SelectiveGZipMiddleware
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import asyncio
 import time
 import logging
-from typing import Callable
 import os
 from dotenv import load_dotenv
 
@@ -38,29 +47,117 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.add_middleware(GZipMiddleware, minimum_size=1000)
+# Skips PDFs and other already-compressed responses
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=1000)
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=["*"])
 
-# Request timing middleware
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next: Callable):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
-
-# Error handling middleware
-@app.middleware("http")
-async def error_handling_middleware(request: Request, call_next: Callable):
-    try:
-        return await call_next(request)
-    except Exception as e:
-        logger.error(f"Error processing request: {str(e)}")
-        return JSONResponse(
-            status_code=500,
-            content={"detail": "Internal server error"}
-        )
+# The middlewares below are plain ASGI rather than @app.middleware("http"): BaseHTTPMiddleware
+# wraps receive, which hides the client's http.disconnect from request.is_disconnected()
+
+def _route_path(scope: Scope, default: str) -> str:
+    # The router records the matched route in the shared scope
+    return getattr(scope.get("route"), "path", default)
+
+class RequestTimingMiddleware:
+    """Process-time and Server-Timing headers, the request latency histogram and the query report"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = start_request_timings()
+        queries = start_query_tracking()
+        start_time = time.time()
+        status_code = 500
+
+        async def send_with_timing(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                process_time = time.time() - start_time
+                headers = MutableHeaders(scope=message)
+                headers["X-Process-Time"] = str(process_time)
+                headers["Server-Timing"] = format_server_timing(timings, process_time)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            # Label by route template rather than raw path to keep label cardinality bounded
+            route = _route_path(scope, "unmatched")
+            REQUEST_SECONDS.observe(time.time() - start_time, method=scope["method"], route=route, status=status_code)
+            report_query_patterns(queries, route)
+
+class ProfilingMiddleware:
+    """Opt-in request profiling: admin header or random sampling"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not should_profile(Request(scope)):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = start_profile()
+        if profiler is None:
+            # Another request is already being profiled
+            await self.app(scope, receive, send)
+            return
+
+        profile_name = None
+
+        async def send_with_profile(message: Message):
+            nonlocal profile_name
+            # The profile covers the work up to the response headers, which carry its id
+            if message["type"] == "http.response.start":
+                profile_name = await finish_profile(profiler, _route_path(scope, scope["path"]))
+                MutableHeaders(scope=message)["X-Profile-Id"] = profile_name
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            if profile_name is None:
+                await finish_profile(profiler, _route_path(scope, scope["path"]))
+
+class ErrorHandlingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def send_tracking(message: Message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_tracking)
+        except Exception as e:
+            logger.error(f"Error processing request: {str(e)}")
+            if response_started:
+                raise
+            response = JSONResponse(
+                status_code=500,
+                content={"detail": "Internal server error"}
+            )
+            await response(scope, receive, send)
+
+# Added innermost first: errors wrap profiling, which wraps timing
+app.add_middleware(RequestTimingMiddleware)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(ErrorHandlingMiddleware)
 
 # Health check endpoint
 @app.get("/health")
@@ -71,8 +168,14 @@ async def health_check():
         "version": "1.4.0"
     }
 
+# Prometheus metrics endpoint
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 # Include routers
 app.include_router(sop_router, prefix="/api")
+app.include_router(admin_router, prefix="/api")
 
 # Root endpoint
 @app.get("/")
@@ -88,9 +191,18 @@ async def home():
 async def startup_event():
     logger.info("Starting up SOP Generator API")
     # Add any startup tasks here (e.g., database connection)
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        logger.error(f"Could not create database indexes: {str(e)}")
+    if SNAPSHOT_INTERVAL > 0:
+        app.state.index_maintenance_task = asyncio.create_task(index_maintenance_loop(embedding_index))
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down SOP Generator API")
     # Add any cleanup tasks here
+    index_maintenance_task = getattr(app.state, "index_maintenance_task", None)
+    if index_maintenance_task:
+        index_maintenance_task.cancel()
@@ -1,7 +1,19 @@
 from pydantic import BaseModel
 from typing import List
+from app.utils.vector_codec import encode_vector
+from app.utils.embedding_models import LEGACY_EMBEDDING_MODEL
 
 class Embedding(BaseModel):
     sop_id: str
     topic_embedding: List[float]
-    summary_embedding: List[float] 
\ No newline at end of file
+    summary_embedding: List[float]
+    model: str = LEGACY_EMBEDDING_MODEL
+
+    def to_document(self) -> dict:
+        # Vectors are stored as float32 binary rather than arrays of doubles
+        return {
+            "sop_id": self.sop_id,
+            "topic_embedding": encode_vector(self.topic_embedding),
+            "summary_embedding": encode_vector(self.summary_embedding),
+            "model": self.model
+        }
@@ -29,8 +29,6 @@ class Task(BaseModel):
 class EditedSOPDetails(BaseModel):
     new_sop_id: str
     old_sop_id: str
-    original_details: str
-    edited_details: str
     pdf_url: str
     created_at: datetime
     effectiveness_score: float
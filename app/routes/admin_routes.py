@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from app.utils.admin_auth import require_admin
+from app.utils.profiling import list_profiles, profile_path
+from app.jobs.reembed import start_reembed_job, get_reembed_job
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.get("/admin/profiles")
+async def list_profiles_endpoint():
+    return list_profiles()
+
+@router.get("/admin/profiles/{name}")
+async def download_profile_endpoint(name: str):
+    try:
+        path = profile_path(name)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return FileResponse(path, media_type="application/octet-stream", filename=name)
+
+@router.post("/admin/reembed/{model}")
+async def start_reembed_endpoint(model: str):
+    started = start_reembed_job(model)
+    return {"model": model, "started": started}
+
+@router.get("/admin/reembed/{model}")
+async def reembed_status_endpoint(model: str):
+    job = await get_reembed_job(model)
+    if not job:
+        raise HTTPException(status_code=404, detail="No re-embedding job for this model")
+    return job
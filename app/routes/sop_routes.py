@@ -1,16 +1,29 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+import asyncio
+from fastapi import APIRouter, HTTPException, Query, Request, UploadFile, File
+from fastapi.responses import ORJSONResponse
 from app.services.sop_service import (
-    create_sop, get_sop_pdf, get_sop_summary, create_sop_direct,
-    create_task, get_task, get_all_tasks, update_task_status, get_sop_details,
-    edit_sop_details, calculate_effectiveness_score, update_effectiveness_score,get_effectiveness_score_by_sop_id
+    create_sop, get_sop_pdf, get_sop_preview, get_sop_summary, create_sop_direct,
+    create_task, get_task, get_all_tasks, get_all_sop_documents, update_task_status, get_sop_details,
+    edit_sop_details, calculate_effectiveness_score, update_effectiveness_score,get_effectiveness_score_by_sop_id,
+    get_task_status_counts, get_task_counts_by_sop, get_task_counts_by_day, TaskTransitionError,
+    pdf_download_url, PDF_TEMPLATE_VERSION
 )
-from app.utils.openai_embeddings import get_embedding
-from app.utils.similarity_search import find_similar_sops
+from app.services.bulk_service import (
+    parse_bulk_rows, create_bulk_job, start_bulk_job, resume_bulk_job, get_bulk_job_progress,
+    BULK_GENERATION_CONCURRENCY
+)
+from app.utils.openai_embeddings import get_embedding, get_embeddings
+from app.utils.embedding_index import embedding_index, SimilarityFilters
+from app.utils.keyword_index import keyword_index, reciprocal_rank_fusion
+from app.utils.request_deadline import run_cancellable, RequestCancelled, GENERATE_SOP_DEADLINE_SECONDS
+from app.utils.ann_index import measure_recall
+from app.utils.similarity_search import fetch_sop_metadata
+from app.utils.response_cache import response_cache, etag_response, make_etag
+from app.utils.file_responses import cacheable_file_response, IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL
 from app.models.sop import Task
 from pydantic import BaseModel
-import os
-from typing import Optional
+from datetime import datetime
+from typing import List, Optional
 from app.database import db
 
 router = APIRouter()
@@ -23,11 +36,33 @@ class SimilarityResponse(BaseModel):
     sop_id: str
     similarity_score: float
     is_existing: bool
+    topic: Optional[str] = None
+    version: int = 1
+    effectiveness_score: Optional[float] = None
+    created_at: Optional[datetime] = None
+    # Component scores of a hybrid search; similarity_score is then the fused RRF score
+    vector_score: Optional[float] = None
+    lexical_score: Optional[float] = None
 
 class SimilarityRequest(BaseModel):
     topic: str
     description: str
 
+class BatchSimilarityRequest(BaseModel):
+    queries: List[SimilarityRequest]
+    threshold: float = 0.6
+    limit: int = 10
+    include_superseded: bool = False
+    min_effectiveness_score: Optional[float] = None
+    created_after: Optional[datetime] = None
+
+class BatchSimilarityResponse(BaseModel):
+    topic: str
+    results: List[SimilarityResponse]
+
+# Largest number of queries accepted by one batch similarity request
+MAX_BATCH_QUERIES = 1000
+
 class TaskCreateRequest(BaseModel):
     sop_id: str
     topic: str
@@ -38,66 +73,209 @@ class TaskStatusUpdateRequest(BaseModel):
 class EditSOPDetailsRequest(BaseModel):
     edited_details: str
 
+def _cancelled_error(e: RequestCancelled) -> HTTPException:
+    # 499 (client closed request) is only seen in logs and metrics; the client is gone
+    if e.reason == "deadline":
+        return HTTPException(status_code=504, detail="SOP generation exceeded its deadline")
+    return HTTPException(status_code=499, detail="Client closed request")
+
 @router.post("/generate_sop")
-async def generate_sop_endpoint(sop_request: SOPRequest):
+async def generate_sop_endpoint(sop_request: SOPRequest, request: Request):
     try:
-        response = await create_sop(sop_request.topic, sop_request.description)
+        response = await run_cancellable(
+            request, create_sop(sop_request.topic, sop_request.description),
+            "/generate_sop", GENERATE_SOP_DEADLINE_SECONDS
+        )
         return response
+    except RequestCancelled as e:
+        raise _cancelled_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 @router.post("/generate_sop_direct")
-async def generate_sop_direct_endpoint(sop_request: SOPRequest):
+async def generate_sop_direct_endpoint(sop_request: SOPRequest, request: Request):
     try:
-        response = await create_sop_direct(sop_request.topic, sop_request.description)
+        response = await run_cancellable(
+            request, create_sop_direct(sop_request.topic, sop_request.description),
+            "/generate_sop_direct", GENERATE_SOP_DEADLINE_SECONDS
+        )
         return response
+    except RequestCancelled as e:
+        raise _cancelled_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/sop/bulk")
+async def bulk_generate_endpoint(file: UploadFile = File(...), concurrency: int = Query(BULK_GENERATION_CONCURRENCY, ge=1, le=64)):
+    try:
+        content = (await file.read()).decode("utf-8-sig")
+        rows = parse_bulk_rows(content, file.filename or "")
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        job_id = await create_bulk_job(rows)
+        start_bulk_job(job_id, concurrency)
+        return {"job_id": job_id, "rows": len(rows)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/sop/bulk/{job_id}")
+async def bulk_job_progress_endpoint(job_id: str):
+    progress = await get_bulk_job_progress(job_id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="Bulk job not found")
+    return progress
+
+@router.post("/sop/bulk/{job_id}/resume")
+async def resume_bulk_job_endpoint(job_id: str, concurrency: int = Query(BULK_GENERATION_CONCURRENCY, ge=1, le=64)):
+    if not await get_bulk_job_progress(job_id):
+        raise HTTPException(status_code=404, detail="Bulk job not found")
+    started = await resume_bulk_job(job_id, concurrency)
+    return {"job_id": job_id, "resumed": started}
+
 @router.get("/sop/{sop_id}/pdf")
-async def get_pdf(sop_id: str):
+async def get_pdf(sop_id: str, request: Request, v: Optional[str] = None):
     try:
         pdf_path = await get_sop_pdf(sop_id)
-        if not os.path.exists(pdf_path):
-            raise HTTPException(status_code=404, detail="PDF not found")
-        
-        headers = {
-            "Content-Disposition": f"inline; filename=sop_{sop_id}.pdf"
-        }
-        return FileResponse(
-            pdf_path, 
-            media_type="application/pdf", 
-            filename=f"sop_{sop_id}.pdf",
-            headers=headers
-        )
+        # Regeneration replaces the file in place, so only URLs naming the template version are immutable
+        cache_control = IMMUTABLE_CACHE_CONTROL if v == PDF_TEMPLATE_VERSION else REVALIDATE_CACHE_CONTROL
+        return cacheable_file_response(request, pdf_path, "application/pdf", f"sop_{sop_id}.pdf", cache_control)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Preview formats and their media types
+PREVIEW_MEDIA_TYPES = {"html": "text/html", "markdown": "text/markdown"}
+
+@router.get("/sop/{sop_id}/preview")
+async def get_preview(sop_id: str, request: Request, format: str = "html"):
+    if format not in PREVIEW_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(PREVIEW_MEDIA_TYPES)}")
+    try:
+        body = (await get_sop_preview(sop_id, format)).encode("utf-8")
+        return etag_response(request, body, make_etag(body), f"{PREVIEW_MEDIA_TYPES[format]}; charset=utf-8")
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/sop/{sop_id}/summary")
-async def get_summary(sop_id: str):
+async def get_summary(sop_id: str, request: Request):
     try:
-        summary = await get_sop_summary(sop_id)
-        return {"summary": summary}
+        async def load():
+            return {"summary": await get_sop_summary(sop_id)}
+        body, etag = await response_cache.get_or_load("summary", sop_id, load)
+        return etag_response(request, body, etag)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/sop/similar")
-async def find_similar_sops_endpoint(request: SimilarityRequest, threshold: float = 0.6):
+# Candidates taken from each ranking before a hybrid search fuses them
+HYBRID_CANDIDATES = 50
+SIMILARITY_MODES = ("vector", "lexical", "hybrid")
+
+@router.post("/sop/similar", response_model=List[SimilarityResponse])
+async def find_similar_sops_endpoint(request: SimilarityRequest, threshold: float = 0.6, limit: int = Query(10, ge=1, le=100),
+                                     mode: str = "vector", include_superseded: bool = False,
+                                     min_effectiveness_score: Optional[float] = None, created_after: Optional[datetime] = None):
+    """vector: embedding similarity; lexical: BM25 keyword match with no embedding call
+    (scores are BM25, threshold is not applied); hybrid: both fused with reciprocal-rank fusion.
+
+    Versions superseded by an edit are left out unless include_superseded is set.
+    """
+    if mode not in SIMILARITY_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(SIMILARITY_MODES)}")
+    filters = SimilarityFilters(not include_superseded, min_effectiveness_score, created_after)
     try:
-        topic_embedding = get_embedding(request.topic)
-        description_embedding = get_embedding(request.description)
+        component_scores = {}
+        if mode == "lexical":
+            await keyword_index.ensure_loaded()
+            await embedding_index.ensure_loaded()
+            similar_sops = _filter_lexical(keyword_index.search(f"{request.topic} {request.description}", None), filters, limit)
+        else:
+            # Queries are embedded with the model the loaded index was built from
+            await embedding_index.ensure_loaded()
+            topic_embedding = await get_embedding(request.topic, model=embedding_index.model)
+            description_embedding = await get_embedding(request.description, model=embedding_index.model)
+            
+            if mode == "vector":
+                similar_sops = embedding_index.search(topic_embedding, description_embedding, threshold, limit, filters)
+            else:
+                await keyword_index.ensure_loaded()
+                vector_results = embedding_index.search(topic_embedding, description_embedding, threshold, HYBRID_CANDIDATES, filters)
+                lexical_results = _filter_lexical(
+                    keyword_index.search(f"{request.topic} {request.description}", None), filters, HYBRID_CANDIDATES
+                )
+                similar_sops = reciprocal_rank_fusion(
+                    [sop_id for sop_id, _ in vector_results], [sop_id for sop_id, _ in lexical_results]
+                )[:limit]
+                for key, results in (("vector_score", vector_results), ("lexical_score", lexical_results)):
+                    for sop_id, score in results:
+                        component_scores.setdefault(sop_id, {})[key] = score
         
-        similar_sops = await find_similar_sops(topic_embedding, description_embedding, threshold)
+        # Join the display fields in one bulk query instead of one request per result
+        metadata = await fetch_sop_metadata([sop_id for sop_id, _ in similar_sops])
         
-        response = []
-        for sop_id, similarity in similar_sops:
-            response.append({
-                "sop_id": sop_id,
-                "similarity_score": similarity,
-                "is_existing": True
-            })
+        return _similarity_results(similar_sops, metadata, component_scores)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _filter_lexical(results, filters: SimilarityFilters, limit: int) -> list:
+    # The keyword index holds no metadata, so its ranking is filtered with the embedding index's
+    allowed = set(embedding_index.allowed([sop_id for sop_id, _ in results], filters))
+    return [(sop_id, score) for sop_id, score in results if sop_id in allowed][:limit]
+
+@router.post("/sop/similar/batch", response_model=List[BatchSimilarityResponse])
+async def find_similar_sops_batch_endpoint(request: BatchSimilarityRequest):
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    if not 1 <= request.limit <= 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+    try:
+        # Embed every topic and description in bulk rather than two API calls per query
+        texts = [query.topic for query in request.queries] + [query.description for query in request.queries]
+        await embedding_index.ensure_loaded()
+        embeddings = await get_embeddings(texts, model=embedding_index.model)
+        count = len(request.queries)
         
-        return response
+        filters = SimilarityFilters(not request.include_superseded, request.min_effectiveness_score, request.created_after)
+        batch_results = embedding_index.search_batch(
+            embeddings[:count], embeddings[count:], request.threshold, request.limit, filters
+        )
+        
+        metadata = await fetch_sop_metadata({sop_id for results in batch_results for sop_id, _ in results})
+        
+        return [
+            {"topic": query.topic, "results": _similarity_results(results, metadata)}
+            for query, results in zip(request.queries, batch_results)
+        ]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _similarity_results(similar_sops, metadata: dict, component_scores: Optional[dict] = None) -> list:
+    response = []
+    for sop_id, similarity in similar_sops:
+        doc = metadata.get(sop_id, {})
+        response.append({
+            **(component_scores or {}).get(sop_id, {}),
+            "sop_id": sop_id,
+            "similarity_score": similarity,
+            "is_existing": True,
+            "topic": doc.get("topic"),
+            "version": doc.get("version", 1),
+            "effectiveness_score": doc.get("effectiveness_score"),
+            "created_at": doc.get("created_at")
+        })
+    return response
+
+@router.get("/sop/index/recall")
+async def get_ann_recall(k: int = 10, sample: int = 100, ef_search: Optional[int] = None):
+    try:
+        await embedding_index.ensure_loaded()
+        # Hundreds of exact and graph searches; run them off the event loop
+        return await asyncio.to_thread(measure_recall, embedding_index, k, sample, ef_search)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -113,6 +291,28 @@ async def create_task_endpoint(task_request: TaskCreateRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Registered before /tasks/{task_id} so "stats" is not taken for a task id
+@router.get("/tasks/stats")
+async def get_task_stats_endpoint():
+    try:
+        return await get_task_status_counts()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/tasks/stats/by_sop")
+async def get_task_stats_by_sop_endpoint(status: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)):
+    try:
+        return await get_task_counts_by_sop(status, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/tasks/stats/by_day")
+async def get_task_stats_by_day_endpoint(days: int = Query(30, ge=1, le=366), status: Optional[str] = None):
+    try:
+        return await get_task_counts_by_day(days, status)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/tasks/{task_id}", response_model=Task)
 async def get_task_endpoint(task_id: str):
     task = await get_task(task_id)
@@ -120,75 +320,91 @@ async def get_task_endpoint(task_id: str):
         raise HTTPException(status_code=404, detail="Task not found")
     return task
 
+# Rows are projected to Task's fields and serialised with orjson, skipping per-row validation
 @router.get("/tasks", response_model=list[Task])
 async def get_all_tasks_endpoint():
-    return await get_all_tasks()
+    return ORJSONResponse(await get_all_tasks())
 
 @router.patch("/tasks/{task_id}/status", response_model=Task)
 async def update_task_status_endpoint(task_id: str, status_request: TaskStatusUpdateRequest):
-    task = await update_task_status(task_id, status_request.status)
+    try:
+        task = await update_task_status(task_id, status_request.status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except TaskTransitionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     return task
 
 @router.get("/sop/{sop_id}/details")
-async def get_sop_details_endpoint(sop_id: str):
+async def get_sop_details_endpoint(sop_id: str, request: Request):
     try:
-        details = await get_sop_details(sop_id)
-        return details
+        body, etag = await response_cache.get_or_load("details", sop_id, lambda: get_sop_details(sop_id))
+        return etag_response(request, body, etag)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/sop/{sop_id}/version_history")
-async def get_sop_version_history(sop_id: str):
+async def get_sop_version_history(sop_id: str, request: Request):
     try:
-        # Get the original SOP document
-        original_sop = await db.sops.find_one({"sop_id": sop_id})
-        if not original_sop:
-            raise ValueError("SOP not found")
-        
-        # Get all versions of this SOP
-        versions = []
-        
-        # Get the original version
-        original_doc = await db.sop_documents.find_one({"sop_id": sop_id})
-        if original_doc:
-            versions.append({
-                "sop_id": original_doc["sop_id"],
-                "version": original_doc.get("version", 1),
-                "created_at": original_doc["created_at"],
-                "effectiveness_score": original_doc.get("effectiveness_score"),
-                "pdf_url": original_doc["pdf_url"]
-            })
-        
-        # Get edited versions
-        edited_versions = await db.edited_sop_details.find({"old_sop_id": sop_id}).to_list(None)
-        for edited in edited_versions:
-            new_sop = await db.sop_documents.find_one({"sop_id": edited["new_sop_id"]})
-            if new_sop:
-                versions.append({
-                    "sop_id": new_sop["sop_id"],
-                    "version": new_sop.get("version", 1),
-                    "created_at": new_sop["created_at"],
-                    "effectiveness_score": new_sop.get("effectiveness_score"),
-                    "pdf_url": new_sop["pdf_url"]
-                })
-        
-        # Sort versions by version number
-        versions.sort(key=lambda x: x["version"])
-        
-        return {
-            "topic": original_sop["topic"],
-            "description": original_sop["description"],
-            "versions": versions
-        }
+        # The history lists every version's score, so editing or scoring any of them invalidates it
+        body, etag = await response_cache.get_or_load(
+            "version_history", sop_id, lambda: _load_version_history(sop_id),
+            depends_on=lambda history: [version["sop_id"] for version in history["versions"]]
+        )
+        return etag_response(request, body, etag)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _load_version_history(sop_id: str) -> dict:
+    # Get the original SOP document
+    original_sop = await db.sops.find_one({"sop_id": sop_id})
+    if not original_sop:
+        raise ValueError("SOP not found")
+    
+    # Get all versions of this SOP
+    versions = []
+    
+    # Get the original version
+    original_doc = await db.sop_documents.find_one({"sop_id": sop_id})
+    if original_doc:
+        versions.append({
+            "sop_id": original_doc["sop_id"],
+            "version": original_doc.get("version", 1),
+            "created_at": original_doc["created_at"],
+            "effectiveness_score": original_doc.get("effectiveness_score"),
+            "pdf_url": original_doc["pdf_url"],
+            "download_url": pdf_download_url(original_doc["sop_id"])
+        })
+    
+    # Get edited versions
+    edited_versions = await db.edited_sop_details.find({"old_sop_id": sop_id}).to_list(None)
+    for edited in edited_versions:
+        new_sop = await db.sop_documents.find_one({"sop_id": edited["new_sop_id"]})
+        if new_sop:
+            versions.append({
+                "sop_id": new_sop["sop_id"],
+                "version": new_sop.get("version", 1),
+                "created_at": new_sop["created_at"],
+                "effectiveness_score": new_sop.get("effectiveness_score"),
+                "pdf_url": new_sop["pdf_url"],
+                "download_url": pdf_download_url(new_sop["sop_id"])
+            })
+    
+    # Sort versions by version number
+    versions.sort(key=lambda x: x["version"])
+    
+    return {
+        "topic": original_sop["topic"],
+        "description": original_sop["description"],
+        "versions": versions
+    }
+
 @router.patch("/sop/{sop_id}/edit")
 async def edit_sop_details_endpoint(sop_id: str, edit_request: EditSOPDetailsRequest):
     try:
@@ -221,29 +437,20 @@ async def update_effectiveness_score_endpoint(sop_id: str):
     
 
 @router.get("/sop/{sop_id}/direct_effectiveness_score")
-async def get_direct_effectiveness_score(sop_id: str):
+async def get_direct_effectiveness_score(sop_id: str, request: Request):
     try:
-        result = await get_effectiveness_score_by_sop_id(sop_id)
-        return result
+        body, etag = await response_cache.get_or_load(
+            "direct_effectiveness_score", sop_id, lambda: get_effectiveness_score_by_sop_id(sop_id)
+        )
+        return etag_response(request, body, etag)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/sop_documents")
-async def get_all_sop_documents():
-    try:
-        # Get all SOP documents
-        sop_documents = []
-        async for doc in db.sop_documents.find():
-            sop_documents.append({
-                "sop_id": doc["sop_id"],
-                "topic": doc["topic"],
-                "created_at": doc["created_at"],
-                "version": doc.get("version", 1),
-                "effectiveness_score": doc.get("effectiveness_score")
-            })
-        
-        return sop_documents
+async def get_all_sop_documents_endpoint():
+    try:
+        return ORJSONResponse(await get_all_sop_documents())
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,237 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from pymongo import ReturnDocument, UpdateOne
+from app.database import db
+from app.services.sop_service import pdf_path_for, store_generated_sops
+from app.utils.openai_helper import generate_sop
+from app.utils.openai_embeddings import get_embeddings
+from app.utils.openai_scheduler import BULK
+
+logger = logging.getLogger(__name__)
+
+# Rows generated at the same time within one job
+BULK_GENERATION_CONCURRENCY = int(os.getenv("BULK_GENERATION_CONCURRENCY", "8"))
+# Generated rows embedded and written together
+BULK_GENERATION_BATCH_SIZE = int(os.getenv("BULK_GENERATION_BATCH_SIZE", "20"))
+
+# How long a claimed row stays reserved for its worker; rows whose lease ran out (a crashed worker) are claimed again
+BULK_ROW_LEASE_SECONDS = int(os.getenv("BULK_ROW_LEASE_SECONDS", "900"))
+# A running job extends the leases of its rows this often, however long they wait for the scheduler
+BULK_LEASE_RENEW_SECONDS = BULK_ROW_LEASE_SECONDS / 3
+
+# Jobs running in this process, kept referenced so they are not garbage collected
+_running_jobs = {}
+# Owner recorded on the rows this process claims
+_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _expired_lease(now: datetime) -> dict:
+    # Rows claimed before leases existed have no expiry and count as expired
+    return {"$or": [{"lease_expires_at": {"$exists": False}}, {"lease_expires_at": {"$lt": now}}]}
+
+def parse_bulk_rows(content: str, filename: str = "") -> List[dict]:
+    """Read topic/description rows from CSV (with a header) or JSON Lines"""
+    stripped = content.lstrip()
+    if filename.endswith(".jsonl") or (not filename.endswith(".csv") and stripped.startswith("{")):
+        records = [json.loads(line) for line in content.splitlines() if line.strip()]
+    else:
+        records = list(csv.DictReader(io.StringIO(content)))
+
+    rows = []
+    for number, record in enumerate(records, start=1):
+        topic = (record.get("topic") or "").strip()
+        description = (record.get("description") or "").strip()
+        if not topic or not description:
+            raise ValueError(f"Row {number} needs both a topic and a description")
+        rows.append({"topic": topic, "description": description})
+    if not rows:
+        raise ValueError("No rows found")
+    return rows
+
+async def create_bulk_job(rows: List[dict]) -> str:
+    """Record one pending task per row; SOP ids are assigned now so a resumed job never duplicates a row"""
+    job_id = str(uuid.uuid4())
+    created_at = datetime.utcnow()
+    await db.tasks.insert_many([{
+        "id": str(uuid.uuid4()),
+        "job_id": job_id,
+        "row": number,
+        "sop_id": str(uuid.uuid4()),
+        "topic": row["topic"],
+        "description": row["description"],
+        "created_at": created_at,
+        "status": "pending"
+    } for number, row in enumerate(rows)])
+    return job_id
+
+def start_bulk_job(job_id: str, concurrency: int = BULK_GENERATION_CONCURRENCY) -> bool:
+    """Run a job in the background of this process; False if it is already running here"""
+    if job_id in _running_jobs:
+        return False
+    task = asyncio.create_task(run_bulk_job(job_id, concurrency))
+    _running_jobs[job_id] = task
+    task.add_done_callback(lambda _: _running_jobs.pop(job_id, None))
+    return True
+
+async def resume_bulk_job(job_id: str, concurrency: int = BULK_GENERATION_CONCURRENCY) -> bool:
+    """Requeue failed rows and rows abandoned by a dead worker and start the job again.
+
+    Rows still leased by a worker in another process are left alone, so resuming
+    from any API worker never generates a row twice.
+    """
+    if job_id in _running_jobs:
+        return False
+    await requeue_bulk_job(job_id)
+    return start_bulk_job(job_id, concurrency)
+
+async def requeue_bulk_job(job_id: str):
+    result = await db.tasks.update_many(
+        {"job_id": job_id, "$or": [
+            {"status": "failed"},
+            {"status": "in_progress", **_expired_lease(_now())}
+        ]},
+        {"$set": {"status": "pending"}, "$unset": {"error": "", "owner": "", "lease_expires_at": ""}}
+    )
+    logger.info(f"Requeued {result.modified_count} rows of bulk job {job_id}")
+
+async def _mark_stored_rows_completed(job_id: str):
+    # Rows whose SOP was written just before a crash are finished, not regenerated. Embeddings are
+    # written last, so a row without them was interrupted part way and is generated and written again.
+    unfinished = await db.tasks.find(
+        {"job_id": job_id, "status": {"$ne": "completed"}}, {"_id": 0, "sop_id": 1}
+    ).to_list(None)
+    stored = await db.embeddings.distinct("sop_id", {"sop_id": {"$in": [task["sop_id"] for task in unfinished]}})
+    if stored:
+        await db.tasks.update_many(
+            {"job_id": job_id, "sop_id": {"$in": stored}},
+            {"$set": {"status": "completed"}, "$unset": {"error": ""}}
+        )
+
+async def _renew_leases(job_id: str):
+    """Keep this worker's rows of the job leased while it is alive; a crashed worker's leases run out"""
+    while True:
+        await asyncio.sleep(BULK_LEASE_RENEW_SECONDS)
+        await db.tasks.update_many(
+            {"job_id": job_id, "status": "in_progress", "owner": _WORKER_ID},
+            {"$set": {"lease_expires_at": _now() + timedelta(seconds=BULK_ROW_LEASE_SECONDS)}}
+        )
+
+async def run_bulk_job(job_id: str, concurrency: int = BULK_GENERATION_CONCURRENCY):
+    await _mark_stored_rows_completed(job_id)
+
+    generated = []
+    write_lock = asyncio.Lock()
+
+    async def flush():
+        async with write_lock:
+            batch = generated[:]
+            del generated[:]
+            if not batch:
+                return
+            try:
+                # One embeddings request and one insert per collection for the whole batch
+                embeddings = await get_embeddings(
+                    [sop["topic"] for sop in batch] + [sop["summary"] for sop in batch],
+                    priority=BULK
+                )
+                for i, sop in enumerate(batch):
+                    sop["topic_embedding"] = embeddings[i]
+                    sop["summary_embedding"] = embeddings[len(batch) + i]
+                await store_generated_sops(batch)
+                await db.tasks.bulk_write([
+                    UpdateOne({"id": sop["task_id"]}, {"$set": {"status": "completed"}})
+                    for sop in batch
+                ])
+            except Exception as e:
+                logger.error(f"Bulk job {job_id}: failed to store {len(batch)} rows: {str(e)}")
+                await db.tasks.update_many(
+                    {"id": {"$in": [sop["task_id"] for sop in batch]}, "owner": _WORKER_ID},
+                    {"$set": {"status": "failed", "error": str(e)}}
+                )
+
+    async def worker():
+        while True:
+            # Claim a row atomically: pending, or abandoned by a worker whose lease ran out
+            now = _now()
+            task = await db.tasks.find_one_and_update(
+                {"job_id": job_id, "$or": [
+                    {"status": "pending"},
+                    {"status": "in_progress", "lease_expires_at": {"$lt": now}}
+                ]},
+                {"$set": {
+                    "status": "in_progress",
+                    "owner": _WORKER_ID,
+                    "lease_expires_at": now + timedelta(seconds=BULK_ROW_LEASE_SECONDS)
+                }},
+                sort=[("row", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if task is None:
+                return
+            try:
+                sop_data = await generate_sop(task["topic"], task["description"], priority=BULK)
+                if not isinstance(sop_data, dict) or "details" not in sop_data or "summary" not in sop_data:
+                    raise ValueError("Invalid SOP response from OpenAI")
+            except Exception as e:
+                logger.warning(f"Bulk job {job_id}: row {task['row']} failed: {str(e)}")
+                await db.tasks.update_one(
+                    {"id": task["id"], "owner": _WORKER_ID}, {"$set": {"status": "failed", "error": str(e)}}
+                )
+                continue
+
+            generated.append({
+                "task_id": task["id"],
+                "sop_id": task["sop_id"],
+                "topic": task["topic"],
+                "description": task["description"],
+                "details": sop_data["details"],
+                "summary": sop_data["summary"],
+                # Rendered on first download
+                "pdf_url": pdf_path_for(task["sop_id"])
+            })
+            if len(generated) >= BULK_GENERATION_BATCH_SIZE:
+                await flush()
+
+    renewal = asyncio.create_task(_renew_leases(job_id))
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        await flush()
+    finally:
+        renewal.cancel()
+    logger.info(f"Bulk job {job_id} finished: {await get_bulk_job_progress(job_id)}")
+
+async def get_bulk_job_progress(job_id: str) -> Optional[dict]:
+    counts = {}
+    async for group in db.tasks.aggregate([
+        {"$match": {"job_id": job_id}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]):
+        counts[group["_id"]] = group["count"]
+    if not counts:
+        return None
+
+    failures = await db.tasks.find(
+        {"job_id": job_id, "status": "failed"},
+        {"_id": 0, "row": 1, "topic": 1, "error": 1}
+    ).sort("row", 1).to_list(100)
+
+    return {
+        "job_id": job_id,
+        "total": sum(counts.values()),
+        "status_counts": counts,
+        # Running anywhere: some row is still leased by a live worker
+        "running": job_id in _running_jobs or await db.tasks.count_documents(
+            {"job_id": job_id, "status": "in_progress", "lease_expires_at": {"$gt": _now()}}, limit=1
+        ) > 0,
+        "failures": failures
+    }
@@ -1,29 +1,108 @@
 from app.utils.openai_helper import generate_sop
-from app.utils.pdf_generator import create_pdf
-from app.utils.openai_embeddings import get_embedding
-from app.utils.similarity_search import find_similar_sops
+from app.utils.openai_embeddings import get_embedding, get_embeddings
+from app.utils.openai_scheduler import BULK
+from app.utils.embedding_models import active_embedding_model, backfill_embedding_models
+from app.utils.similarity_search import find_similar_sops, cosine_similarities
+from app.utils.embedding_index import embedding_index
+from app.utils.keyword_index import keyword_index
+from app.utils.metrics import track_stage, record_cache
+from app.utils.response_cache import response_cache
+from app.utils.sop_markdown import render_preview_html, render_preview_markdown
+from app.utils.sop_versions import version_store, version_fields, DETAILS_PROJECTION
 from app.database import db
 from app.models.embedding import Embedding
 from app.models.sop import Task, SOPDocument, EditedSOPDetails
+import asyncio
+import logging
 import uuid
+from pymongo import ReplaceOne
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 from typing import List, Optional
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 import re
 from difflib import SequenceMatcher
 
+logger = logging.getLogger(__name__)
+
 # Get Sri Lankan timezone
 sri_lanka_tz = pytz.timezone('Asia/Colombo')
 
 def get_sri_lankan_time():
     return datetime.now(sri_lanka_tz)
 
+PDF_DIRECTORY = "pdfs"
+PDF_COMPANY_NAME = os.getenv("PDF_COMPANY_NAME", "Your Company")
+# Bump together with template or branding changes; versioned PDF URLs may be cached forever
+PDF_TEMPLATE_VERSION = os.getenv("PDF_TEMPLATE_VERSION", "1")
+
+# Weighted cosine, without version boosts, at or above which create_sop returns the stored SOP instead of generating
+SOP_REUSE_THRESHOLD = float(os.getenv("SOP_REUSE_THRESHOLD", "0.9"))
+
+# PDF renders in progress in this process, so concurrent downloads share one
+_pdf_renders = {}
+
+def pdf_path_for(sop_id: str) -> str:
+    return os.path.join(PDF_DIRECTORY, f"{sop_id}.pdf")
+
+def pdf_download_url(sop_id: str) -> str:
+    """Download URL naming the template version, which clients may cache forever"""
+    return f"/api/sop/{sop_id}/pdf?v={PDF_TEMPLATE_VERSION}"
+
+def create_pdf(sop_id: str, topic: str, details: str) -> str:
+    # ReportLab is only imported once a PDF is actually rendered, keeping it off the startup path
+    from app.utils.pdf_generator import create_pdf as render_pdf
+    with track_stage("pdf_render"):
+        return render_pdf(sop_id, topic, details, PDF_COMPANY_NAME, pdf_path=pdf_path_for(sop_id))
+
+async def ensure_pdf(sop_id: str, topic: str, details: str) -> str:
+    """Path of the SOP's PDF, rendering it on first export"""
+    pdf_path = pdf_path_for(sop_id)
+    if os.path.exists(pdf_path):
+        return pdf_path
+
+    render = _pdf_renders.get(sop_id)
+    if render is None:
+        render = asyncio.ensure_future(asyncio.to_thread(create_pdf, sop_id, topic, details))
+        _pdf_renders[sop_id] = render
+        render.add_done_callback(lambda _: _pdf_renders.pop(sop_id, None))
+    if not await asyncio.shield(render):
+        raise RuntimeError("PDF generation failed")
+    return pdf_path
+
 async def create_sop(topic: str, description: str):
-    topic_embedding = get_embedding(topic)
-    description_embedding = get_embedding(description)
+    """Return a stored SOP when one closely matches the request, otherwise generate a new one"""
+    # The request is embedded and matched the same way as POST /sop/similar
+    await embedding_index.ensure_loaded()
+    topic_embedding = await get_embedding(topic, model=embedding_index.model)
+    description_embedding = await get_embedding(description, model=embedding_index.model)
+
+    # Boosts would let a much-edited SOP pass on its version count alone, and push the reported score above 1
+    matches = embedding_index.search(topic_embedding, description_embedding, SOP_REUSE_THRESHOLD, 1, boosted=False)
+    record_cache("sop_reuse", bool(matches))
+    if matches:
+        sop_id, similarity = matches[0]
+        return {
+            "sop_id": sop_id,
+            "message": "Existing SOP matches the request",
+            "is_existing": True,
+            "similarity_score": similarity,
+            "download_url": pdf_download_url(sop_id)
+        }
+
+    # Reuse the topic embedding when the index is on the model new SOPs are stored with
+    if embedding_index.model != active_embedding_model():
+        topic_embedding = None
+    return await _generate_and_store_sop(topic, description, topic_embedding)
+
+async def create_sop_direct(topic: str, description: str):
+    """Always generate a new SOP, even when a similar one exists"""
+    return await _generate_and_store_sop(topic, description)
+
+async def _generate_and_store_sop(topic: str, description: str, topic_embedding: Optional[list] = None):
+    if topic_embedding is None:
+        topic_embedding = await get_embedding(topic)
     
     sop_id = str(uuid.uuid4())
 
@@ -32,118 +111,115 @@ async def create_sop(topic: str, description: str):
     if not isinstance(sop_data, dict) or "details" not in sop_data or "summary" not in sop_data:
         raise ValueError("Invalid SOP response from OpenAI")
 
-    pdf_path = create_pdf(sop_id, topic, sop_data["details"])
+    # The PDF is rendered on first download; previews use the cheaper HTML renderer
+    pdf_path = pdf_path_for(sop_id)
 
-    # Create SOP document with Sri Lankan timezone
-    current_time = get_sri_lankan_time()
-    
-    # Store in sops collection
-    await db.sops.insert_one({
+    summary_embedding = await get_embedding(sop_data["summary"])
+
+    # Once generation is paid for, a cancelled request still finishes the writes so no SOP is half stored
+    await asyncio.shield(store_generated_sops([{
         "sop_id": sop_id,
         "topic": topic,
         "description": description,
         "details": sop_data["details"],
-        "pdf_url": pdf_path
-    })
-
-    # Store in new sop_documents collection
-    sop_document = SOPDocument(
-        sop_id=sop_id,
-        topic=topic,
-        pdf_url=pdf_path,
-        created_at=current_time
-    )
-    await db.sop_documents.insert_one(sop_document.dict())
-
-    await db.summaries.insert_one({
-        "topic_id": sop_id,
-        "sop_id": sop_id,
-        "summary": sop_data["summary"]
-    })
-
-    summary_embedding = get_embedding(sop_data["summary"])
-
-    embedding_doc = Embedding(
-        sop_id=sop_id,
-        topic_embedding=topic_embedding,
-        summary_embedding=summary_embedding
-    )
-
-    await db.embeddings.insert_one(embedding_doc.dict())
+        "summary": sop_data["summary"],
+        "pdf_url": pdf_path,
+        "topic_embedding": topic_embedding,
+        "summary_embedding": summary_embedding
+    }]))
 
     return {
         "sop_id": sop_id,
         "message": "New SOP created successfully",
-        "is_existing": False
+        "is_existing": False,
+        "download_url": pdf_download_url(sop_id)
     }
 
-async def create_sop_direct(topic: str, description: str):
-    topic_embedding = get_embedding(topic)
-    description_embedding = get_embedding(description)
-    
-    sop_id = str(uuid.uuid4())
-
-    sop_data = await generate_sop(topic, description)
-
-    if not isinstance(sop_data, dict) or "details" not in sop_data or "summary" not in sop_data:
-        raise ValueError("Invalid SOP response from OpenAI")
-
-    pdf_path = create_pdf(sop_id, topic, sop_data["details"])
+async def store_generated_sops(sops: List[dict]):
+    """Write newly generated SOPs to every collection, one bulk write per collection.
 
-    # Create SOP document with Sri Lankan timezone
+    Every write is an upsert keyed by sop_id, so a batch interrupted part way
+    (a crashed bulk job) can simply be written again without duplicates.
+    """
+    # Create SOP documents with Sri Lankan timezone
     current_time = get_sri_lankan_time()
     
     # Store in sops collection
-    await db.sops.insert_one({
-        "sop_id": sop_id,
-        "topic": topic,
-        "description": description,
-        "details": sop_data["details"],
-        "pdf_url": pdf_path
-    })
+    await db.sops.bulk_write([ReplaceOne({"sop_id": sop["sop_id"]}, {
+        "sop_id": sop["sop_id"],
+        "topic": sop["topic"],
+        "description": sop["description"],
+        "details": sop["details"],
+        "pdf_url": sop["pdf_url"]
+    }, upsert=True) for sop in sops])
 
     # Store in new sop_documents collection
-    sop_document = SOPDocument(
-        sop_id=sop_id,
-        topic=topic,
-        pdf_url=pdf_path,
+    await db.sop_documents.bulk_write([ReplaceOne({"sop_id": sop["sop_id"]}, SOPDocument(
+        sop_id=sop["sop_id"],
+        topic=sop["topic"],
+        pdf_url=sop["pdf_url"],
         created_at=current_time
-    )
-    await db.sop_documents.insert_one(sop_document.dict())
-
-    await db.summaries.insert_one({
-        "topic_id": sop_id,
-        "sop_id": sop_id,
-        "summary": sop_data["summary"]
-    })
-
-    summary_embedding = get_embedding(sop_data["summary"])
-
-    embedding_doc = Embedding(
-        sop_id=sop_id,
-        topic_embedding=topic_embedding,
-        summary_embedding=summary_embedding
-    )
-
-    await db.embeddings.insert_one(embedding_doc.dict())
-
-    return {
-        "sop_id": sop_id,
-        "message": "New SOP created successfully",
-        "is_existing": False
-    }
-
+    ).dict(), upsert=True) for sop in sops])
+
+    await db.summaries.bulk_write([ReplaceOne({"sop_id": sop["sop_id"]}, {
+        "topic_id": sop["sop_id"],
+        "sop_id": sop["sop_id"],
+        "summary": sop["summary"]
+    }, upsert=True) for sop in sops])
+
+    # Written last: a SOP with its embeddings stored is completely stored
+    model = active_embedding_model()
+    await db.embeddings.bulk_write([ReplaceOne({"sop_id": sop["sop_id"], "model": model}, Embedding(
+        sop_id=sop["sop_id"],
+        topic_embedding=sop["topic_embedding"],
+        summary_embedding=sop["summary_embedding"],
+        model=model
+    ).to_document(), upsert=True) for sop in sops])
+
+    await _store_backfill_embeddings(sops)
+
+    for sop in sops:
+        embedding_index.add(sop["sop_id"], sop["topic_embedding"], sop["summary_embedding"], created_at=current_time)
+        keyword_index.add(sop["sop_id"], sop["topic"], sop["summary"], sop["details"])
+
+async def _store_backfill_embeddings(sops: List[dict]):
+    """Also embed new SOPs with the model of any running re-embedding backfill.
+
+    The backfill may already have passed them, and search switches to its
+    model as soon as it finishes. A failure here leaves the SOP to the
+    backfill's final missing-vector pass rather than failing the write.
+    """
+    for model in await backfill_embedding_models():
+        try:
+            embeddings = await get_embeddings(
+                [sop["topic"] for sop in sops] + [sop["summary"] for sop in sops], model=model
+            )
+            await db.embeddings.bulk_write([ReplaceOne({"sop_id": sop["sop_id"], "model": model}, Embedding(
+                sop_id=sop["sop_id"],
+                topic_embedding=embeddings[i],
+                summary_embedding=embeddings[len(sops) + i],
+                model=model
+            ).to_document(), upsert=True) for i, sop in enumerate(sops)])
+        except Exception as e:
+            logger.warning(f"Could not embed {len(sops)} new SOPs with backfill model {model}: {str(e)}")
 
 async def get_sop_pdf(sop_id: str):
-    sop = await db.sops.find_one({"sop_id": sop_id})
-    if not sop or "pdf_url" not in sop:
-        raise ValueError("SOP not found or PDF not generated")
+    sop = await db.sops.find_one({"sop_id": sop_id}, {"_id": 0, "topic": 1, **DETAILS_PROJECTION})
+    if not sop:
+        raise ValueError("SOP not found")
     
-    pdf_path = sop["pdf_url"]
-    if not os.path.exists(pdf_path):
-        raise ValueError("PDF file not found")
+    return await ensure_pdf(sop_id, sop["topic"], await version_store.details_of(sop))
+
+async def get_sop_preview(sop_id: str, format: str = "html") -> str:
+    """The SOP rendered as HTML or normalised Markdown, without building the PDF"""
+    sop = await db.sops.find_one({"sop_id": sop_id}, {"_id": 0, "topic": 1, **DETAILS_PROJECTION})
+    if not sop:
+        raise ValueError("SOP not found")
     
-    return pdf_path
+    details = await version_store.details_of(sop)
+    if format == "markdown":
+        return render_preview_markdown(sop_id, sop["topic"], details)
+    return render_preview_html(sop_id, sop["topic"], details)
 
 async def get_sop_summary(sop_id: str):
     summary_doc = await db.summaries.find_one({"sop_id": sop_id})
@@ -169,22 +245,94 @@ async def get_task(task_id: str) -> Optional[Task]:
         return Task(**task_doc)
     return None
 
-async def get_all_tasks() -> List[Task]:
-    tasks = []
-    async for task_doc in db.tasks.find():
-        tasks.append(Task(**task_doc))
-    return tasks
+# Fields of Task; list endpoints return these rows without building a model per document
+TASK_LIST_PROJECTION = {"_id": 0, "id": 1, "sop_id": 1, "topic": 1, "created_at": 1, "status": 1}
+
+async def get_all_tasks() -> List[dict]:
+    return await db.tasks.find({}, TASK_LIST_PROJECTION).to_list(None)
+
+async def get_all_sop_documents() -> List[dict]:
+    # Defaults are filled in by the server so rows need no per-document Python work
+    return await db.sop_documents.aggregate([{"$project": {
+        "_id": 0,
+        "sop_id": 1,
+        "topic": 1,
+        "created_at": 1,
+        "version": {"$ifNull": ["$version", 1]},
+        "effectiveness_score": {"$ifNull": ["$effectiveness_score", None]},
+        "download_url": {"$concat": ["/api/sop/", "$sop_id", f"/pdf?v={PDF_TEMPLATE_VERSION}"]}
+    }}]).to_list(None)
+
+# Statuses a task may move to from each status. Other statuses (set by older clients or before
+# transitions were checked) are not restricted: a task may move to or from them freely.
+TASK_TRANSITIONS = {
+    "pending": {"in_progress", "completed", "failed"},
+    "in_progress": {"pending", "completed", "failed"},
+    "failed": {"pending", "in_progress"},
+    "completed": {"in_progress"},
+}
+
+class TaskTransitionError(Exception):
+    """The task exists but cannot move from its current status to the requested one"""
 
 async def update_task_status(task_id: str, status: str) -> Optional[Task]:
-    result = await db.tasks.find_one_and_update(
-        {"id": task_id},
-        {"$set": {"status": status}},
-        return_document=True
-    )
+    query = {"id": task_id}
+    if status in TASK_TRANSITIONS:
+        # Validate and apply in one conditional update; setting the current status again is a no-op
+        allowed_from = [current for current, targets in TASK_TRANSITIONS.items() if status in targets] + [status]
+        query["$or"] = [{"status": {"$in": allowed_from}}, {"status": {"$nin": list(TASK_TRANSITIONS)}}]
+    result = await db.tasks.find_one_and_update(query, {"$set": {"status": status}}, return_document=True)
     if result:
         return Task(**result)
+    current = await db.tasks.find_one({"id": task_id}, {"_id": 0, "status": 1})
+    if current:
+        raise TaskTransitionError(f"Cannot move task from '{current['status']}' to '{status}'")
     return None
 
+async def get_task_status_counts() -> dict:
+    counts = {}
+    async for group in db.tasks.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+        counts[group["_id"]] = group["count"]
+    return {"total": sum(counts.values()), "by_status": counts}
+
+async def get_task_counts_by_sop(status: Optional[str] = None, limit: int = 100) -> List[dict]:
+    """Per-SOP task counts split by status, SOPs with the most tasks first"""
+    pipeline = [{"$match": {"status": status}}] if status else []
+    pipeline += [
+        {"$group": {"_id": {"sop_id": "$sop_id", "status": "$status"}, "count": {"$sum": 1}}},
+        {"$group": {
+            "_id": "$_id.sop_id",
+            "total": {"$sum": "$count"},
+            "by_status": {"$push": {"k": "$_id.status", "v": "$count"}}
+        }},
+        {"$sort": {"total": -1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "sop_id": "$_id", "total": 1, "by_status": {"$arrayToObject": "$by_status"}}}
+    ]
+    return await db.tasks.aggregate(pipeline).to_list(None)
+
+async def get_task_counts_by_day(days: int = 30, status: Optional[str] = None) -> List[dict]:
+    """Tasks created per UTC day over the last `days` days, split by status"""
+    match = {"created_at": {"$gte": datetime.utcnow() - timedelta(days=days)}}
+    # Served by the (status, created_at) index when filtered by status, the created_at index otherwise
+    if status:
+        match["status"] = status
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}, "status": "$status"},
+            "count": {"$sum": 1}
+        }},
+        {"$group": {
+            "_id": "$_id.day",
+            "total": {"$sum": "$count"},
+            "by_status": {"$push": {"k": "$_id.status", "v": "$count"}}
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "day": "$_id", "total": 1, "by_status": {"$arrayToObject": "$by_status"}}}
+    ]
+    return await db.tasks.aggregate(pipeline).to_list(None)
+
 async def get_sop_details(sop_id: str):
     # Get SOP document
     sop_doc = await db.sops.find_one({"sop_id": sop_id})
@@ -203,9 +351,10 @@ async def get_sop_details(sop_id: str):
     return {
         "topic": sop_doc["topic"],
         "description": sop_doc["description"],
-        "details": sop_doc["details"],
+        "details": await version_store.details_of(sop_doc),
         "summary": summary,
         "pdf_url": sop_doc["pdf_url"],
+        "download_url": pdf_download_url(sop_id),
         "effectiveness_score": effectiveness_score,
         "version":version
     }
@@ -221,6 +370,8 @@ async def edit_sop_details(sop_id: str, edited_details: str):
     if not original_summary:
         raise ValueError("Original summary not found")
     
+    original_details = await version_store.details_of(original_sop)
+    
     # Get current version number
     current_version = await db.sop_documents.find_one({"sop_id": sop_id})
     new_version = (current_version.get("version", 1) if current_version else 1) + 1
@@ -228,18 +379,16 @@ async def edit_sop_details(sop_id: str, edited_details: str):
     # Generate new SOP ID
     new_sop_id = str(uuid.uuid4())
     
-    # Create new PDF with edited details
-    pdf_path = create_pdf(new_sop_id, original_sop["topic"], edited_details)
+    # The PDF with the edited details is rendered on first download
+    pdf_path = pdf_path_for(new_sop_id)
     
     # Get current time in Sri Lankan timezone
     current_time = get_sri_lankan_time()
     
-    # Store in edited_sop_details collection
+    # Store in edited_sop_details collection; both texts are reconstructed from sops when needed
     edited_sop = EditedSOPDetails(
         new_sop_id=new_sop_id,
         old_sop_id=sop_id,
-        original_details=original_sop["details"],
-        edited_details=edited_details,
         pdf_url=pdf_path,
         created_at=current_time,
         effectiveness_score=100,  # Set initial score to 100
@@ -247,16 +396,17 @@ async def edit_sop_details(sop_id: str, edited_details: str):
     )
     await db.edited_sop_details.insert_one(edited_sop.dict())
     
-    # Store in sops collection with initial score 100
+    # Store in sops collection with initial score 100, as a delta against the edited version
     await db.sops.insert_one({
         "sop_id": new_sop_id,
         "topic": original_sop["topic"],
         "description": original_sop["description"],
-        "details": edited_details,
+        **version_fields(sop_id, original_sop.get("depth", 0), original_details, edited_details),
         "pdf_url": pdf_path,
         "effectiveness_score": 100,
         "version": new_version
     })
+    version_store.remember(new_sop_id, edited_details)
     
     # Store in sop_documents collection with initial score 100
     sop_document = SOPDocument(
@@ -277,41 +427,55 @@ async def edit_sop_details(sop_id: str, edited_details: str):
     })
     
     # Get embeddings for the edited details
-    topic_embedding = get_embedding(original_sop["topic"])
-    summary_embedding = get_embedding(original_summary["summary"])
+    topic_embedding = await get_embedding(original_sop["topic"])
+    summary_embedding = await get_embedding(original_summary["summary"])
     
     # Store embeddings
     embedding_doc = Embedding(
         sop_id=new_sop_id,
         topic_embedding=topic_embedding,
-        summary_embedding=summary_embedding
+        summary_embedding=summary_embedding,
+        model=active_embedding_model()
     )
-    await db.embeddings.insert_one(embedding_doc.dict())
+    await db.embeddings.insert_one(embedding_doc.to_document())
+    await _store_backfill_embeddings([{"sop_id": new_sop_id, "topic": original_sop["topic"], "summary": original_summary["summary"]}])
+    embedding_index.add(new_sop_id, topic_embedding, summary_embedding, new_version, 100, current_time)
+    embedding_index.mark_superseded(sop_id)
+    keyword_index.add(new_sop_id, original_sop["topic"], original_summary["summary"], edited_details)
+    # The version history of the edited SOP now has another entry
+    response_cache.invalidate(sop_id)
     
     return {
         "new_sop_id": new_sop_id,
         "message": "SOP details edited and stored successfully",
         "pdf_url": pdf_path,
+        "download_url": pdf_download_url(new_sop_id),
         "version": new_version
     }
 
-def calculate_content_similarity(original: str, edited: str) -> float:
+async def calculate_content_similarity(original: str, edited: str) -> float:
     # Split content into sections
     original_sections = re.split(r'\n---\n', original)
     edited_sections = re.split(r'\n---\n', edited)
     
+    # Get embeddings for every section pair in one bulk call; scoring yields to interactive work
+    section_pairs = list(zip(original_sections, edited_sections))
+    section_embeddings = await get_embeddings(
+        [orig_sec for orig_sec, _ in section_pairs] + [edit_sec for _, edit_sec in section_pairs],
+        priority=BULK
+    )
+    
     # Calculate section similarity
     section_similarities = []
-    for orig_sec, edit_sec in zip(original_sections, edited_sections):
-        # Get embeddings for each section
-        orig_embedding = get_embedding(orig_sec)
-        edit_embedding = get_embedding(edit_sec)
+    for i in range(len(section_pairs)):
+        orig_embedding = section_embeddings[i]
+        edit_embedding = section_embeddings[len(section_pairs) + i]
         
         # Calculate cosine similarity
-        similarity = cosine_similarity(
-            np.array(orig_embedding).reshape(1, -1),
+        similarity = float(cosine_similarities(
+            np.array(orig_embedding),
             np.array(edit_embedding).reshape(1, -1)
-        )[0][0]
+        )[0])
         section_similarities.append(similarity)
     
     # Calculate average section similarity
@@ -339,9 +503,9 @@ async def calculate_effectiveness_score(old_sop_id: str) -> float:
         raise ValueError("No edited version found for this SOP")
     
     # Calculate content similarity
-    similarity = calculate_content_similarity(
-        edited_sop["original_details"],
-        edited_sop["edited_details"]
+    similarity = await calculate_content_similarity(
+        await version_store.get_details(edited_sop["old_sop_id"]),
+        await version_store.get_details(edited_sop["new_sop_id"])
     )
     
     # Convert similarity to percentage (0-100)
@@ -364,14 +528,19 @@ async def calculate_effectiveness_score(old_sop_id: str) -> float:
     )
     
     # Update the sop_documents collection with the score for both old and new SOP IDs
+    # effectiveness_updated_at lets every worker's similarity index pick the change up incrementally
+    scored_at = datetime.utcnow()
     await db.sop_documents.update_one(
         {"sop_id": edited_sop["old_sop_id"]},
-        {"$set": {"effectiveness_score": effectiveness_score}}
+        {"$set": {"effectiveness_score": effectiveness_score, "effectiveness_updated_at": scored_at}}
     )
     await db.sop_documents.update_one(
         {"sop_id": edited_sop["new_sop_id"]},
-        {"$set": {"effectiveness_score": 100}}
+        {"$set": {"effectiveness_score": 100, "effectiveness_updated_at": scored_at}}
     )
+    embedding_index.set_effectiveness_score(edited_sop["old_sop_id"], effectiveness_score)
+    embedding_index.set_effectiveness_score(edited_sop["new_sop_id"], 100)
+    response_cache.invalidate(edited_sop["old_sop_id"], edited_sop["new_sop_id"])
     
     return effectiveness_score
 
@@ -391,8 +560,10 @@ async def update_effectiveness_score(sop_id: str):
     # Update sop_documents collection
     await db.sop_documents.update_one(
         {"sop_id": sop_id},
-        {"$set": {"effectiveness_score": 100.0}}
+        {"$set": {"effectiveness_score": 100.0, "effectiveness_updated_at": datetime.utcnow()}}
     )
+    embedding_index.set_effectiveness_score(sop_id, 100.0)
+    response_cache.invalidate(sop_id)
 
 async def get_effectiveness_score_by_sop_id(sop_id: str) -> dict:
     sop_doc = await db.sops.find_one({"sop_id": sop_id})
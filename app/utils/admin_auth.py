@@ -0,0 +1,19 @@
+import hmac
+import os
+from typing import Optional
+from fastapi import Header, HTTPException
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def is_admin_token(token: Optional[str]) -> bool:
+    # Admin features stay disabled until a token is configured
+    if not ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token, ADMIN_TOKEN)
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
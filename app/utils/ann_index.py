@@ -0,0 +1,165 @@
+import asyncio
+import json
+import logging
+import os
+import numpy as np
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Below this many SOPs the exact scan is fast enough and always fully accurate
+ANN_MIN_SIZE = int(os.getenv("ANN_MIN_SIZE", "20000"))
+ANN_INDEX_PATH = os.getenv("ANN_INDEX_PATH", "indexes/sop_hnsw.faiss")
+ANN_HNSW_M = int(os.getenv("ANN_HNSW_M", "32"))
+ANN_EF_CONSTRUCTION = int(os.getenv("ANN_EF_CONSTRUCTION", "200"))
+ANN_EF_SEARCH = int(os.getenv("ANN_EF_SEARCH", "128"))
+# Seconds between full background rebuilds (0 disables the schedule)
+ANN_REBUILD_INTERVAL = int(os.getenv("ANN_REBUILD_INTERVAL", "3600"))
+
+def _faiss():
+    # faiss is large and only needed once a library crosses ANN_MIN_SIZE
+    import faiss
+    return faiss
+
+class ANNIndex:
+    """HNSW graph over the concatenated [topic | summary] vectors of every SOP.
+
+    Rows are the unit-length prefix vectors of EmbeddingIndex side by side and
+    queries are [0.6 * topic, 0.4 * summary], so the inner product the graph
+    maximises is the same weighted cosine the prefix scan computes. The graph
+    only proposes candidates; they are re-ranked with the full vectors.
+    """
+
+    def __init__(self, path: str = ANN_INDEX_PATH):
+        self.path = path
+        self.index = None
+        self.sop_ids: List[str] = []
+        self.model: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.index is not None
+
+    def __len__(self) -> int:
+        return len(self.sop_ids)
+
+    @staticmethod
+    def _new_index(dim: int):
+        faiss = _faiss()
+        index = faiss.IndexHNSWFlat(dim, ANN_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ANN_EF_CONSTRUCTION
+        index.hnsw.efSearch = ANN_EF_SEARCH
+        return index
+
+    @staticmethod
+    def build(sop_ids: List[str], vectors: np.ndarray, model: str) -> "ANNIndex":
+        """Build a fresh graph; CPU heavy, so callers run it in a worker thread"""
+        ann = ANNIndex()
+        ann.model = model
+        ann.index = ANNIndex._new_index(vectors.shape[1])
+        ann.index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+        ann.sop_ids = list(sop_ids)
+        return ann
+
+    def add(self, sop_ids: List[str], vectors: np.ndarray):
+        if not self.ready or not len(sop_ids):
+            return
+        self.index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+        self.sop_ids.extend(sop_ids)
+
+    def search(self, query: np.ndarray, k: int, ef_search: Optional[int] = None) -> List[Tuple[str, float]]:
+        # Per-call parameters: requests and a recall measurement in a worker thread may search at once
+        params = _faiss().SearchParametersHNSW(efSearch=max(ef_search or ANN_EF_SEARCH, k))
+        scores, labels = self.index.search(np.ascontiguousarray(query.reshape(1, -1), dtype=np.float32), k, params=params)
+        return [
+            (self.sop_ids[label], float(score))
+            for label, score in zip(labels[0], scores[0])
+            if label >= 0
+        ]
+
+    def save(self, path: Optional[str] = None):
+        """Write the graph and its id table, replacing any previous files atomically"""
+        path = path or self.path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Several workers may rebuild at once, so temporary files are per process
+        suffix = f".{os.getpid()}.tmp"
+        _faiss().write_index(self.index, path + suffix)
+        with open(path + ".ids" + suffix, "w") as f:
+            json.dump({"model": self.model, "sop_ids": self.sop_ids}, f)
+        os.replace(path + suffix, path)
+        os.replace(path + ".ids" + suffix, path + ".ids")
+
+    @staticmethod
+    def load(path: str = ANN_INDEX_PATH) -> Optional["ANNIndex"]:
+        if not (os.path.exists(path) and os.path.exists(path + ".ids")):
+            return None
+        ann = ANNIndex(path)
+        ann.index = _faiss().read_index(path)
+        with open(path + ".ids") as f:
+            table = json.load(f)
+        if not isinstance(table, dict):
+            logger.warning(f"Ignoring ANN index at {path}: id table has no model")
+            return None
+        ann.model = table["model"]
+        ann.sop_ids = table["sop_ids"]
+        if ann.index.ntotal != len(ann.sop_ids):
+            logger.warning(f"Ignoring ANN index at {path}: id table does not match the graph")
+            return None
+        return ann
+
+def _build_and_save(sop_ids: List[str], vectors: np.ndarray, model: str) -> ANNIndex:
+    ann = ANNIndex.build(sop_ids, vectors, model)
+    ann.save()
+    return ann
+
+async def rebuild_ann_index(embedding_index) -> ANNIndex:
+    """Rebuild the graph from the in-memory index without blocking the event loop"""
+    await embedding_index.ensure_loaded()
+    count = len(embedding_index)
+    model = embedding_index.model
+    sop_ids = embedding_index.sop_ids[:count]
+    vectors = embedding_index.ann_vectors(slice(0, count))
+    # Build and persist in a worker thread, before the graph is shared with request handlers
+    ann = await asyncio.to_thread(_build_and_save, sop_ids, vectors, model)
+
+    # The index was reloaded for another model while the graph was being built
+    if embedding_index.model != model:
+        return ann
+
+    # Catch up on SOPs inserted while the graph was being built; loading fills these in too
+    if len(embedding_index) > count:
+        ann.add(embedding_index.sop_ids[count:], embedding_index.ann_vectors(slice(count, None)))
+
+    embedding_index.ann = ann
+    logger.info(f"Rebuilt ANN index over {len(ann)} SOPs")
+    return ann
+
+def measure_recall(embedding_index, k: int = 10, sample: int = 100, ef_search: Optional[int] = None, seed: int = 0) -> dict:
+    """Recall@k of the ANN graph against an exact scan, using library rows as queries"""
+    ann = embedding_index.ann
+    if ann is None or not ann.ready:
+        raise ValueError("ANN index has not been built")
+
+    n = len(embedding_index)
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(n, size=min(sample, n), replace=False)
+    vectors = embedding_index.ann_vectors(slice(0, n))
+    topic_vectors = embedding_index.topic_vectors(rows)
+    summary_vectors = embedding_index.summary_vectors(rows)
+
+    recalls = []
+    for topic, summary in zip(topic_vectors, summary_vectors):
+        query = embedding_index.ann_query(topic, summary)
+        exact_scores = vectors @ query
+        top = np.argpartition(-exact_scores, min(k, n) - 1)[:k]
+        expected = {embedding_index.sop_ids[i] for i in top}
+        found = {sop_id for sop_id, _ in ann.search(query, k, ef_search)}
+        recalls.append(len(found & expected) / len(expected))
+
+    return {
+        "k": k,
+        "sample": len(rows),
+        "ef_search": ef_search or ANN_EF_SEARCH,
+        "library_size": n,
+        "recall": float(np.mean(recalls))
+    }
@@ -0,0 +1,116 @@
+import zlib
+from typing import Iterable
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Formats that are already compressed: gzipping them costs CPU and saves nothing
+INCOMPRESSIBLE_CONTENT_TYPES = (
+    "application/pdf",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/octet-stream",
+    "image/",
+    "audio/",
+    "video/",
+    "font/woff",
+    "font/woff2",
+    # Streams have to reach the client as they are produced
+    "text/event-stream",
+)
+# Image formats that are text and do compress well
+COMPRESSIBLE_EXCEPTIONS = ("image/svg+xml",)
+
+def is_compressible(content_type: str, excluded: Iterable[str] = INCOMPRESSIBLE_CONTENT_TYPES) -> bool:
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    if media_type in COMPRESSIBLE_EXCEPTIONS:
+        return True
+    return not any(media_type == prefix or (prefix.endswith("/") and media_type.startswith(prefix)) for prefix in excluded)
+
+class SelectiveGZipMiddleware:
+    """GZip responses, except for already-compressed content types.
+
+    Unlike Starlette's GZipMiddleware it also leaves alone responses that are
+    already encoded, partial (206) or empty (304), so byte ranges of a PDF
+    reach the browser exactly as served.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 500, compresslevel: int = 6,
+                 excluded_content_types: Iterable[str] = INCOMPRESSIBLE_CONTENT_TYPES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+        self.excluded_content_types = tuple(excluded_content_types)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get("accept-encoding", ""):
+            await self.app(scope, receive, send)
+            return
+        responder = _GZipResponder(send, self.minimum_size, self.compresslevel, self.excluded_content_types)
+        await self.app(scope, receive, responder.send)
+
+class _GZipResponder:
+    def __init__(self, send: Send, minimum_size: int, compresslevel: int, excluded_content_types: tuple):
+        self._send = send
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+        self.excluded_content_types = excluded_content_types
+        self.start_message: Message = None
+        # None until the first body message decides; True streams through untouched
+        self.passthrough = None
+        self.compressor = None
+
+    def _skip(self, message: Message) -> bool:
+        headers = Headers(raw=message["headers"])
+        return (
+            message["status"] in (204, 206, 304)
+            or "content-encoding" in headers
+            or "content-range" in headers
+            or not is_compressible(headers.get("content-type", ""), self.excluded_content_types)
+        )
+
+    async def send(self, message: Message):
+        if message["type"] == "http.response.start":
+            if self._skip(message):
+                self.passthrough = True
+                await self._send(message)
+            else:
+                # Held back until the first body chunk shows whether compressing is worth it
+                self.start_message = message
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.passthrough is None:
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self._send(self.start_message)
+                await self._send(message)
+                return
+
+            self.passthrough = False
+            self.compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            headers["Content-Encoding"] = "gzip"
+            headers.add_vary_header("Accept-Encoding")
+            compressed = self.compressor.compress(body)
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                compressed += self.compressor.flush()
+                headers["Content-Length"] = str(len(compressed))
+            await self._send(self.start_message)
+            await self._send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+            return
+
+        compressed = self.compressor.compress(body)
+        if not more_body:
+            compressed += self.compressor.flush()
+        await self._send({"type": "http.response.body", "body": compressed, "more_body": more_body})
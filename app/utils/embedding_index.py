@@ -0,0 +1,595 @@
+import asyncio
+import logging
+import os
+import time
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from app.database import db
+from app.utils.ann_index import ANNIndex, ANN_MIN_SIZE
+from app.utils.vector_codec import decode_vector, VECTOR_DTYPE
+from app.utils.similarity_search import select_top
+from app.utils.metrics import track_stage
+from app.utils.embedding_models import (
+    active_embedding_model, refresh_active_embedding_model, embedding_model_filter
+)
+from app.utils import embedding_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Same weighting as find_similar_sops: topic similarity counts for 60%, summary for 40%
+TOPIC_WEIGHT = 0.6
+SUMMARY_WEIGHT = 0.4
+# Each version increases similarity by 5%
+VERSION_BOOST = 0.05
+
+# Number of leading dimensions used for the first-pass scan (0 disables it)
+PREFIX_DIM = int(os.getenv("SIMILARITY_PREFIX_DIM", "256"))
+# Seconds between checks for a switched search model or a newer shared snapshot
+MODEL_CHECK_INTERVAL = int(os.getenv("EMBEDDING_MODEL_CHECK_INTERVAL", "30"))
+# Number of first-pass candidates re-ranked with the full vectors
+RERANK_CANDIDATES = int(os.getenv("SIMILARITY_RERANK_CANDIDATES", "200"))
+# Queries scored per matrix product in batch searches, bounding the (queries x library) score block
+BATCH_QUERY_BLOCK = int(os.getenv("SIMILARITY_BATCH_QUERY_BLOCK", "256"))
+# ObjectIds are generated by each client, so catch-up after a snapshot re-reads a short overlap
+CATCH_UP_OVERLAP = timedelta(seconds=60)
+# Seconds between reads of the edits and score updates other workers stored
+METADATA_REFRESH_INTERVAL = int(os.getenv("SIMILARITY_METADATA_REFRESH_INTERVAL", "300"))
+# SOP ids sent per $in when reading the metadata of new rows
+METADATA_IN_LIMIT = 1000
+# Filters keeping less than this share of the library score only the rows they keep; broader ones mask rows out
+FILTER_GATHER_FRACTION = float(os.getenv("SIMILARITY_FILTER_GATHER_FRACTION", "0.5"))
+
+class SimilarityFilters(NamedTuple):
+    """Predicates applied to the library before it is scored"""
+    # Skip versions that have since been edited into a newer one
+    latest_only: bool = True
+    min_effectiveness_score: Optional[float] = None
+    created_after: Optional[datetime] = None
+
+DEFAULT_FILTERS = SimilarityFilters()
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(VECTOR_DTYPE, copy=False)
+
+def _as_query(vector: Sequence[float]) -> np.ndarray:
+    return _normalize(np.asarray(vector, dtype=VECTOR_DTYPE).reshape(1, -1))[0]
+
+def _version_boost(version: Optional[int]) -> float:
+    return 1.0 + ((version or 1) - 1) * VERSION_BOOST
+
+def _epoch(value: Optional[datetime]) -> float:
+    if value is None:
+        return np.nan
+    # MongoDB returns naive UTC datetimes
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+def _score_value(score: Optional[float]) -> float:
+    return np.nan if score is None else float(score)
+
+def _combine(topic: np.ndarray, summary: np.ndarray, dim: Optional[int] = None) -> np.ndarray:
+    """Unit-length topic and summary vectors side by side, truncated to `dim` each when given"""
+    if dim:
+        # Truncated vectors have to be re-normalised to keep the dot product a cosine
+        topic, summary = topic[..., :dim], summary[..., :dim]
+    return np.concatenate([_normalize(topic), _normalize(summary)], axis=-1)
+
+class AppendableRows:
+    """A read-only base matrix, usually memory-mapped from the shared snapshot,
+    plus the rows this process has appended since loading it"""
+
+    def __init__(self, base: np.ndarray):
+        self.base = base
+        self.tail = np.empty((0, base.shape[1]), dtype=VECTOR_DTYPE)
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.tail)
+
+    @property
+    def width(self) -> int:
+        return self.base.shape[1]
+
+    def append(self, rows: np.ndarray):
+        self.tail = np.vstack([self.tail, rows])
+
+    def dot(self, other: np.ndarray) -> np.ndarray:
+        if not len(self.tail):
+            return self.base @ other
+        return np.concatenate([self.base @ other, self.tail @ other])
+
+    def take(self, rows) -> np.ndarray:
+        if isinstance(rows, slice):
+            rows = np.arange(len(self))[rows]
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(self.tail):
+            return np.asarray(self.base[rows])
+        out = np.empty((len(rows), self.width), dtype=VECTOR_DTYPE)
+        in_base = rows < len(self.base)
+        out[in_base] = self.base[rows[in_base]]
+        out[~in_base] = self.tail[rows[~in_base] - len(self.base)]
+        return out
+
+class EmbeddingIndex:
+    """Matrices of all SOP embeddings for fast similarity search.
+
+    Each row holds the L2-normalised topic and summary vectors side by side, so
+    the weighted cosine is a single dot product with [0.6 * topic, 0.4 * summary].
+    Searches first score a truncated prefix of every vector (text-embedding-3
+    vectors keep most of their ranking quality when truncated) and then re-rank
+    the best candidates with the full vectors. Large libraries take their
+    candidates from an HNSW graph instead of scanning every prefix row.
+
+    When a snapshot of the active model exists the matrices are memory-mapped
+    from it, so every worker on a node shares the same pages, and only SOPs
+    stored after the snapshot are read from MongoDB.
+
+    Per-row metadata (latest version of its lineage, effectiveness score,
+    creation time) lives beside the vectors so filters become boolean masks
+    applied before scoring. It is snapshotted with the vectors; edits and score
+    updates stored since are read every METADATA_REFRESH_INTERVAL seconds
+    through indexed queries above the edits_last_id and scores_since marks.
+    """
+
+    def __init__(self, prefix_dim: int = PREFIX_DIM, use_ann: bool = True):
+        self.prefix_dim = prefix_dim
+        # Batch jobs that score every row exactly have no use for the graph
+        self.use_ann = use_ann
+        self.dim = 0
+        self.sop_ids: List[str] = []
+        self.vectors: Optional[AppendableRows] = None
+        self.prefix: Optional[AppendableRows] = None
+        self.boosts = np.empty(0, dtype=VECTOR_DTYPE)
+        self.latest = np.empty(0, dtype=bool)
+        # NaN where a SOP has no score or creation time, so range filters exclude it
+        self.effectiveness = np.empty(0, dtype=VECTOR_DTYPE)
+        self.created = np.empty(0, dtype=np.float64)
+        self.ann: Optional[ANNIndex] = None
+        self.model: Optional[str] = None
+        self.snapshot_version: Optional[str] = None
+        # Newest embeddings document read from MongoDB, where catch-up resumes
+        self.last_id: Optional[ObjectId] = None
+        # Newest edited_sop_details document and score update time the metadata reflects
+        self.edits_last_id: Optional[ObjectId] = None
+        self.scores_since: Optional[datetime] = None
+        self._model_checked = 0.0
+        self._metadata_refreshed = 0.0
+        self._row_of = {}
+        self._loaded = False
+        self._loading = False
+        self._pending = []
+        # Per-SOP metadata set in this process while a refresh is reading, re-applied once it finishes
+        self._metadata_changes: Optional[Dict[str, dict]] = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.sop_ids)
+
+    async def ensure_loaded(self):
+        now = time.monotonic()
+        if self._loaded and now - self._model_checked < MODEL_CHECK_INTERVAL and now - self._metadata_refreshed < METADATA_REFRESH_INTERVAL:
+            return
+        async with self._lock:
+            if not self._loaded:
+                await self.load()
+                return
+            if time.monotonic() - self._model_checked >= MODEL_CHECK_INTERVAL:
+                self._model_checked = time.monotonic()
+                # A completed backfill switches every worker over to the new vectors
+                if await refresh_active_embedding_model() != self.model:
+                    logger.info(f"Search embedding model changed to {active_embedding_model()}, reloading")
+                    await self.load()
+                    return
+                # Another worker published a newer snapshot; mapping it drops our private tail
+                manifest = embedding_snapshot.read_manifest()
+                if manifest and manifest["model"] == self.model and manifest["version"] != self.snapshot_version:
+                    await self.load()
+                else:
+                    # Pick up SOPs other workers stored since our last read, as the keyword index does
+                    await self._catch_up(self.model)
+            if time.monotonic() - self._metadata_refreshed >= METADATA_REFRESH_INTERVAL:
+                await self.refresh_metadata()
+
+    async def load(self):
+        """Load every embedding of the active model, from the shared snapshot when there is one"""
+        self._loading = True
+        try:
+            model = await refresh_active_embedding_model()
+            manifest = embedding_snapshot.read_manifest()
+            if manifest and manifest["model"] == model:
+                await self._load_snapshot(manifest)
+                await self.refresh_metadata()
+                await self._catch_up(model)
+            else:
+                await self._load_from_mongo(model)
+
+            self.model = model
+            self._model_checked = time.monotonic()
+            self.ann = None
+            self._loaded = True
+            logger.info(f"Loaded {len(self)} {model} SOP embeddings into the similarity index")
+            if self.use_ann and len(self) >= ANN_MIN_SIZE:
+                self._load_ann()
+        finally:
+            self._loading = False
+
+        # Apply rows inserted while the load was running
+        pending, self._pending = self._pending, []
+        for row in pending:
+            if row[0] not in self._row_of:
+                self.add(*row)
+
+    async def _read_embeddings(self, query: dict):
+        """Decoded vectors, version boosts and metadata of the matching embeddings documents"""
+        sop_ids = []
+        topic_vectors = []
+        summary_vectors = []
+        projection = {"sop_id": 1, "topic_embedding": 1, "summary_embedding": 1}
+        async for doc in db.embeddings.find(query, projection):
+            sop_ids.append(doc["sop_id"])
+            topic_vectors.append(decode_vector(doc["topic_embedding"]))
+            summary_vectors.append(decode_vector(doc["summary_embedding"]))
+            if self.last_id is None or doc["_id"] > self.last_id:
+                self.last_id = doc["_id"]
+
+        boosts, metadata = await self._read_metadata(sop_ids)
+        return sop_ids, topic_vectors, summary_vectors, boosts, metadata
+
+    async def _read_metadata(self, sop_ids: List[str]):
+        """Version boosts and (latest, effectiveness, created) arrays for the given SOPs"""
+        documents = {}
+        superseded = set()
+        projection = {"_id": 0, "sop_id": 1, "version": 1, "effectiveness_score": 1, "created_at": 1}
+        for start in range(0, len(sop_ids), METADATA_IN_LIMIT):
+            chunk = sop_ids[start:start + METADATA_IN_LIMIT]
+            async for doc in db.sop_documents.find({"sop_id": {"$in": chunk}}, projection):
+                documents[doc["sop_id"]] = doc
+            # A version that has been edited is superseded by the edit
+            async for doc in db.edited_sop_details.find({"old_sop_id": {"$in": chunk}}, {"_id": 0, "old_sop_id": 1}):
+                superseded.add(doc["old_sop_id"])
+
+        docs = [documents.get(sop_id, {}) for sop_id in sop_ids]
+        boosts = np.array([_version_boost(doc.get("version")) for doc in docs], dtype=VECTOR_DTYPE)
+        latest = np.array([sop_id not in superseded for sop_id in sop_ids], dtype=bool)
+        effectiveness = np.array([_score_value(doc.get("effectiveness_score")) for doc in docs], dtype=VECTOR_DTYPE)
+        created = np.array([_epoch(doc.get("created_at")) for doc in docs], dtype=np.float64)
+        return boosts, (latest, effectiveness, created)
+
+    async def _start_metadata_marks(self):
+        """Set the incremental marks before a full metadata read, so changes stored during it are read again"""
+        newest = await db.edited_sop_details.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        self.edits_last_id = newest["_id"] if newest else None
+        self.scores_since = datetime.utcnow()
+
+    async def _read_metadata_changes(self, edits_last_id: Optional[ObjectId], scores_since: Optional[datetime]):
+        """SOPs edited after edits_last_id, scores updated after scores_since and the newest edit read"""
+        query = {}
+        if edits_last_id is not None:
+            # Like embeddings, edits get client-generated ObjectIds, so re-read a short overlap
+            query = {"_id": {"$gt": ObjectId.from_datetime(edits_last_id.generation_time - CATCH_UP_OVERLAP)}}
+        superseded = []
+        async for doc in db.edited_sop_details.find(query, {"old_sop_id": 1}):
+            superseded.append(doc["old_sop_id"])
+            if edits_last_id is None or doc["_id"] > edits_last_id:
+                edits_last_id = doc["_id"]
+
+        scores = {}
+        if scores_since is not None:
+            query = {"effectiveness_updated_at": {"$gt": scores_since - CATCH_UP_OVERLAP}}
+            async for doc in db.sop_documents.find(query, {"_id": 0, "sop_id": 1, "effectiveness_score": 1}):
+                scores[doc["sop_id"]] = doc.get("effectiveness_score")
+        return superseded, scores, edits_last_id
+
+    async def refresh_metadata(self):
+        """Apply the edits and score updates stored since the last read, including other workers' ones"""
+        self._metadata_changes = {}
+        try:
+            scores_since = datetime.utcnow()
+            superseded, scores, self.edits_last_id = await self._read_metadata_changes(self.edits_last_id, self.scores_since)
+            self.scores_since = scores_since
+            self._metadata_refreshed = time.monotonic()
+            for sop_id in superseded:
+                row = self._row_of.get(sop_id)
+                if row is not None:
+                    self.latest[row] = False
+            for sop_id, score in scores.items():
+                row = self._row_of.get(sop_id)
+                if row is not None:
+                    self.effectiveness[row] = _score_value(score)
+            # The read may predate an edit or score update made here meanwhile; the in-process value is newer
+            changes = self._metadata_changes
+        finally:
+            self._metadata_changes = None
+        for sop_id, change in changes.items():
+            if "latest" in change:
+                self.mark_superseded(sop_id)
+            if "effectiveness" in change:
+                self.set_effectiveness_score(sop_id, change["effectiveness"])
+
+    async def _load_from_mongo(self, model: str):
+        self.last_id = None
+        self.snapshot_version = None
+        await self._start_metadata_marks()
+        sop_ids, topic_vectors, summary_vectors, boosts, metadata = await self._read_embeddings(embedding_model_filter(model))
+        self._metadata_refreshed = time.monotonic()
+        if not sop_ids:
+            self._set_rows([], None, None, boosts, metadata)
+            return
+        topic, summary = np.vstack(topic_vectors), np.vstack(summary_vectors)
+        self.dim = topic.shape[1]
+        self._set_rows(
+            sop_ids,
+            _combine(topic, summary),
+            _combine(topic, summary, self.prefix_dim) if self._uses_prefix() else None,
+            boosts,
+            metadata
+        )
+
+    async def _load_snapshot(self, manifest: dict):
+        snapshot = embedding_snapshot.open_snapshot(manifest)
+        self.dim = manifest["dim"]
+        self.last_id = ObjectId(manifest["last_id"]) if manifest["last_id"] else None
+        self.snapshot_version = manifest["version"]
+        prefix = snapshot["prefix"] if manifest["prefix_dim"] == self.prefix_dim else None
+        metadata = snapshot["metadata"]
+        if metadata is None:
+            # Snapshot written before metadata was snapshotted: read it once, later refreshes are incremental
+            await self._start_metadata_marks()
+            _, metadata = await self._read_metadata(snapshot["sop_ids"])
+        else:
+            self.edits_last_id = ObjectId(manifest["edits_last_id"]) if manifest["edits_last_id"] else None
+            self.scores_since = datetime.fromisoformat(manifest["scores_since"]) if manifest["scores_since"] else None
+        self._set_rows(snapshot["sop_ids"], snapshot["vectors"], prefix, snapshot["boosts"], metadata)
+        if prefix is None and self._uses_prefix():
+            # Snapshot written with another prefix size: this worker keeps a private copy
+            self.rebuild_prefix(self.prefix_dim)
+
+    async def _catch_up(self, model: str):
+        """Append the SOPs stored after the snapshot was written"""
+        query = embedding_model_filter(model)
+        if self.last_id is not None:
+            since = ObjectId.from_datetime(self.last_id.generation_time - CATCH_UP_OVERLAP)
+            query = {"$and": [query, {"_id": {"$gt": since}}]}
+        sop_ids, topic_vectors, summary_vectors, boosts, (latest, effectiveness, created) = await self._read_embeddings(query)
+        for row, sop_id in enumerate(sop_ids):
+            if sop_id not in self._row_of:
+                self._append(
+                    sop_id, topic_vectors[row].reshape(1, -1), summary_vectors[row].reshape(1, -1), float(boosts[row]),
+                    (bool(latest[row]), float(effectiveness[row]), float(created[row]))
+                )
+
+    def _load_ann(self):
+        """Reuse the graph persisted by the last rebuild, adding SOPs it has not seen"""
+        ann = ANNIndex.load()
+        if ann is None:
+            return
+        if ann.model != self.model:
+            logger.warning(f"Ignoring persisted ANN index built from {ann.model} vectors")
+            return
+        if ann.index.d != self.ann_vectors(slice(0, 1)).shape[1]:
+            logger.warning("Ignoring persisted ANN index built with a different dimension")
+            return
+        known = set(ann.sop_ids)
+        missing = [row for row, sop_id in enumerate(self.sop_ids) if sop_id not in known]
+        ann.add([self.sop_ids[row] for row in missing], self.ann_vectors(missing))
+        self.ann = ann
+
+    def _set_rows(self, sop_ids: List[str], vectors: Optional[np.ndarray], prefix: Optional[np.ndarray], boosts: np.ndarray,
+                  metadata: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+        self.sop_ids = list(sop_ids)
+        self._row_of = {sop_id: row for row, sop_id in enumerate(self.sop_ids)}
+        self.vectors = AppendableRows(vectors) if vectors is not None else None
+        self.prefix = AppendableRows(prefix) if prefix is not None else None
+        self.boosts = np.asarray(boosts, dtype=VECTOR_DTYPE)
+        latest, effectiveness, created = metadata
+        self.latest = np.array(latest, dtype=bool)
+        self.effectiveness = np.array(effectiveness, dtype=VECTOR_DTYPE)
+        self.created = np.array(created, dtype=np.float64)
+
+    def rebuild_prefix(self, prefix_dim: int):
+        """Recompute the truncated first-pass matrix for a new prefix size"""
+        self.prefix_dim = prefix_dim
+        # The graph holds vectors of the old prefix size; queries of the new size no longer fit it
+        self.ann = None
+        if not self._uses_prefix() or self.vectors is None:
+            self.prefix = None
+            return
+        rows = self.vectors.take(slice(None))
+        self.prefix = AppendableRows(_combine(rows[:, :self.dim], rows[:, self.dim:], prefix_dim))
+
+    def topic_vectors(self, rows) -> np.ndarray:
+        return self.vectors.take(rows)[:, :self.dim]
+
+    def summary_vectors(self, rows) -> np.ndarray:
+        return self.vectors.take(rows)[:, self.dim:]
+
+    def ann_vectors(self, rows) -> np.ndarray:
+        """Rows as stored in the ANN graph: topic and summary prefixes side by side"""
+        rows_source = self.prefix if self.prefix is not None else self.vectors
+        return rows_source.take(rows)
+
+    def ann_query(self, topic_query: np.ndarray, summary_query: np.ndarray) -> np.ndarray:
+        if self._uses_prefix():
+            topic_query = _normalize(topic_query[:self.prefix_dim])
+            summary_query = _normalize(summary_query[:self.prefix_dim])
+        return np.concatenate([TOPIC_WEIGHT * topic_query, SUMMARY_WEIGHT * summary_query])
+
+    def _uses_prefix(self) -> bool:
+        return 0 < self.prefix_dim < self.dim
+
+    def add(self, sop_id: str, topic_embedding: Sequence[float], summary_embedding: Sequence[float], version: int = 1,
+            effectiveness_score: Optional[float] = None, created_at: Optional[datetime] = None):
+        """Append a newly stored SOP so it is searchable without a reload"""
+        # Keep it in case a running load has already read past it in MongoDB
+        if self._loading:
+            self._pending.append((sop_id, topic_embedding, summary_embedding, version, effectiveness_score, created_at))
+        if not self._loaded or self._loading:
+            return
+        # Vectors of a newly activated model arrive before this worker has reloaded
+        if active_embedding_model() != self.model:
+            return
+
+        topic = np.asarray(topic_embedding, dtype=VECTOR_DTYPE).reshape(1, -1)
+        summary = np.asarray(summary_embedding, dtype=VECTOR_DTYPE).reshape(1, -1)
+        self._append(sop_id, topic, summary, _version_boost(version), (True, _score_value(effectiveness_score), _epoch(created_at)))
+
+    def _append(self, sop_id: str, topic: np.ndarray, summary: np.ndarray, boost: float, metadata: Tuple[bool, float, float]):
+        if self.vectors is None:
+            self.dim = topic.shape[1]
+            self._set_rows(
+                [sop_id],
+                _combine(topic, summary),
+                _combine(topic, summary, self.prefix_dim) if self._uses_prefix() else None,
+                [boost],
+                tuple([value] for value in metadata)
+            )
+            return
+
+        self._row_of[sop_id] = len(self.sop_ids)
+        self.sop_ids = self.sop_ids + [sop_id]
+        self.vectors.append(_combine(topic, summary))
+        if self.prefix is not None:
+            self.prefix.append(_combine(topic, summary, self.prefix_dim))
+        self.boosts = np.concatenate([self.boosts, np.array([boost], dtype=VECTOR_DTYPE)])
+        latest, effectiveness, created = metadata
+        self.latest = np.append(self.latest, latest)
+        self.effectiveness = np.append(self.effectiveness, np.array([effectiveness], dtype=VECTOR_DTYPE))
+        self.created = np.append(self.created, created)
+        if self.ann is not None:
+            self.ann.add([sop_id], self.ann_vectors([len(self.sop_ids) - 1]))
+
+    def mark_superseded(self, sop_id: str):
+        """An edit of this SOP was stored; latest-only searches skip it from now on"""
+        if self._metadata_changes is not None:
+            self._metadata_changes.setdefault(sop_id, {})["latest"] = False
+        row = self._row_of.get(sop_id)
+        if row is not None:
+            self.latest[row] = False
+
+    def set_effectiveness_score(self, sop_id: str, score: Optional[float]):
+        if self._metadata_changes is not None:
+            self._metadata_changes.setdefault(sop_id, {})["effectiveness"] = score
+        row = self._row_of.get(sop_id)
+        if row is not None:
+            self.effectiveness[row] = _score_value(score)
+
+    def _mask(self, filters: SimilarityFilters) -> Optional[np.ndarray]:
+        """Rows passing every filter, or None when nothing is filtered"""
+        conditions = []
+        if filters.latest_only:
+            conditions.append(self.latest)
+        if filters.min_effectiveness_score is not None:
+            conditions.append(self.effectiveness >= filters.min_effectiveness_score)
+        if filters.created_after is not None:
+            conditions.append(self.created > _epoch(filters.created_after))
+        if not conditions:
+            return None
+        return np.logical_and.reduce(conditions)
+
+    def allowed(self, sop_ids: List[str], filters: SimilarityFilters = DEFAULT_FILTERS) -> List[str]:
+        """The given SOPs that pass the filters; SOPs not in the index are kept"""
+        mask = self._mask(filters)
+        if mask is None:
+            return list(sop_ids)
+        return [sop_id for sop_id in sop_ids if sop_id not in self._row_of or mask[self._row_of[sop_id]]]
+
+    def _candidates(self, topic_query: np.ndarray, summary_query: np.ndarray, count: int,
+                    mask: Optional[np.ndarray] = None) -> np.ndarray:
+        n = len(self.sop_ids)
+        allowed = np.flatnonzero(mask) if mask is not None else None
+        if count >= (n if allowed is None else len(allowed)):
+            return np.arange(n) if allowed is None else allowed
+
+        # Selective filters: score only the rows they keep instead of the whole library
+        if allowed is not None and len(allowed) < FILTER_GATHER_FRACTION * n:
+            if self.prefix is None:
+                return allowed
+            coarse = (self.prefix.take(allowed) @ self.ann_query(topic_query, summary_query)) * self.boosts[allowed]
+            return allowed[np.argpartition(-coarse, count - 1)[:count]]
+
+        # Large libraries: ask the graph instead of scanning every row
+        if self.ann is not None and n >= ANN_MIN_SIZE:
+            # The graph cannot filter, so fetch enough extra neighbours to cover the rows the filters drop
+            fetch = count if allowed is None else min(n, count * n // len(allowed) + count)
+            matches = self.ann.search(self.ann_query(topic_query, summary_query), fetch)
+            rows = np.array([self._row_of[sop_id] for sop_id, _ in matches if sop_id in self._row_of], dtype=np.int64)
+            return rows if mask is None else rows[mask[rows]]
+
+        if self.prefix is None:
+            return np.arange(n) if allowed is None else allowed
+
+        # First pass: score every row on the truncated prefix only
+        coarse = self.prefix.dot(self.ann_query(topic_query, summary_query)) * self.boosts
+        if mask is not None:
+            coarse[~mask] = -np.inf
+        return np.argpartition(-coarse, count - 1)[:count]
+
+    @track_stage("similarity_scan")
+    def search(self, topic_embedding: Sequence[float], summary_embedding: Sequence[float],
+               threshold: float = 0.6, limit: Optional[int] = None,
+               filters: SimilarityFilters = DEFAULT_FILTERS, boosted: bool = True) -> List[Tuple[str, float]]:
+        """Return (sop_id, score) pairs above the threshold that pass the filters, best first.
+
+        Scores include the version boost unless boosted is False, in which case
+        they are the plain weighted cosine and never exceed 1.
+        """
+        if not self.sop_ids:
+            return []
+        mask = self._mask(filters)
+        if mask is not None and not mask.any():
+            return []
+
+        topic_query = _as_query(topic_embedding)
+        summary_query = _as_query(summary_embedding)
+        query = np.concatenate([TOPIC_WEIGHT * topic_query, SUMMARY_WEIGHT * summary_query])
+
+        candidates = self._candidates(topic_query, summary_query, max(limit or 0, RERANK_CANDIDATES), mask)
+
+        # Re-rank the candidates with the full-dimension vectors
+        scores = self.vectors.take(candidates) @ query
+        if boosted:
+            scores *= self.boosts[candidates]
+
+        order = select_top(scores, threshold, limit)
+        return [(self.sop_ids[candidates[i]], float(scores[i])) for i in order]
+
+    @track_stage("similarity_scan")
+    def search_batch(self, topic_embeddings: Sequence[Sequence[float]], summary_embeddings: Sequence[Sequence[float]],
+                     threshold: float = 0.6, limit: Optional[int] = None,
+                     filters: SimilarityFilters = DEFAULT_FILTERS) -> List[List[Tuple[str, float]]]:
+        """Exact top results for many queries, scored with one matrix product per block of queries"""
+        if not len(topic_embeddings):
+            return []
+        mask = self._mask(filters) if self.sop_ids else None
+        if not self.sop_ids or (mask is not None and not mask.any()):
+            return [[] for _ in topic_embeddings]
+
+        topic_queries = _normalize(np.asarray(topic_embeddings, dtype=VECTOR_DTYPE))
+        summary_queries = _normalize(np.asarray(summary_embeddings, dtype=VECTOR_DTYPE))
+        queries = np.hstack([TOPIC_WEIGHT * topic_queries, SUMMARY_WEIGHT * summary_queries])
+
+        # Selective filters: gather the rows they keep once and score only those
+        rows = None
+        vectors, boosts = self.vectors, self.boosts
+        if mask is not None and mask.sum() < FILTER_GATHER_FRACTION * len(self.sop_ids):
+            rows = np.flatnonzero(mask)
+            vectors, boosts = self.vectors.take(rows), self.boosts[rows]
+            mask = None
+
+        results = []
+        for start in range(0, len(queries), BATCH_QUERY_BLOCK):
+            block = queries[start:start + BATCH_QUERY_BLOCK].T
+            scores = (vectors @ block if rows is not None else vectors.dot(block)).T * boosts
+            if mask is not None:
+                scores[:, ~mask] = -np.inf
+            for row_scores in scores:
+                order = select_top(row_scores, threshold, limit)
+                ids = order if rows is None else rows[order]
+                results.append([(self.sop_ids[i], float(row_scores[j])) for i, j in zip(ids, order)])
+        return results
+
+embedding_index = EmbeddingIndex()
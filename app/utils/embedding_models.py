@@ -0,0 +1,49 @@
+import os
+from dotenv import load_dotenv
+from typing import List
+from app.database import db
+
+load_dotenv()
+
+# Model of every embedding written before vectors were tagged with their model
+LEGACY_EMBEDDING_MODEL = "text-embedding-3-small"
+# Model used until a re-embedding backfill switches search over to another one
+DEFAULT_EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", LEGACY_EMBEDDING_MODEL)
+
+SETTINGS_ID = "embedding_model"
+
+_active_model = DEFAULT_EMBEDDING_MODEL
+
+def active_embedding_model() -> str:
+    """Model used for new vectors and search queries, as of the last refresh"""
+    return _active_model
+
+async def refresh_active_embedding_model() -> str:
+    global _active_model
+    settings = await db.settings.find_one({"_id": SETTINGS_ID})
+    _active_model = settings["model"] if settings else DEFAULT_EMBEDDING_MODEL
+    return _active_model
+
+async def set_active_embedding_model(model: str):
+    global _active_model
+    await db.settings.update_one({"_id": SETTINGS_ID}, {"$set": {"model": model}}, upsert=True)
+    _active_model = model
+
+def embedding_model_filter(model: str) -> dict:
+    """Query matching embedding documents of one model, including untagged legacy documents"""
+    if model == LEGACY_EMBEDDING_MODEL:
+        return {"$or": [{"model": model}, {"model": {"$exists": False}}]}
+    return {"model": model}
+
+async def backfill_embedding_models() -> List[str]:
+    """Models new SOPs must also be embedded with besides the one this worker is on.
+
+    That is every model a re-embedding backfill is still running for, plus the
+    model search has switched to if this worker has not refreshed since.
+    """
+    models = set(await db.embedding_jobs.distinct("_id", {"status": "running"}))
+    settings = await db.settings.find_one({"_id": SETTINGS_ID})
+    if settings:
+        models.add(settings["model"])
+    models.discard(_active_model)
+    return sorted(models)
@@ -0,0 +1,190 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+import numpy as np
+from contextlib import contextmanager
+from typing import Optional
+from app.utils.vector_codec import VECTOR_DTYPE
+from app.utils.ann_index import rebuild_ann_index, ANN_MIN_SIZE, ANN_REBUILD_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Directory holding one sub-directory per snapshot version and the CURRENT manifest
+EMBEDDING_SNAPSHOT_DIR = os.getenv("EMBEDDING_SNAPSHOT_DIR", "indexes/embeddings")
+# Older versions are kept briefly so workers still mapping them are not disturbed
+SNAPSHOT_KEEP_VERSIONS = int(os.getenv("EMBEDDING_SNAPSHOT_KEEP_VERSIONS", "2"))
+# Rows copied into the snapshot files per step, bounding the extra memory of a write
+SNAPSHOT_WRITE_CHUNK = 65536
+# Seconds between snapshot and ANN graph refreshes (0 disables the schedule)
+SNAPSHOT_INTERVAL = int(os.getenv("EMBEDDING_SNAPSHOT_INTERVAL", str(ANN_REBUILD_INTERVAL)))
+
+MANIFEST_NAME = "CURRENT"
+
+def _manifest_path(directory: str) -> str:
+    return os.path.join(directory, MANIFEST_NAME)
+
+def read_manifest(directory: str = EMBEDDING_SNAPSHOT_DIR) -> Optional[dict]:
+    """The manifest of the published snapshot, or None when there is none"""
+    try:
+        with open(_manifest_path(directory)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable embedding snapshot manifest: {str(e)}")
+        return None
+
+def open_snapshot(manifest: dict, directory: str = EMBEDDING_SNAPSHOT_DIR) -> dict:
+    """Map the snapshot files read-only; pages are shared through the OS page cache"""
+    path = os.path.join(directory, manifest["version"])
+    with open(os.path.join(path, "sop_ids.json")) as f:
+        sop_ids = json.load(f)
+    prefix_path = os.path.join(path, "prefix.npy")
+    # Snapshots written before the filter metadata was included have no metadata.npz
+    metadata_path = os.path.join(path, "metadata.npz")
+    metadata = None
+    if os.path.exists(metadata_path):
+        with np.load(metadata_path) as arrays:
+            metadata = (arrays["latest"], arrays["effectiveness"], arrays["created"])
+    return {
+        "sop_ids": sop_ids,
+        "vectors": np.load(os.path.join(path, "vectors.npy"), mmap_mode="r"),
+        "prefix": np.load(prefix_path, mmap_mode="r") if os.path.exists(prefix_path) else None,
+        "boosts": np.load(os.path.join(path, "boosts.npy")),
+        "metadata": metadata
+    }
+
+@contextmanager
+def snapshot_lock(directory: str = EMBEDDING_SNAPSHOT_DIR):
+    """Exclusive non-blocking lock; yields False when another process already holds it"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, ".lock"), "w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _write_rows(path: str, rows, count: int):
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=VECTOR_DTYPE, shape=(count, rows.width))
+    for start in range(0, count, SNAPSHOT_WRITE_CHUNK):
+        stop = min(start + SNAPSHOT_WRITE_CHUNK, count)
+        out[start:stop] = rows.take(slice(start, stop))
+    out.flush()
+    del out
+
+def write_snapshot(embedding_index, directory: str = EMBEDDING_SNAPSHOT_DIR) -> dict:
+    """Write the index matrices to a new version directory and publish it.
+
+    CPU and IO heavy, so callers run it in a worker thread while holding
+    snapshot_lock. The manifest is replaced atomically, so readers see either
+    the previous snapshot or the complete new one.
+    """
+    # Take one consistent view; the event loop may append rows or reload meanwhile.
+    # The marks are read first so a reader resuming from them re-reads anything newer than the arrays
+    edits_last_id, scores_since = embedding_index.edits_last_id, embedding_index.scores_since
+    count = len(embedding_index)
+    sop_ids = embedding_index.sop_ids[:count]
+    vectors, prefix = embedding_index.vectors, embedding_index.prefix
+    boosts = embedding_index.boosts[:count]
+    latest = embedding_index.latest[:count].copy()
+    effectiveness = embedding_index.effectiveness[:count].copy()
+    created = embedding_index.created[:count].copy()
+    manifest = {
+        "version": f"{int(time.time() * 1000)}-{os.getpid()}",
+        "model": embedding_index.model,
+        "count": count,
+        "dim": embedding_index.dim,
+        "prefix_dim": embedding_index.prefix_dim if prefix is not None else 0,
+        "last_id": str(embedding_index.last_id) if embedding_index.last_id else None,
+        # Where incremental reads of edits and score updates resume after loading this snapshot
+        "edits_last_id": str(edits_last_id) if edits_last_id else None,
+        "scores_since": scores_since.isoformat() if scores_since else None
+    }
+    path = os.path.join(directory, manifest["version"])
+    os.makedirs(path)
+
+    _write_rows(os.path.join(path, "vectors.npy"), vectors, count)
+    if prefix is not None:
+        _write_rows(os.path.join(path, "prefix.npy"), prefix, count)
+    np.save(os.path.join(path, "boosts.npy"), boosts)
+    np.savez(os.path.join(path, "metadata.npz"), latest=latest, effectiveness=effectiveness, created=created)
+    with open(os.path.join(path, "sop_ids.json"), "w") as f:
+        json.dump(sop_ids, f)
+
+    tmp_path = _manifest_path(directory) + f".{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _manifest_path(directory))
+    prune_snapshots(directory, manifest["version"])
+    logger.info(f"Published embedding snapshot {manifest['version']} with {count} SOPs")
+    return manifest
+
+def prune_snapshots(directory: str = EMBEDDING_SNAPSHOT_DIR, current: Optional[str] = None):
+    """Remove all but the newest SNAPSHOT_KEEP_VERSIONS version directories.
+
+    Unlinking a mapped file is safe on POSIX: workers still mapping an old
+    version keep its pages until they switch to the new one.
+    """
+    versions = sorted(
+        (name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name))),
+        key=lambda name: int(name.split("-")[0]),
+        reverse=True
+    )
+    for name in versions[SNAPSHOT_KEEP_VERSIONS:]:
+        if name != current:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+def _snapshot_age(manifest: dict) -> float:
+    return time.time() - int(manifest["version"].split("-")[0]) / 1000
+
+async def refresh_snapshot(embedding_index, min_age: float = 0) -> Optional[dict]:
+    """Rebuild the ANN graph when the library is large and publish a new snapshot.
+
+    Only one worker per node does this at a time; the others pick the new
+    snapshot and graph up on their next periodic check.
+    """
+    with snapshot_lock() as acquired:
+        if not acquired:
+            return None
+        await embedding_index.ensure_loaded()
+        manifest = read_manifest()
+        # Another worker published recently
+        if manifest and manifest["model"] == embedding_index.model and _snapshot_age(manifest) < min_age:
+            return None
+        if embedding_index.vectors is None:
+            return None
+        if len(embedding_index) >= ANN_MIN_SIZE:
+            await rebuild_ann_index(embedding_index)
+        manifest = await asyncio.to_thread(write_snapshot, embedding_index)
+        embedding_index.snapshot_version = manifest["version"]
+        return manifest
+
+async def index_maintenance_loop(embedding_index, interval: int = SNAPSHOT_INTERVAL):
+    """Periodically refresh the shared snapshot and the ANN graph"""
+    first_run = True
+    while True:
+        try:
+            await embedding_index.ensure_loaded()
+            manifest = read_manifest()
+            missing = not manifest or manifest["model"] != embedding_index.model
+            missing_ann = embedding_index.ann is None and len(embedding_index) >= ANN_MIN_SIZE
+            # On startup a snapshot and graph from disk are good enough until the first scheduled refresh
+            if not first_run or missing or missing_ann:
+                await refresh_snapshot(embedding_index, min_age=0 if first_run else interval / 2)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Embedding snapshot refresh failed: {str(e)}")
+        first_run = False
+        await asyncio.sleep(interval)
@@ -0,0 +1,218 @@
+import asyncio
+import heapq
+import logging
+import math
+import os
+import re
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from typing import Dict, List, Optional, Tuple
+from app.database import db
+from app.utils.metrics import track_stage
+from app.utils.sop_versions import version_store, DETAILS_PROJECTION
+from app.utils.version_delta import apply_delta
+
+logger = logging.getLogger(__name__)
+
+# BM25 parameters: term-frequency saturation and document-length normalisation
+BM25_K1 = 1.2
+BM25_B = 0.75
+# A term in the topic counts three times, in the summary twice, in the details once
+FIELD_WEIGHTS = {"topic": 3.0, "summary": 2.0, "details": 1.0}
+# Seconds between catch-ups on SOPs stored by other worker processes
+KEYWORD_REFRESH_INTERVAL = int(os.getenv("KEYWORD_INDEX_REFRESH_INTERVAL", "30"))
+CATCH_UP_OVERLAP = timedelta(seconds=60)
+# A SOP's summary is written just after it; one still missing after this long is indexed without it
+SUMMARY_WAIT = timedelta(minutes=5)
+# Rank constant of reciprocal-rank fusion; 60 is the value from the original RRF paper
+RRF_K = 60
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or that the this to was were "
+    "will with into should must all any each your you our we".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS and len(token) > 1]
+
+def reciprocal_rank_fusion(*rankings: List[str], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists: each list contributes 1 / (k + rank) for every id it contains"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, sop_id in enumerate(ranking, start=1):
+            scores[sop_id] = scores.get(sop_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+class KeywordIndex:
+    """In-process BM25 inverted index over SOP topics, summaries and details.
+
+    Postings map each term to {row: weighted term frequency}; a query only
+    touches the postings of its own terms, so short keyword lookups need no
+    embedding call and no scan of the library.
+    """
+
+    def __init__(self):
+        self._reset()
+        self._refreshed = 0.0
+        self._loaded = False
+        self._loading = False
+        self._pending = []
+        self._lock = asyncio.Lock()
+
+    def _reset(self):
+        self.sop_ids: List[str] = []
+        self.postings: Dict[str, Dict[int, float]] = {}
+        # Weighted token count per row; removed rows keep a zero so row numbers stay stable
+        self.lengths: List[float] = []
+        self.total_length = 0.0
+        self.live = 0
+        # Newest sops document read from MongoDB, where catch-up resumes
+        self.last_id = None
+        self._terms_of: Dict[int, List[str]] = {}
+        self._row_of: Dict[str, int] = {}
+        # SOPs read before their summary was stored, retried on every catch-up
+        self._awaiting_summary: Dict[str, dict] = {}
+
+    def __len__(self) -> int:
+        return self.live
+
+    async def ensure_loaded(self):
+        if self._loaded and time.monotonic() - self._refreshed < KEYWORD_REFRESH_INTERVAL:
+            return
+        async with self._lock:
+            if not self._loaded:
+                await self.load()
+            elif time.monotonic() - self._refreshed >= KEYWORD_REFRESH_INTERVAL:
+                await self._catch_up()
+
+    async def load(self):
+        """Index every stored SOP"""
+        self._loading = True
+        try:
+            self._reset()
+            await self._catch_up()
+            self._loaded = True
+            logger.info(f"Indexed {self.live} SOPs for keyword search")
+        finally:
+            self._loading = False
+
+        # Apply rows stored while the load was running
+        pending, self._pending = self._pending, []
+        for row in pending:
+            if row[0] not in self._row_of:
+                self.add(*row)
+
+    async def _catch_up(self):
+        """Index SOPs stored since the last read, including those written by other workers"""
+        query = {}
+        if self.last_id is not None:
+            # ObjectIds come from each client's clock, so re-read a short overlap; known ids are skipped
+            query = {"_id": {"$gt": ObjectId.from_datetime(self.last_id.generation_time - CATCH_UP_OVERLAP)}}
+        sops = await db.sops.find(query, {"topic": 1, **DETAILS_PROJECTION}).sort("_id", 1).to_list(None)
+        self._refreshed = time.monotonic()
+        if sops:
+            self.last_id = max(sops[-1]["_id"], self.last_id) if self.last_id is not None else sops[-1]["_id"]
+        # In _id order, so edited versions come after the parents they are stored as deltas against
+        candidates = sorted(list(self._awaiting_summary.values()) + [
+            sop for sop in sops if sop["sop_id"] not in self._row_of and sop["sop_id"] not in self._awaiting_summary
+        ], key=lambda sop: sop["_id"])
+        if not candidates:
+            return
+        summaries = {}
+        async for doc in db.summaries.find({"sop_id": {"$in": [sop["sop_id"] for sop in candidates]}}, {"_id": 0, "sop_id": 1, "summary": 1}):
+            summaries[doc["sop_id"]] = doc.get("summary", "")
+        now = datetime.now(timezone.utc)
+        materialised: Dict[str, str] = {}
+        for sop in candidates:
+            sop_id = sop["sop_id"]
+            if sop_id in self._row_of:
+                # Indexed by add() in the meantime
+                self._awaiting_summary.pop(sop_id, None)
+                continue
+            # Wait for the summary rather than indexing without it for good
+            if sop_id not in summaries and now - sop["_id"].generation_time < SUMMARY_WAIT:
+                self._awaiting_summary[sop_id] = sop
+                continue
+            self._awaiting_summary.pop(sop_id, None)
+            self._index(sop_id, sop.get("topic", ""), summaries.get(sop_id, ""), await self._details(sop, materialised))
+
+    @staticmethod
+    async def _details(sop: dict, materialised: Dict[str, str]) -> str:
+        """Details of a sops document, replaying its delta on a parent materialised earlier in the same read"""
+        if "delta" not in sop:
+            details = sop.get("details", "")
+        elif sop["parent_sop_id"] in materialised:
+            details = apply_delta(materialised[sop["parent_sop_id"]], sop["delta"])
+        else:
+            # Parent read before this batch: walk the stored chain
+            details = await version_store.details_of(sop)
+        materialised[sop["sop_id"]] = details
+        return details
+
+    def add(self, sop_id: str, topic: str, summary: str, details: str):
+        """Index a newly stored SOP so keyword search finds it without a reload"""
+        # Keep it in case a running load has already read past it in MongoDB
+        if self._loading:
+            self._pending.append((sop_id, topic, summary, details))
+        if not self._loaded or self._loading:
+            return
+        self._index(sop_id, topic, summary, details)
+
+    def _index(self, sop_id: str, topic: str, summary: str, details: str):
+        if sop_id in self._row_of:
+            self._remove(self._row_of[sop_id])
+
+        frequencies = Counter()
+        for field, text in (("topic", topic), ("summary", summary), ("details", details)):
+            for token in tokenize(text or ""):
+                frequencies[token] += FIELD_WEIGHTS[field]
+
+        row = len(self.sop_ids)
+        self.sop_ids.append(sop_id)
+        self._row_of[sop_id] = row
+        length = sum(frequencies.values())
+        self.lengths.append(length)
+        self.total_length += length
+        self.live += 1
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[row] = frequency
+        self._terms_of[row] = list(frequencies)
+
+    def _remove(self, row: int):
+        for term in self._terms_of.pop(row, []):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(row, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= self.lengths[row]
+        self.lengths[row] = 0.0
+        self.live -= 1
+        del self._row_of[self.sop_ids[row]]
+
+    @track_stage("keyword_search")
+    def search(self, query: str, limit: Optional[int] = 10) -> List[Tuple[str, float]]:
+        """Return (sop_id, BM25 score) pairs for SOPs matching any query term, best first"""
+        if not self.live:
+            return []
+        average_length = self.total_length / self.live or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (self.live - len(postings) + 0.5) / (len(postings) + 0.5))
+            for row, frequency in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[row] / average_length)
+                scores[row] = scores.get(row, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+
+        if limit is None:
+            top = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        else:
+            top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(self.sop_ids[row], score) for row, score in top]
+
+keyword_index = KeywordIndex()
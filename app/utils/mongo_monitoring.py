@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+from contextvars import ContextVar
+from typing import Dict, Optional
+from pymongo import monitoring
+from app.utils.metrics import registry, record_stage
+
+logger = logging.getLogger(__name__)
+
+# Commands slower than this are logged with their shape and route
+MONGO_SLOW_QUERY_MS = float(os.getenv("MONGO_SLOW_QUERY_MS", "100"))
+# A request issuing more than this many commands of one shape is flagged as a likely N+1 loop
+MONGO_N_PLUS_ONE_THRESHOLD = int(os.getenv("MONGO_N_PLUS_ONE_THRESHOLD", "10"))
+
+COMMAND_SECONDS = registry.histogram(
+    "sop_mongo_command_duration_seconds", "MongoDB command latency", ("collection", "operation")
+)
+N_PLUS_ONE = registry.counter(
+    "sop_mongo_repeated_query_total", "Requests that repeated one query shape above the threshold",
+    ("route", "collection", "operation")
+)
+
+# Commands whose first field is not a collection name
+_NON_COLLECTION_COMMANDS = {"getMore", "killCursors", "endSessions", "hello", "isMaster", "ping", "saslStart", "saslContinue"}
+
+# Cursor continuations repeat their find or aggregate; counting them would flag every large read as N+1
+_CURSOR_COMMANDS = {"getMore", "killCursors"}
+
+# Where each command keeps its filter
+_FILTER_FIELDS = {"find": "filter", "count": "query", "distinct": "query", "findAndModify": "query"}
+
+# Queries issued by the request being handled, keyed by (collection, operation, shape)
+_request_queries: ContextVar[Optional[dict]] = ContextVar("request_queries", default=None)
+
+def command_collection(command_name: str, command) -> str:
+    if command_name == "getMore":
+        return str(command.get("collection", ""))
+    if command_name in _NON_COLLECTION_COMMANDS:
+        return ""
+    value = command.get(command_name)
+    return value if isinstance(value, str) else ""
+
+def _shape(value):
+    """Replace literal values with '?' so queries differing only in parameters compare equal"""
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{key}: {_shape(value[key])}" for key in sorted(value)) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + (_shape(value[0]) if value else "") + "]"
+    return "?"
+
+def command_shape(command_name: str, command) -> str:
+    if command_name in _FILTER_FIELDS:
+        return _shape(command.get(_FILTER_FIELDS[command_name], {}))
+    if command_name in ("update", "delete"):
+        statements = command.get(command_name + "s") or [{}]
+        return _shape(statements[0].get("q", {}))
+    if command_name == "aggregate":
+        return "[" + ", ".join(next(iter(stage), "") for stage in command.get("pipeline", [])) + "]"
+    return ""
+
+def start_query_tracking() -> dict:
+    queries = {"shapes": {}, "slow": []}
+    _request_queries.set(queries)
+    return queries
+
+def _log_slow_command(operation: str, collection: str, milliseconds: float, shape: str, route: str):
+    logger.warning(
+        f"Slow MongoDB command: {operation} on {collection or 'admin'} "
+        f"took {milliseconds:.1f} ms (shape {shape or '-'}, route {route})"
+    )
+
+def report_query_patterns(queries: dict, route: str):
+    """Log the request's slow commands and flag query shapes it repeated more often than the N+1 threshold"""
+    # The route template is only known once routing has run, so slow commands are logged here
+    queries["route"] = route
+    for operation, collection, milliseconds, shape in queries["slow"]:
+        _log_slow_command(operation, collection, milliseconds, shape, route)
+    for (collection, operation, shape), count in queries["shapes"].items():
+        if count > MONGO_N_PLUS_ONE_THRESHOLD:
+            N_PLUS_ONE.inc(route=route, collection=collection, operation=operation)
+            logger.warning(
+                f"Possible N+1 query on {route}: {count} x {operation} on {collection} with shape {shape}"
+            )
+
+class CommandTimingListener(monitoring.CommandListener):
+    """Records MongoDB command latency, logs slow commands and counts query shapes per request"""
+
+    def __init__(self):
+        self._started: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = command_collection(event.command_name, event.command)
+        shape = command_shape(event.command_name, event.command)
+        queries = _request_queries.get()
+        if queries is not None and collection and event.command_name not in _CURSOR_COMMANDS:
+            key = (collection, event.command_name, shape)
+            with self._lock:
+                queries["shapes"][key] = queries["shapes"].get(key, 0) + 1
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = (collection, shape, queries)
+
+    def _finished(self, event):
+        with self._lock:
+            started = self._started.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+        collection, shape, queries = started
+        seconds = event.duration_micros / 1_000_000
+        record_stage("db", seconds, collection or "admin")
+        COMMAND_SECONDS.observe(seconds, collection=collection or "admin", operation=event.command_name)
+
+        if seconds * 1000 > MONGO_SLOW_QUERY_MS:
+            if queries is not None and "route" not in queries:
+                with self._lock:
+                    queries["slow"].append((event.command_name, collection, seconds * 1000, shape))
+            else:
+                # Outside a request, or from a task that outlived the request that started it
+                route = queries["route"] if queries is not None else "-"
+                _log_slow_command(event.command_name, collection, seconds * 1000, shape, route)
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
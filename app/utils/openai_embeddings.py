@@ -1,14 +1,48 @@
-from openai import OpenAI
 import os
 from dotenv import load_dotenv
+from functools import lru_cache
+from typing import List, Optional
+from app.utils.metrics import track_stage, record_tokens
+from app.utils.openai_scheduler import openai_scheduler, estimate_tokens, INTERACTIVE
+from app.utils.embedding_models import active_embedding_model
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+@lru_cache(maxsize=1)
+def get_client():
+    # The OpenAI SDK is slow to import, so it is loaded on first use rather than at startup
+    from openai import AsyncOpenAI
+    # Retries are handled by the scheduler, which knows about rate limits across all callers
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
 
-def get_embedding(text: str) -> list:
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text
+async def _create_embeddings(texts, model: str):
+    with track_stage("embed"):
+        return await get_client().embeddings.create(model=model, input=texts)
+
+async def get_embedding(text: str, priority: int = INTERACTIVE, model: Optional[str] = None) -> list:
+    model = model or active_embedding_model()
+    response = await openai_scheduler.run(
+        lambda: _create_embeddings(text, model),
+        estimated_tokens=estimate_tokens(text),
+        priority=priority
     )
-    return response.data[0].embedding 
\ No newline at end of file
+    record_tokens(model, response.usage)
+    return response.data[0].embedding
+
+# The embeddings API accepts at most 2048 inputs per request
+EMBEDDING_BATCH_SIZE = 2048
+
+async def get_embeddings(texts: List[str], priority: int = INTERACTIVE, model: Optional[str] = None) -> List[list]:
+    model = model or active_embedding_model()
+    embeddings = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+        response = await openai_scheduler.run(
+            lambda: _create_embeddings(batch, model),
+            estimated_tokens=estimate_tokens(*batch),
+            priority=priority
+        )
+        record_tokens(model, response.usage)
+        # Results are not guaranteed to come back in input order
+        embeddings.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+    return embeddings
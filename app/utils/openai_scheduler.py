@@ -0,0 +1,149 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import time
+from typing import Awaitable, Callable, Optional
+from dotenv import load_dotenv
+from app.utils.metrics import registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes: lower values are always served first
+INTERACTIVE = 0
+BULK = 1
+
+# Account-wide limits
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+# Processes sharing the account: API workers plus any job processes running beside them.
+# Each process's buckets hold its share of the limits, so together they stay within them.
+OPENAI_PROCESS_COUNT = max(1, int(os.getenv("OPENAI_PROCESS_COUNT", os.getenv("WEB_CONCURRENCY", "1"))))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "30"))
+
+OPENAI_RETRIES = registry.counter(
+    "sop_openai_retries_total", "OpenAI calls retried after a rate limit or server error", ("reason",)
+)
+
+def estimate_tokens(*texts: str) -> int:
+    # Roughly four characters per token for English text, plus per-message overhead
+    return sum(len(text) // 4 + 4 for text in texts)
+
+class TokenBucket:
+    """Continuously refilling allowance of `capacity` units per minute"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.rate = capacity / 60.0
+        self.available = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be consumed (requests larger than the bucket wait for a full one)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        # May go negative when a call used more than estimated; later callers then wait longer
+        self.available = min(self.capacity, self.available - amount)
+
+class OpenAIScheduler:
+    """Admits OpenAI calls within RPM/TPM budgets, highest priority first, and retries transient failures"""
+
+    def __init__(self, rpm: int = OPENAI_RPM_LIMIT, tpm: int = OPENAI_TPM_LIMIT, processes: int = OPENAI_PROCESS_COUNT):
+        self.requests = TokenBucket(max(1, rpm // processes))
+        self.tokens = TokenBucket(max(1, tpm // processes))
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        # Wake every waiter so the new head of the queue re-checks the buckets
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _acquire(self, priority: int, tokens: int):
+        entry = (priority, next(self._sequence))
+        heapq.heappush(self._waiters, entry)
+        self._notify()
+        try:
+            while True:
+                timeout = None
+                if self._waiters[0] == entry:
+                    timeout = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                    if timeout <= 0:
+                        heapq.heappop(self._waiters)
+                        self.requests.consume(1)
+                        self.tokens.consume(tokens)
+                        self._notify()
+                        return
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._notify()
+            raise
+
+    async def run(self, call: Callable[[], Awaitable], estimated_tokens: int = 0, priority: int = INTERACTIVE):
+        """Await `call()` once admitted, retrying rate limits and server errors with jittered backoff"""
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
+            await self._acquire(priority, estimated_tokens)
+            try:
+                response = await call()
+            except Exception as e:
+                reason = _retry_reason(e)
+                if reason is None or attempt == OPENAI_MAX_RETRIES:
+                    raise
+                delay = _backoff_delay(attempt, e)
+                OPENAI_RETRIES.inc(reason=reason)
+                logger.warning(f"OpenAI call failed ({reason}), retrying in {delay:.1f}s: {str(e)}")
+                await asyncio.sleep(delay)
+                continue
+
+            # Charge the difference between the estimate and what the call really used
+            usage = getattr(response, "usage", None)
+            total_tokens = getattr(usage, "total_tokens", None)
+            if total_tokens is not None:
+                self.tokens.consume(total_tokens - estimated_tokens)
+            return response
+
+def _retry_reason(error: Exception) -> Optional[str]:
+    import openai
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limit"
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return "connection"
+    if isinstance(error, openai.APIStatusError) and error.status_code >= 500:
+        return "server_error"
+    return None
+
+def _backoff_delay(attempt: int, error: Exception) -> float:
+    # Full jitter keeps retrying workers from hitting the API in lockstep
+    delay = random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(delay, float(retry_after)) if retry_after else delay
+    except ValueError:
+        return delay
+
+openai_scheduler = OpenAIScheduler()
@@ -7,17 +7,19 @@ from reportlab.lib.units import inch
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_JUSTIFY
 import os
 from datetime import datetime
-import re
 from io import BytesIO
+from app.utils.sop_markdown import parse_sop_markdown, reportlab_inline
 
-def create_pdf(sop_id: str, topic: str, details: str, company_name="Your Company") -> str:
+def create_pdf(sop_id: str, topic: str, details: str, company_name="Your Company", pdf_path: str = None) -> str:
     pdf_directory = "pdfs"
     os.makedirs(pdf_directory, exist_ok=True)
     
-    pdf_path = os.path.join(pdf_directory, f"{sop_id}.pdf")
+    pdf_path = pdf_path or os.path.join(pdf_directory, f"{sop_id}.pdf")
+    # Render next to the target and rename, so a concurrent download never sees a partial file
+    tmp_path = f"{pdf_path}.{os.getpid()}.{id(details)}.tmp"
 
     doc = SimpleDocTemplate(
-        pdf_path,
+        tmp_path,
         pagesize=letter,
         rightMargin=0.75 * inch,
         leftMargin=0.75 * inch,
@@ -39,8 +41,11 @@ def create_pdf(sop_id: str, topic: str, details: str, company_name="Your Company
                  onLaterPages=_add_later_pages_header_footer)
     except Exception as e:
         print(f"Error generating PDF: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         return ""
 
+    os.replace(tmp_path, pdf_path)
     return pdf_path
 
 def _create_custom_stylesheet() -> StyleSheet1:
@@ -221,118 +226,23 @@ def _create_custom_stylesheet() -> StyleSheet1:
 
     return styles
 
+_HEADING_STYLES = {1: 'MarkdownH1', 2: 'MarkdownH2', 3: 'MarkdownH3', 4: 'MarkdownH4', 5: 'MarkdownH5'}
+_NUMBERED_STYLES = {1: 'NumberedLevel1', 2: 'NumberedLevel2', 3: 'NumberedLevel3'}
+
 def _format_markdown_content(content: str, styles) -> list:
     """Format markdown content into proper ReportLab elements with multi-level numbering"""
     story = []
-    
-    # Split the content by lines
-    lines = content.split('\n')
-    
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # Handle headings with multiple hash symbols (###, ####, #####)
-        hash_match = re.match(r'^(#{1,5})\s+(.*?)$', line)
-        if hash_match:
-            # Count the number of hash symbols to determine heading level
-            num_hashes = len(hash_match.group(1))
-            heading_text = hash_match.group(2).strip()
-            
-            # Choose style based on heading level
-            if num_hashes == 1:
-                story.append(Paragraph(heading_text, styles['MarkdownH1']))
-            elif num_hashes == 2:
-                story.append(Paragraph(heading_text, styles['MarkdownH2']))
-            elif num_hashes == 3:
-                story.append(Paragraph(heading_text, styles['MarkdownH3']))
-            elif num_hashes == 4:
-                story.append(Paragraph(heading_text, styles['MarkdownH4']))
-            elif num_hashes == 5:
-                story.append(Paragraph(heading_text, styles['MarkdownH5']))
-        # Handle numbered lists with up to 3 levels (e.g., 1., 1.1., 1.1.1.)
-        elif re.match(r'^\d+\.\s', line):  # Main level (1., 2., etc.)
-            # Extract number and text
-            match = re.match(r'^(\d+)\.(.*)$', line)
-            if match:
-                number = match.group(1)
-                list_text = match.group(2).strip()
-                
-                # Process bold text within list items
-                list_text = _process_bold_text(list_text)
-                
-                # Create a primary level numbered list item with proper tab spacing
-                story.append(Paragraph(f"{number}. {list_text}", styles['NumberedLevel1']))
-        elif re.match(r'^\d+\.\d+\.\s', line):  # Second level (1.1., 1.2., etc.)
-            # Extract number and text
-            match = re.match(r'^(\d+\.\d+)\.(.*)$', line)
-            if match:
-                number = match.group(1)
-                list_text = match.group(2).strip()
-                
-                # Process bold text within list items
-                list_text = _process_bold_text(list_text)
-                
-                # Create a secondary level numbered list item with proper tab spacing
-                story.append(Paragraph(f"{number}. {list_text}", styles['NumberedLevel2']))
-        elif re.match(r'^\d+\.\d+\.\d+\.\s', line):  # Third level (1.1.1., 1.1.2., etc.)
-            # Extract number and text
-            match = re.match(r'^(\d+\.\d+\.\d+)\.(.*)$', line)
-            if match:
-                number = match.group(1)
-                list_text = match.group(2).strip()
-                
-                # Process bold text within list items
-                list_text = _process_bold_text(list_text)
-                
-                # Create a tertiary level numbered list item with proper tab spacing
-                story.append(Paragraph(f"{number}. {list_text}", styles['NumberedLevel3']))
-        # Handle dash or bullet lists
-        elif line.startswith('- ') or line.startswith('* ') or line.startswith('• '):
-            # Remove the bullet character and any leading space
-            if line.startswith('- '):
-                list_text = line[2:].strip()
-            elif line.startswith('* '):
-                list_text = line[2:].strip()
-            elif line.startswith('• '):
-                list_text = line[2:].strip()
-                
-            list_text = _process_bold_text(list_text)
-            story.append(Paragraph(f"• {list_text}", styles['BulletPoint']))
-        # Handle bold text
-        elif '**' in line:
-            formatted_text = _process_bold_text(line)
-            story.append(Paragraph(formatted_text, styles['SOPNormal']))
-        # Regular text - might be part of a paragraph
-        elif line:
-            # Collect lines until we hit an empty line or a heading
-            paragraph_lines = [line]
-            j = i + 1
-            while j < len(lines) and lines[j].strip() and not (
-                lines[j].strip().startswith(('#', '- ', '* ', '• ')) or 
-                re.match(r'^\d+(\.\d+)*\.', lines[j].strip())
-            ):
-                paragraph_lines.append(lines[j].strip())
-                j += 1
-            
-            # Join the paragraph lines and process any bold text
-            paragraph_text = ' '.join(paragraph_lines)
-            paragraph_text = _process_bold_text(paragraph_text)
-            
-            story.append(Paragraph(paragraph_text, styles['SOPNormal']))
-            
-            # Update index to skip processed lines
-            i = j - 1
-        
-        i += 1
-    
+    for block in parse_sop_markdown(content):
+        if block.kind == "heading":
+            story.append(Paragraph(reportlab_inline(block.text), styles[_HEADING_STYLES[block.level]]))
+        elif block.kind == "numbered":
+            story.append(Paragraph(f"{block.number}. {reportlab_inline(block.text)}", styles[_NUMBERED_STYLES[block.level]]))
+        elif block.kind == "bullet":
+            story.append(Paragraph(f"• {reportlab_inline(block.text)}", styles['BulletPoint']))
+        else:
+            story.append(Paragraph(reportlab_inline(block.text), styles['SOPNormal']))
     return story
 
-def _process_bold_text(text: str) -> str:
-    """Process bold text marked with ** in markdown"""
-    # Replace **text** with <b>text</b> for ReportLab formatting
-    return re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', text)
-
 def _build_document_story(topic: str, sop_id: str, details: str, styles, company_name) -> list:
     story = []
     
@@ -0,0 +1,97 @@
+import asyncio
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+from typing import List, Optional
+from dotenv import load_dotenv
+from app.utils.admin_auth import is_admin_token
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Fraction of requests profiled without being asked to (0 disables sampling)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# The profiler is switched off after this many seconds even if the request is still running
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "30"))
+# Oldest profiles are deleted once either limit is exceeded
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+PROFILE_MAX_BYTES = int(os.getenv("PROFILE_MAX_BYTES", str(100 * 1024 * 1024)))
+
+# Requests carrying the admin token in this header are always profiled
+PROFILE_HEADER = "X-Profile-Request"
+
+_PROFILE_NAME = re.compile(r"^[\w.-]+\.pstats$")
+
+# cProfile hooks the whole interpreter thread, so only one request is profiled at a time
+_active_profile = None
+
+def should_profile(request) -> bool:
+    if is_admin_token(request.headers.get(PROFILE_HEADER)):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def start_profile() -> Optional[cProfile.Profile]:
+    """Start profiling, or return None when another request is already being profiled"""
+    global _active_profile
+    if _active_profile is not None:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    _active_profile = profiler
+    # Cap the overhead of slow requests: other requests share the profiled thread
+    asyncio.get_running_loop().call_later(PROFILE_MAX_SECONDS, profiler.disable)
+    return profiler
+
+async def finish_profile(profiler: cProfile.Profile, route: str) -> str:
+    """Stop profiling and write a .pstats file; returns the profile name"""
+    global _active_profile
+    profiler.disable()
+    _active_profile = None
+
+    slug = re.sub(r"[^\w-]+", "_", route).strip("_") or "root"
+    name = f"{int(time.time() * 1000)}_{slug}.pstats"
+    # Serialising the stats and pruning old files is blocking file I/O
+    await asyncio.to_thread(_write_profile, profiler, name)
+    return name
+
+def _write_profile(profiler: cProfile.Profile, name: str):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+    _enforce_retention()
+
+def _enforce_retention():
+    profiles = list_profiles()
+    total_bytes = sum(profile["size"] for profile in profiles)
+    # list_profiles is newest first, so trim from the end
+    while profiles and (len(profiles) > PROFILE_MAX_FILES or total_bytes > PROFILE_MAX_BYTES):
+        oldest = profiles.pop()
+        total_bytes -= oldest["size"]
+        try:
+            os.remove(os.path.join(PROFILE_DIR, oldest["name"]))
+        except OSError as e:
+            logger.warning(f"Could not remove profile {oldest['name']}: {str(e)}")
+
+def list_profiles() -> List[dict]:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for entry in os.scandir(PROFILE_DIR):
+        if entry.is_file() and _PROFILE_NAME.match(entry.name):
+            stat = entry.stat()
+            profiles.append({"name": entry.name, "size": stat.st_size, "created_at": stat.st_mtime})
+    profiles.sort(key=lambda profile: profile["created_at"], reverse=True)
+    return profiles
+
+def profile_path(name: str) -> str:
+    # Names come from the URL, so only plain file names inside PROFILE_DIR are accepted
+    if not _PROFILE_NAME.match(name):
+        raise ValueError("Invalid profile name")
+    path = os.path.join(PROFILE_DIR, name)
+    if not os.path.isfile(path):
+        raise ValueError("Profile not found")
+    return path
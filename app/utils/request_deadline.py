@@ -0,0 +1,53 @@
+import asyncio
+import os
+from typing import Awaitable, Optional, TypeVar
+from fastapi import Request
+from app.utils.metrics import record_cancellation
+
+T = TypeVar("T")
+
+# Upper bound on a synchronous SOP generation request, in seconds
+GENERATE_SOP_DEADLINE_SECONDS = float(os.getenv("GENERATE_SOP_DEADLINE_SECONDS", "120"))
+# How often a running request checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+class RequestCancelled(Exception):
+    """The request's work was cancelled; reason is "disconnect" or "deadline" """
+
+    def __init__(self, reason: str):
+        super().__init__(f"Request cancelled: {reason}")
+        self.reason = reason
+
+async def run_cancellable(request: Request, work: Awaitable[T], route: str,
+                          deadline: Optional[float] = None) -> T:
+    """Await `work`, cancelling it when the client disconnects or the deadline passes.
+
+    Cancellation reaches whatever the work is awaiting (a queued or in-flight
+    OpenAI call, an embedding request), so later stages never start.
+    """
+    task = asyncio.ensure_future(work)
+    loop = asyncio.get_running_loop()
+    expires = loop.time() + deadline if deadline else None
+    try:
+        while True:
+            timeout = DISCONNECT_POLL_INTERVAL
+            if expires is not None:
+                remaining = expires - loop.time()
+                if remaining <= 0:
+                    reason = "deadline"
+                    break
+                timeout = min(timeout, remaining)
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                reason = "disconnect"
+                break
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    record_cancellation(route, reason)
+    raise RequestCancelled(reason)
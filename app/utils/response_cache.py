@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from app.utils.metrics import record_cache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Bounded per worker; entries also expire so other workers' edits show up within the TTL
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "60"))
+
+class ResponseCache:
+    """TTL + LRU cache of rendered JSON bodies for SOP read endpoints.
+
+    Entries are keyed by (view, sop_id) and remember every SOP id their content
+    was built from, so invalidating one SOP also drops e.g. the version history
+    that lists its score.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, bytes, str, Set[str]]]" = OrderedDict()
+        self._keys_by_sop: Dict[str, Set[Tuple[str, str]]] = {}
+        # Bumped on every invalidation so loads that raced with a write are not stored
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Tuple[str, str]) -> Optional[Tuple[bytes, str]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, body, etag, _ = entry
+        if expires < time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return body, etag
+
+    def set(self, key: Tuple[str, str], body: bytes, etag: str, depends_on: Iterable[str]):
+        if key in self._entries:
+            self._drop(key)
+        sop_ids = set(depends_on) | {key[1]}
+        self._entries[key] = (time.monotonic() + self.ttl, body, etag, sop_ids)
+        for sop_id in sop_ids:
+            self._keys_by_sop.setdefault(sop_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def invalidate(self, *sop_ids: str):
+        """Drop every cached view built from any of these SOPs"""
+        self._generation += 1
+        for sop_id in sop_ids:
+            for key in list(self._keys_by_sop.get(sop_id, ())):
+                self._drop(key)
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+        self._keys_by_sop.clear()
+
+    def _drop(self, key: Tuple[str, str]):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for sop_id in entry[3]:
+            keys = self._keys_by_sop.get(sop_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_sop[sop_id]
+
+    async def get_or_load(self, view: str, sop_id: str, loader: Callable[[], Awaitable[object]],
+                          depends_on: Optional[Callable[[object], Iterable[str]]] = None) -> Tuple[bytes, str]:
+        """Rendered body and strong ETag of a view, loading and storing it on a miss"""
+        key = (view, sop_id)
+        cached = self.get(key)
+        record_cache(view, cached is not None)
+        if cached is not None:
+            return cached
+
+        generation = self._generation
+        value = await loader()
+        body = render_json(value)
+        etag = make_etag(body)
+        if generation == self._generation:
+            self.set(key, body, etag, depends_on(value) if depends_on else ())
+        return body, etag
+
+def render_json(value) -> bytes:
+    # Same encoding as FastAPI's JSONResponse
+    return json.dumps(
+        jsonable_encoder(value), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match check; uses weak comparison as RFC 9110 requires for this header"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+
+def etag_response(request: Request, body: bytes, etag: str, media_type: str = "application/json") -> Response:
+    """200 with the body, or 304 when the client already holds this representation"""
+    # no-cache: clients may store the view but must revalidate it on every use
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+response_cache = ResponseCache()
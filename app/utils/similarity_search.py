@@ -1,10 +1,9 @@
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
 import numpy as np
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 from app.database import db
-from app.models.embedding import Embedding
-from sklearn.metrics.pairwise import cosine_similarity
+from app.utils.vector_codec import decode_vector
+from app.utils.metrics import track_stage
+from app.utils.embedding_models import active_embedding_model, embedding_model_filter
 
 async def calculate_similarity(embedding1: List[float], embedding2: List[float]) -> float:
     vec1 = np.array(embedding1)
@@ -12,50 +11,67 @@ async def calculate_similarity(embedding1: List[float], embedding2: List[float])
     similarity = np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
     return float(similarity)
 
-async def find_similar_sops(topic_embedding: List[float], description_embedding: List[float], threshold: float = 0.6) -> List[Tuple[str, float]]:
+def cosine_similarities(query: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """Cosine similarity of one vector against every row of a matrix"""
+    query = np.asarray(query, dtype=np.float32).ravel()
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    norms[norms == 0] = 1.0
+    return (matrix @ query) / norms
+
+async def find_similar_sops(topic_embedding: List[float], description_embedding: List[float], threshold: float = 0.6, limit: Optional[int] = None) -> List[Tuple[str, float]]:
     # Get all embeddings from the database
-    embeddings = []
-    async for doc in db.embeddings.find():
-        embeddings.append(Embedding(**doc))
+    sop_ids = []
+    topic_vectors = []
+    summary_vectors = []
+    projection = {"_id": 0, "sop_id": 1, "topic_embedding": 1, "summary_embedding": 1}
+    async for doc in db.embeddings.find(embedding_model_filter(active_embedding_model()), projection):
+        sop_ids.append(doc["sop_id"])
+        topic_vectors.append(decode_vector(doc["topic_embedding"]))
+        summary_vectors.append(decode_vector(doc["summary_embedding"]))
     
-    if not embeddings:
+    if not sop_ids:
         return []
     
-    # Convert embeddings to numpy arrays
-    topic_embeddings = np.array([e.topic_embedding for e in embeddings])
-    description_embeddings = np.array([e.summary_embedding for e in embeddings])
+    # Stack the decoded float32 vectors into matrices
+    topic_embeddings = np.vstack(topic_vectors)
+    description_embeddings = np.vstack(summary_vectors)
     
     # Calculate similarities
-    topic_similarities = cosine_similarity(
-        np.array(topic_embedding).reshape(1, -1),
-        topic_embeddings
-    )[0]
-    
-    description_similarities = cosine_similarity(
-        np.array(description_embedding).reshape(1, -1),
-        description_embeddings
-    )[0]
-    
-    # Combine similarities with weights
-    combined_similarities = 0.6 * topic_similarities + 0.4 * description_similarities
+    with track_stage("similarity_scan"):
+        topic_similarities = cosine_similarities(topic_embedding, topic_embeddings)
+        description_similarities = cosine_similarities(description_embedding, description_embeddings)
+        
+        # Combine similarities with weights
+        combined_similarities = 0.6 * topic_similarities + 0.4 * description_similarities
     
-    # Get version numbers for each SOP
-    version_boost = []
-    for embedding in embeddings:
-        sop_doc = await db.sop_documents.find_one({"sop_id": embedding.sop_id})
-        version = sop_doc.get("version", 1) if sop_doc else 1
-        # Apply version boost: each version increases similarity by 5%
-        version_boost.append(1.0 + (version - 1) * 0.05)
+    # Get version numbers for every SOP in one query
+    versions = {}
+    async for doc in db.sop_documents.find({}, {"_id": 0, "sop_id": 1, "version": 1}):
+        versions[doc["sop_id"]] = doc.get("version", 1)
+    # Apply version boost: each version increases similarity by 5%
+    version_boost = np.array([1.0 + (versions.get(sop_id, 1) - 1) * 0.05 for sop_id in sop_ids])
     
     # Apply version boost to similarities
-    boosted_similarities = combined_similarities * np.array(version_boost)
+    boosted_similarities = combined_similarities * version_boost
     
-    # Get SOP IDs and create tuples
-    sop_ids = [e.sop_id for e in embeddings]
-    results = list(zip(sop_ids, boosted_similarities))
+    # Filter by threshold and keep the top results without sorting the whole library
+    order = select_top(boosted_similarities, threshold, limit)
     
-    # Filter by threshold and sort by similarity
-    filtered_results = [(sop_id, score) for sop_id, score in results if score >= threshold]
-    filtered_results.sort(key=lambda x: x[1], reverse=True)
-    
-    return filtered_results 
\ No newline at end of file
+    # Create (SOP ID, score) tuples; float32 scores are converted so they stay JSON serialisable
+    return [(sop_ids[i], float(boosted_similarities[i])) for i in order]
+
+def select_top(scores: np.ndarray, threshold: float, limit: Optional[int] = None) -> np.ndarray:
+    """Indices of scores at or above the threshold, best first, at most limit of them"""
+    candidates = np.flatnonzero(scores >= threshold)
+    if limit is not None and limit < len(candidates):
+        # Partial selection: only the top `limit` entries are ever sorted
+        candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+async def fetch_sop_metadata(sop_ids: List[str]) -> Dict[str, dict]:
+    """Topic, version, score and creation time for a set of SOPs in a single query"""
+    projection = {"_id": 0, "sop_id": 1, "topic": 1, "version": 1, "effectiveness_score": 1, "created_at": 1}
+    metadata = {}
+    async for doc in db.sop_documents.find({"sop_id": {"$in": list(sop_ids)}}, projection):
+        metadata[doc["sop_id"]] = doc
+    return metadata
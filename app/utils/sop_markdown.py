@@ -0,0 +1,129 @@
+import html
+import re
+from typing import List, NamedTuple, Optional
+
+class Block(NamedTuple):
+    """One structural element of SOP details.
+
+    kind is "heading" (level 1-5), "numbered" (level 1-3, with its number such
+    as "1.2"), "bullet" or "paragraph". text keeps the inline markdown (**bold**).
+    """
+    kind: str
+    text: str
+    level: int = 0
+    number: Optional[str] = None
+
+_HEADING = re.compile(r'^(#{1,5})\s+(.*?)$')
+_NUMBERED = (
+    (1, re.compile(r'^\d+\.\s'), re.compile(r'^(\d+)\.(.*)$')),
+    (2, re.compile(r'^\d+\.\d+\.\s'), re.compile(r'^(\d+\.\d+)\.(.*)$')),
+    (3, re.compile(r'^\d+\.\d+\.\d+\.\s'), re.compile(r'^(\d+\.\d+\.\d+)\.(.*)$')),
+)
+_BULLET_PREFIXES = ('- ', '* ', '• ')
+_LIST_START = re.compile(r'^\d+(\.\d+)*\.')
+_BOLD = re.compile(r'\*\*(.*?)\*\*')
+
+def parse_sop_markdown(content: str) -> List[Block]:
+    """Interpret the markdown the SOP prompt produces, line by line"""
+    blocks = []
+    lines = content.split('\n')
+
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+
+        heading = _HEADING.match(line)
+        if heading:
+            blocks.append(Block("heading", heading.group(2).strip(), len(heading.group(1))))
+            i += 1
+            continue
+
+        numbered = next((level for level, start, _ in _NUMBERED if start.match(line)), None)
+        if numbered is not None:
+            match = _NUMBERED[numbered - 1][2].match(line)
+            if match:
+                blocks.append(Block("numbered", match.group(2).strip(), numbered, match.group(1)))
+        elif line.startswith(_BULLET_PREFIXES):
+            blocks.append(Block("bullet", line[2:].strip()))
+        elif '**' in line:
+            # A line with bold text stands on its own
+            blocks.append(Block("paragraph", line))
+        elif line:
+            # Collect lines until an empty line, a heading or a list item
+            paragraph_lines = [line]
+            j = i + 1
+            while j < len(lines) and lines[j].strip() and not (
+                lines[j].strip().startswith(('#',) + _BULLET_PREFIXES) or _LIST_START.match(lines[j].strip())
+            ):
+                paragraph_lines.append(lines[j].strip())
+                j += 1
+            blocks.append(Block("paragraph", ' '.join(paragraph_lines)))
+            i = j - 1
+
+        i += 1
+
+    return blocks
+
+def reportlab_inline(text: str) -> str:
+    """Inline markup for ReportLab paragraphs, whose markup is XML: stray < and & are escaped as in HTML"""
+    return _BOLD.sub(r'<b>\1</b>', html.escape(text, quote=False))
+
+def html_inline(text: str) -> str:
+    return _BOLD.sub(r'<strong>\1</strong>', html.escape(text, quote=False))
+
+def render_html(blocks: List[Block]) -> str:
+    """HTML fragment for the blocks; consecutive bullets share one list element"""
+    parts = []
+    in_list = False
+    for block in blocks:
+        if in_list != (block.kind == "bullet"):
+            parts.append("<ul>" if not in_list else "</ul>")
+            in_list = not in_list
+
+        text = html_inline(block.text)
+        if block.kind == "heading":
+            # h1 is the document title, so markdown headings start at h2
+            tag = f"h{min(block.level + 1, 6)}"
+            parts.append(f"<{tag}>{text}</{tag}>")
+        elif block.kind == "numbered":
+            # Steps carry their own hierarchical numbers, as in the PDF
+            parts.append(f'<p class="step level-{block.level}"><span class="number">{block.number}.</span> {text}</p>')
+        elif block.kind == "bullet":
+            parts.append(f"<li>{text}</li>")
+        else:
+            parts.append(f"<p>{text}</p>")
+    if in_list:
+        parts.append("</ul>")
+    return "\n".join(parts)
+
+def render_markdown(blocks: List[Block]) -> str:
+    """Normalised markdown: one block per paragraph, blank lines between blocks"""
+    parts = []
+    for block in blocks:
+        if block.kind == "heading":
+            parts.append(f"{'#' * block.level} {block.text}")
+        elif block.kind == "numbered":
+            parts.append(f"{block.number}. {block.text}")
+        elif block.kind == "bullet":
+            parts.append(f"- {block.text}")
+        else:
+            parts.append(block.text)
+    return "\n\n".join(parts) + "\n"
+
+def render_preview_html(sop_id: str, topic: str, details: str) -> str:
+    """The PDF's title block and procedure as an embeddable HTML fragment"""
+    return (
+        '<article class="sop-preview">\n'
+        '<h1>STANDARD OPERATING PROCEDURE</h1>\n'
+        f'<p class="sop-id">Document ID: {html.escape(sop_id)}</p>\n'
+        '<dl class="sop-metadata">'
+        f'<dt>Document Title:</dt><dd>{html.escape(topic)}</dd>'
+        f'<dt>Document ID:</dt><dd>{html.escape(sop_id)}</dd>'
+        '</dl>\n'
+        '<h2>PROCEDURE</h2>\n'
+        f'{render_html(parse_sop_markdown(details))}\n'
+        '</article>\n'
+    )
+
+def render_preview_markdown(sop_id: str, topic: str, details: str) -> str:
+    return f"# {topic}\n\nDocument ID: {sop_id}\n\n## PROCEDURE\n\n{render_markdown(parse_sop_markdown(details))}"
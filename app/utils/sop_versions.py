@@ -0,0 +1,89 @@
+import os
+from collections import OrderedDict
+from typing import List, Optional
+from app.database import db
+from app.utils.metrics import record_cache
+from app.utils.version_delta import make_delta, apply_delta, delta_size
+
+# An edited version stores its full details every this many versions, bounding reconstruction to that many deltas
+VERSION_CHECKPOINT_INTERVAL = int(os.getenv("VERSION_CHECKPOINT_INTERVAL", "8"))
+# Materialised details kept per process
+VERSION_CACHE_SIZE = int(os.getenv("VERSION_CACHE_SIZE", "256"))
+
+# Fields a reader needs from a sops document to reconstruct its details
+DETAILS_PROJECTION = {"sop_id": 1, "details": 1, "parent_sop_id": 1, "delta": 1}
+
+def version_fields(parent_sop_id: str, parent_depth: int, parent_details: str, details: str) -> dict:
+    """sops fields storing an edited version: a delta against its parent, or a full checkpoint"""
+    depth = parent_depth + 1
+    if depth < VERSION_CHECKPOINT_INTERVAL:
+        delta = make_delta(parent_details, details)
+        # A rewrite is cheaper to store in full
+        if delta_size(delta) < len(details):
+            return {"parent_sop_id": parent_sop_id, "delta": delta, "depth": depth}
+    return {"parent_sop_id": parent_sop_id, "details": details, "depth": 0}
+
+class VersionStore:
+    """Reconstructs SOP details from checkpoints and deltas, caching recent results.
+
+    A version's content never changes once stored (an edit creates a new
+    sop_id), so cached details never need invalidating.
+    """
+
+    def __init__(self, max_entries: int = VERSION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+
+    def _cached(self, sop_id: str) -> Optional[str]:
+        details = self._cache.get(sop_id)
+        if details is not None:
+            self._cache.move_to_end(sop_id)
+        return details
+
+    def remember(self, sop_id: str, details: str):
+        self._cache[sop_id] = details
+        self._cache.move_to_end(sop_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def get_details(self, sop_id: str) -> str:
+        cached = self._cached(sop_id)
+        record_cache("sop_versions", cached is not None)
+        if cached is not None:
+            return cached
+        sop = await db.sops.find_one({"sop_id": sop_id}, DETAILS_PROJECTION)
+        if not sop:
+            raise ValueError("SOP not found")
+        return await self._materialise(sop_id, sop)
+
+    async def details_of(self, sop: dict) -> str:
+        """Details of a sops document read with (at least) DETAILS_PROJECTION"""
+        if "details" in sop:
+            return sop["details"]
+        cached = self._cached(sop["sop_id"])
+        record_cache("sop_versions", cached is not None)
+        if cached is not None:
+            return cached
+        return await self._materialise(sop["sop_id"], sop)
+
+    async def _materialise(self, sop_id: str, sop: dict) -> str:
+        # Walk up to the nearest checkpoint or cached ancestor, then replay the deltas downwards
+        deltas: List[list] = []
+        while "details" not in sop:
+            deltas.append(sop["delta"])
+            parent_id = sop["parent_sop_id"]
+            base = self._cached(parent_id)
+            if base is not None:
+                break
+            sop = await db.sops.find_one({"sop_id": parent_id}, DETAILS_PROJECTION)
+            if not sop:
+                raise ValueError(f"Parent version {parent_id} not found")
+        else:
+            base = sop["details"]
+
+        for delta in reversed(deltas):
+            base = apply_delta(base, delta)
+        self.remember(sop_id, base)
+        return base
+
+version_store = VersionStore()
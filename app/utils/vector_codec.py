@@ -0,0 +1,17 @@
+import numpy as np
+from bson.binary import Binary
+from typing import Sequence, Union
+
+# Embeddings are persisted as little-endian float32 so they can be decoded without copying
+VECTOR_DTYPE = np.dtype("<f4")
+
+def encode_vector(vector: Union[Sequence[float], np.ndarray]) -> Binary:
+    return Binary(np.asarray(vector, dtype=VECTOR_DTYPE).tobytes())
+
+def decode_vector(value) -> np.ndarray:
+    """Decode a stored embedding into a read-only float32 array"""
+    # Binary subtype 0 comes back from the driver as plain bytes
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return np.frombuffer(value, dtype=VECTOR_DTYPE)
+    # Legacy documents still hold BSON arrays of doubles
+    return np.asarray(value, dtype=VECTOR_DTYPE)
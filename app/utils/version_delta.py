@@ -0,0 +1,39 @@
+from difflib import SequenceMatcher
+
+def make_delta(parent: str, child: str) -> list:
+    """Line-level edit script turning parent into child.
+
+    Ops are ["=", n] (keep the next n parent lines), ["-", n] (drop them)
+    and ["+", lines] (insert lines); lines keep their line endings, so
+    applying the delta reproduces child exactly.
+    """
+    parent_lines = parent.splitlines(keepends=True)
+    child_lines = child.splitlines(keepends=True)
+    delta = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, parent_lines, child_lines, autojunk=False).get_opcodes():
+        if tag == "equal":
+            delta.append(["=", i2 - i1])
+            continue
+        if i2 > i1:
+            delta.append(["-", i2 - i1])
+        if j2 > j1:
+            delta.append(["+", child_lines[j1:j2]])
+    return delta
+
+def apply_delta(parent: str, delta: list) -> str:
+    parent_lines = parent.splitlines(keepends=True)
+    lines = []
+    position = 0
+    for op, value in delta:
+        if op == "=":
+            lines.extend(parent_lines[position:position + value])
+            position += value
+        elif op == "-":
+            position += value
+        else:
+            lines.extend(value)
+    return "".join(lines)
+
+def delta_size(delta: list) -> int:
+    # Rough stored size: inserted text plus a few bytes per op
+    return sum(sum(len(line) for line in value) if op == "+" else 0 for op, value in delta) + 8 * len(delta)
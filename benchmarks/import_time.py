@@ -0,0 +1,58 @@
+"""Cold-start import budget for the API.
+
+Runs `python -X importtime -c "import app.main"` in a fresh interpreter, prints
+the slowest top-level imports and exits with status 1 when the total goes over
+the budget, so it can gate CI.
+
+    python -m benchmarks.import_time --budget-ms 1000
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+DEFAULT_BUDGET_MS = int(os.getenv("IMPORT_TIME_BUDGET_MS", "1000"))
+
+def measure(module: str) -> list:
+    """(cumulative microseconds, module name) for every top-level import"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        # Lines look like: "import time:       123 |       4567 |   package.module"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented below the package that pulled them in
+        if not name.startswith("  "):
+            imports.append((int(cumulative), name.strip()))
+    return imports
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--budget-ms", type=int, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    imports = measure(args.module)
+    total_ms = sum(cumulative for cumulative, _ in imports) / 1000
+
+    print(f"Slowest top-level imports for {args.module}:")
+    for cumulative, name in sorted(imports, reverse=True)[:args.top]:
+        print(f"{cumulative / 1000:>9.1f} ms  {name}")
+    print(f"Total: {total_ms:.1f} ms (budget {args.budget_ms} ms)")
+
+    if total_ms > args.budget_ms:
+        print("Import time budget exceeded")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Recall-vs-latency report for the truncated-prefix similarity search.
+
+Compares EmbeddingIndex.search at several prefix sizes with the exact results of
+find_similar_sops. Queries are library vectors with a little Gaussian noise so
+the exact top hit is not trivially the query itself.
+
+    python -m benchmarks.prefix_recall --queries 50 --k 10 --dims 64,128,256,512
+"""
+import argparse
+import asyncio
+import time
+import numpy as np
+from app.utils.embedding_index import EmbeddingIndex, SimilarityFilters
+from app.utils.similarity_search import find_similar_sops
+
+# find_similar_sops scores every version, so the index is compared unfiltered
+NO_FILTERS = SimilarityFilters(latest_only=False)
+
+async def run(queries: int, k: int, dims: list, noise: float, seed: int):
+    # The prefix scan is what is measured, so the ANN graph is never loaded
+    index = EmbeddingIndex(use_ann=False)
+    await index.load()
+    n = len(index)
+    if n == 0:
+        print("No embeddings stored; nothing to measure")
+        return
+
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(n, size=min(queries, n), replace=False)
+    full_dim = index.dim
+    query_pairs = [
+        (
+            topic + rng.normal(0, noise, full_dim).astype(np.float32),
+            summary + rng.normal(0, noise, full_dim).astype(np.float32)
+        )
+        for topic, summary in zip(index.topic_vectors(rows), index.summary_vectors(rows))
+    ]
+
+    # Exact reference results straight from MongoDB
+    exact = []
+    exact_latencies = []
+    for topic, summary in query_pairs:
+        start = time.perf_counter()
+        results = await find_similar_sops(topic.tolist(), summary.tolist(), threshold=-np.inf)
+        exact_latencies.append(time.perf_counter() - start)
+        exact.append({sop_id for sop_id, _ in results[:k]})
+
+    print(f"library={n} queries={len(query_pairs)} k={k} full_dim={full_dim}")
+    print(f"exact find_similar_sops: mean {np.mean(exact_latencies) * 1000:.1f} ms (includes MongoDB scan)")
+    print(f"{'dim':>6} {'recall@k':>9} {'mean ms':>9} {'p95 ms':>9} {'scan MiB':>9}")
+
+    for dim in dims + [full_dim]:
+        index.rebuild_prefix(dim)
+        recalls = []
+        latencies = []
+        for (topic, summary), expected in zip(query_pairs, exact):
+            start = time.perf_counter()
+            results = index.search(topic, summary, threshold=-np.inf, limit=k, filters=NO_FILTERS)
+            latencies.append(time.perf_counter() - start)
+            found = {sop_id for sop_id, _ in results}
+            recalls.append(len(found & expected) / len(expected) if expected else 1.0)
+
+        scan_dim = dim if 0 < dim < full_dim else full_dim
+        scan_mib = 2 * n * scan_dim * 4 / 2 ** 20
+        print(
+            f"{dim:>6} {np.mean(recalls):>9.3f} {np.mean(latencies) * 1000:>9.2f} "
+            f"{np.percentile(latencies, 95) * 1000:>9.2f} {scan_mib:>9.1f}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dims", default="64,128,256,512")
+    parser.add_argument("--noise", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    dims = [int(d) for d in args.dims.split(",") if d]
+    asyncio.run(run(args.queries, args.k, dims, args.noise, args.seed))
+
+if __name__ == "__main__":
+    main()
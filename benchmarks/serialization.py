@@ -0,0 +1,98 @@
+"""Per-row serialization cost of the list endpoints, before and after the orjson path.
+
+Builds synthetic task and SOP document rows shaped like MongoDB returns them
+and times each way of turning them into a JSON body:
+
+  tasks (before)          Task(**doc) per row, then FastAPI's response_model
+                          validation and jsonable_encoder + json.dumps
+  sop_documents (before)  a hand-built dict per row, then jsonable_encoder + json.dumps
+  after                   projected rows straight into orjson.dumps
+
+    python -m benchmarks.serialization --rows 100000
+"""
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from app.models.sop import Task
+
+def _task_rows(count: int) -> List[dict]:
+    start = datetime(2024, 1, 1)
+    return [{
+        "id": str(uuid.uuid4()),
+        "sop_id": str(uuid.uuid4()),
+        "topic": f"Forklift inspection procedure {i}",
+        "created_at": start + timedelta(seconds=i),
+        "status": ("pending", "in_progress", "completed")[i % 3]
+    } for i in range(count)]
+
+def _sop_document_rows(count: int) -> List[dict]:
+    start = datetime(2024, 1, 1)
+    return [{
+        "sop_id": str(uuid.uuid4()),
+        "topic": f"Warehouse safety procedure {i}",
+        "created_at": start + timedelta(seconds=i),
+        "version": 1 + i % 4,
+        "effectiveness_score": None if i % 5 else 87.5
+    } for i in range(count)]
+
+def _dumps(content) -> bytes:
+    # What FastAPI's JSONResponse does with an encoded value
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def _revalidate(models: List[BaseModel]) -> list:
+    # response_model=list[Task] validates every returned model once more before encoding
+    return [Task(**(model.model_dump() if hasattr(model, "model_dump") else model.dict())) for model in models]
+
+def tasks_before(rows: List[dict]) -> bytes:
+    models = [Task(**row) for row in rows]
+    return _dumps(jsonable_encoder(_revalidate(models)))
+
+def sop_documents_before(rows: List[dict]) -> bytes:
+    documents = [{
+        "sop_id": doc["sop_id"],
+        "topic": doc["topic"],
+        "created_at": doc["created_at"],
+        "version": doc.get("version", 1),
+        "effectiveness_score": doc.get("effectiveness_score")
+    } for doc in rows]
+    return _dumps(jsonable_encoder(documents))
+
+def after(rows: List[dict]) -> bytes:
+    return orjson.dumps(rows)
+
+def _time(fn, rows: List[dict], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"rows={args.rows}, best of {args.repeat}")
+    print(f"{'case':<24} {'total ms':>10} {'us/row':>8} {'speedup':>8}")
+    for name, rows, before in (
+        ("tasks", _task_rows(args.rows), tasks_before),
+        ("sop_documents", _sop_document_rows(args.rows), sop_documents_before),
+    ):
+        before_seconds = _time(before, rows, args.repeat)
+        after_seconds = _time(after, rows, args.repeat)
+        for label, seconds in ((f"{name} before", before_seconds), (f"{name} after", after_seconds)):
+            print(
+                f"{label:<24} {seconds * 1000:>10.1f} {seconds / args.rows * 1e6:>8.2f} "
+                f"{before_seconds / seconds:>7.1f}x"
+            )
+
+if __name__ == "__main__":
+    main()
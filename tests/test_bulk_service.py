@@ -0,0 +1,88 @@
+import asyncio
+from datetime import timedelta
+import pytest
+
+pytest.importorskip("motor")
+
+from app.services import bulk_service
+from app.services.bulk_service import parse_bulk_rows
+
+def test_parse_csv():
+    content = "topic,description\nForklift checks, Daily inspection \nLathe setup,Tooling\n"
+    assert parse_bulk_rows(content, "rows.csv") == [
+        {"topic": "Forklift checks", "description": "Daily inspection"},
+        {"topic": "Lathe setup", "description": "Tooling"},
+    ]
+
+def test_parse_jsonl_by_extension_or_content():
+    content = '{"topic": "Forklift checks", "description": "Daily inspection"}\n\n{"topic": "Lathe", "description": "Setup"}\n'
+    expected = [{"topic": "Forklift checks", "description": "Daily inspection"}, {"topic": "Lathe", "description": "Setup"}]
+    assert parse_bulk_rows(content, "rows.jsonl") == expected
+    assert parse_bulk_rows(content) == expected
+
+def test_parse_rejects_incomplete_rows():
+    with pytest.raises(ValueError, match="Row 2"):
+        parse_bulk_rows("topic,description\nA,B\nC,\n", "rows.csv")
+
+def test_parse_rejects_empty_files():
+    with pytest.raises(ValueError, match="No rows"):
+        parse_bulk_rows("topic,description\n", "rows.csv")
+
+@pytest.fixture
+def tasks(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    db = mongomock_motor.AsyncMongoMockClient().sop_database
+    monkeypatch.setattr(bulk_service, "db", db)
+    now = bulk_service._now()
+    rows = [
+        {"status": "pending"},
+        {"status": "in_progress", "owner": "dead:1", "lease_expires_at": now - timedelta(seconds=1)},
+        {"status": "in_progress", "owner": "live:1", "lease_expires_at": now + timedelta(minutes=5)},
+        {"status": "in_progress"},
+        {"status": "failed", "error": "boom"},
+        {"status": "completed"},
+    ]
+    asyncio.run(db.tasks.insert_many([
+        {"id": f"task{number}", "job_id": "job", "row": number, "sop_id": f"sop{number}",
+         "topic": f"Topic {number}", "description": "Description", **row}
+        for number, row in enumerate(rows)
+    ]))
+    return db
+
+def _statuses(db):
+    async def read():
+        return {task["row"]: task["status"] async for task in db.tasks.find({"job_id": "job"})}
+    return asyncio.run(read())
+
+def test_requeue_leaves_live_leases_alone(tasks):
+    asyncio.run(bulk_service.requeue_bulk_job("job"))
+    assert _statuses(tasks) == {0: "pending", 1: "pending", 2: "in_progress", 3: "pending", 4: "pending", 5: "completed"}
+
+def test_workers_reclaim_expired_leases_only(tasks, monkeypatch):
+    generated = []
+
+    async def generate_sop(topic, description, priority=None):
+        generated.append(topic)
+        return {"details": "Details", "summary": "Summary"}
+
+    async def get_embeddings(texts, priority=None):
+        return [[1.0, 0.0]] * len(texts)
+
+    async def store_generated_sops(sops):
+        pass
+
+    monkeypatch.setattr(bulk_service, "generate_sop", generate_sop)
+    monkeypatch.setattr(bulk_service, "get_embeddings", get_embeddings)
+    monkeypatch.setattr(bulk_service, "store_generated_sops", store_generated_sops)
+
+    asyncio.run(bulk_service.run_bulk_job("job", concurrency=2))
+    # Pending and expired rows are generated; the row leased by a live worker, the legacy
+    # in-progress row without a lease, and failed and completed rows are not
+    assert sorted(generated) == ["Topic 0", "Topic 1"]
+    statuses = _statuses(tasks)
+    assert [statuses[row] for row in (2, 3, 4, 5)] == ["in_progress", "in_progress", "failed", "completed"]
+
+def test_progress_reports_rows_leased_elsewhere_as_running(tasks):
+    progress = asyncio.run(bulk_service.get_bulk_job_progress("job"))
+    assert progress["running"] is True
+    assert progress["status_counts"]["in_progress"] == 3
@@ -0,0 +1,157 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("motor")
+
+from bson import ObjectId
+from app.utils import embedding_index as embedding_index_module, embedding_snapshot
+from app.utils.embedding_index import EmbeddingIndex, SimilarityFilters, TOPIC_WEIGHT, SUMMARY_WEIGHT
+from app.utils.embedding_models import active_embedding_model
+
+NO_FILTERS = SimilarityFilters(latest_only=False)
+
+def _index(rows):
+    """Index of (sop_id, topic, summary, version, effectiveness_score, created_at) rows, built without MongoDB"""
+    index = EmbeddingIndex(prefix_dim=0)
+    index._loaded = True
+    index.model = active_embedding_model()
+    for row in rows:
+        index.add(*row)
+    return index
+
+def _library(count=10, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        (f"sop{i}", rng.normal(size=dim).tolist(), rng.normal(size=dim).tolist(), 1,
+         float(i * 10), datetime(2024, 1, 1 + i, tzinfo=timezone.utc))
+        for i in range(count)
+    ]
+
+def _expected(rows, topic, summary, keep):
+    """Brute-force weighted cosine of the query against every kept row, best first"""
+    unit = lambda vector: np.asarray(vector) / np.linalg.norm(vector)
+    scores = [
+        (row[0], TOPIC_WEIGHT * unit(topic) @ unit(row[1]) + SUMMARY_WEIGHT * unit(summary) @ unit(row[2]))
+        for row in rows if keep(row)
+    ]
+    return sorted(scores, key=lambda item: item[1], reverse=True)
+
+def test_mask_combines_filters():
+    rows = _library(4)
+    index = _index(rows)
+    index.mark_superseded("sop1")
+    index.set_effectiveness_score("sop3", None)
+
+    assert index._mask(NO_FILTERS) is None
+    assert index._mask(SimilarityFilters()).tolist() == [True, False, True, True]
+    # A SOP without a score never passes a score filter
+    assert index._mask(SimilarityFilters(min_effectiveness_score=10)).tolist() == [False, False, True, False]
+    assert index._mask(SimilarityFilters(created_after=datetime(2024, 1, 2, tzinfo=timezone.utc))).tolist() == [False, False, True, True]
+
+def test_allowed_keeps_unknown_sops():
+    index = _index(_library(3))
+    index.mark_superseded("sop0")
+    assert index.allowed(["sop0", "sop1", "unknown"]) == ["sop1", "unknown"]
+
+@pytest.mark.parametrize("min_score, expected_path", [(80, "gather"), (20, "mask")])
+def test_search_batch_maps_filtered_rows_back_to_sop_ids(min_score, expected_path):
+    rows = _library(10)
+    index = _index(rows)
+    filters = SimilarityFilters(latest_only=False, min_effectiveness_score=min_score)
+    kept = index._mask(filters).sum()
+    # 80 keeps 2 of 10 rows (scored from a gathered copy), 20 keeps 8 (scored in place with a mask)
+    assert (kept < 0.5 * len(rows)) == (expected_path == "gather")
+
+    queries = _library(3, seed=1)
+    results = index.search_batch([q[1] for q in queries], [q[2] for q in queries], threshold=-1.0, filters=filters)
+
+    assert len(results) == len(queries)
+    for query, result in zip(queries, results):
+        expected = _expected(rows, query[1], query[2], lambda row: row[4] >= min_score)
+        assert [sop_id for sop_id, _ in result] == [sop_id for sop_id, _ in expected]
+        assert [score for _, score in result] == pytest.approx([score for _, score in expected], abs=1e-5)
+
+def test_search_batch_matches_search():
+    rows = _library(10)
+    index = _index(rows)
+    index.mark_superseded("sop4")
+    queries = _library(4, seed=2)
+    batch = index.search_batch([q[1] for q in queries], [q[2] for q in queries], threshold=-1.0, limit=3)
+    for query, result in zip(queries, batch):
+        single = index.search(query[1], query[2], threshold=-1.0, limit=3)
+        assert [sop_id for sop_id, _ in result] == [sop_id for sop_id, _ in single]
+        assert "sop4" not in [sop_id for sop_id, _ in result]
+
+def test_search_batch_with_no_rows_passing():
+    index = _index(_library(3))
+    filters = SimilarityFilters(min_effectiveness_score=1000)
+    assert index.search_batch([[1.0] * 8], [[1.0] * 8], filters=filters) == [[]]
+
+def test_unboosted_scores_ignore_versions():
+    vector = [1.0, 0.0, 0.0, 0.0]
+    index = _index([("edited", vector, vector, 5), ("original", vector, vector, 1)])
+    assert index.search(vector, vector, threshold=0.0)[0] == ("edited", pytest.approx(1.2))
+    assert sorted(score for _, score in index.search(vector, vector, threshold=0.0, boosted=False)) == pytest.approx([1.0, 1.0])
+
+def test_refresh_keeps_changes_made_while_reading():
+    index = _index(_library(3))
+
+    async def stale_read(edits_last_id, scores_since):
+        # An edit and a score update land while the refresh is waiting on MongoDB
+        index.mark_superseded("sop1")
+        index.set_effectiveness_score("sop2", 95.0)
+        return [], {"sop1": 0.0, "sop2": 0.0}, edits_last_id
+
+    index._read_metadata_changes = stale_read
+    asyncio.run(index.refresh_metadata())
+    assert index.latest.tolist() == [True, False, True]
+    assert index.effectiveness.tolist() == [0.0, 0.0, 95.0]
+
+@pytest.fixture
+def metadata_db(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    db = mongomock_motor.AsyncMongoMockClient().sop_database
+    monkeypatch.setattr(embedding_index_module, "db", db)
+    return db
+
+def test_refresh_reads_only_changes_above_the_marks(metadata_db):
+    index = _index(_library(4))
+    old_edit = ObjectId.from_datetime(datetime(2024, 1, 1, tzinfo=timezone.utc))
+    mark = ObjectId.from_datetime(datetime(2024, 1, 2, tzinfo=timezone.utc))
+    asyncio.run(metadata_db.edited_sop_details.insert_one({"_id": old_edit, "old_sop_id": "sop0"}))
+    asyncio.run(metadata_db.edited_sop_details.insert_one({"old_sop_id": "sop1"}))
+    asyncio.run(metadata_db.sop_documents.insert_many([
+        {"sop_id": "sop2", "effectiveness_score": 55.0, "effectiveness_updated_at": datetime.utcnow()},
+        {"sop_id": "sop3", "effectiveness_score": 5.0, "effectiveness_updated_at": datetime(2024, 1, 1)},
+    ]))
+    index.edits_last_id = mark
+    index.scores_since = datetime.utcnow() - timedelta(hours=1)
+
+    asyncio.run(index.refresh_metadata())
+    # The edit and the score update older than the marks were already applied
+    assert index.latest.tolist() == [True, False, True, True]
+    assert index.effectiveness.tolist() == [0.0, 10.0, 55.0, 30.0]
+    assert index.edits_last_id > mark
+    assert index.scores_since > datetime.utcnow() - timedelta(minutes=1)
+
+def test_snapshot_round_trip_keeps_metadata(tmp_path, metadata_db):
+    rows = _library(5)
+    index = _index(rows)
+    index.mark_superseded("sop3")
+    index.edits_last_id = ObjectId()
+    index.scores_since = datetime(2024, 6, 1)
+    manifest = embedding_snapshot.write_snapshot(index, str(tmp_path))
+
+    loaded = EmbeddingIndex(prefix_dim=0, use_ann=False)
+    original_open = embedding_snapshot.open_snapshot
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(embedding_snapshot, "open_snapshot", lambda manifest: original_open(manifest, str(tmp_path)))
+        asyncio.run(loaded._load_snapshot(manifest))
+
+    assert loaded.sop_ids == index.sop_ids
+    assert loaded.latest.tolist() == index.latest.tolist()
+    assert loaded.effectiveness.tolist() == index.effectiveness.tolist()
+    assert loaded.created.tolist() == index.created.tolist()
+    assert (loaded.edits_last_id, loaded.scores_since) == (index.edits_last_id, index.scores_since)
@@ -0,0 +1,96 @@
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+from app.utils.compression import SelectiveGZipMiddleware, is_compressible
+from app.utils.file_responses import cacheable_file_response, parse_range
+
+PDF = b"%PDF-1.4\n" + bytes(range(256)) * 40
+
+def test_parse_range():
+    assert parse_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_range("bytes=900-", 1000) == (900, 999)
+    assert parse_range("bytes=-100", 1000) == (900, 999)
+    assert parse_range("bytes=-5000", 1000) == (0, 999)
+    # An end past the file is clamped
+    assert parse_range("bytes=990-2000", 1000) == (990, 999)
+
+def test_parse_range_falls_back_to_the_whole_file():
+    assert parse_range("bytes=0-1,5-9", 1000) is None
+    assert parse_range("items=0-1", 1000) is None
+    assert parse_range("bytes=-", 1000) is None
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=20-10", "bytes=-0"])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 1000)
+
+def test_is_compressible():
+    assert is_compressible("application/json")
+    assert is_compressible("image/svg+xml")
+    assert not is_compressible("application/pdf")
+    assert not is_compressible("image/png; charset=binary")
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "sop.pdf"
+    path.write_bytes(PDF)
+    app = FastAPI()
+    app.add_middleware(SelectiveGZipMiddleware, minimum_size=100)
+
+    @app.get("/pdf")
+    async def pdf(request: Request):
+        return cacheable_file_response(request, str(path), "application/pdf", "sop.pdf")
+
+    @app.get("/text")
+    async def text():
+        return PlainTextResponse("compressible " * 100)
+
+    return TestClient(app)
+
+def test_full_download_has_validators(client):
+    response = client.get("/pdf")
+    assert response.status_code == 200
+    assert response.content == PDF
+    assert response.headers["accept-ranges"] == "bytes"
+    assert "immutable" in response.headers["cache-control"]
+    assert "etag" in response.headers and "last-modified" in response.headers
+
+def test_range_is_served_as_206(client):
+    response = client.get("/pdf", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == PDF[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(PDF)}"
+    assert response.headers["content-length"] == "10"
+
+def test_unsatisfiable_range_is_416(client):
+    response = client.get("/pdf", headers={"Range": f"bytes={len(PDF)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(PDF)}"
+
+def test_stale_if_range_gets_the_whole_file(client):
+    response = client.get("/pdf", headers={"Range": "bytes=10-19", "If-Range": '"old"'})
+    assert response.status_code == 200
+    assert response.content == PDF
+
+def test_matching_etag_is_304(client):
+    etag = client.get("/pdf").headers["etag"]
+    response = client.get("/pdf", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+def test_pdfs_and_ranges_are_not_gzipped(client):
+    full = client.get("/pdf", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in full.headers
+    partial = client.get("/pdf", headers={"Accept-Encoding": "gzip", "Range": "bytes=0-499"})
+    assert partial.status_code == 206 and "content-encoding" not in partial.headers
+    assert partial.content == PDF[:500]
+
+def test_text_is_gzipped(client):
+    response = client.get("/text", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "accept-encoding" in response.headers["vary"].lower()
+    assert response.text == "compressible " * 100
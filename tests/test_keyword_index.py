@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+
+pytest.importorskip("motor")
+
+from app.utils.keyword_index import KeywordIndex, tokenize, reciprocal_rank_fusion
+from app.utils.version_delta import make_delta
+
+def _index(*sops):
+    index = KeywordIndex()
+    index._loaded = True
+    for sop in sops:
+        index.add(*sop)
+    return index
+
+def test_tokenize_lowercases_and_drops_stopwords():
+    assert tokenize("How to Clean the CNC-Machine in 5 steps") == ["clean", "cnc", "machine", "steps"]
+
+def test_tokenize_drops_single_characters():
+    assert tokenize("a b c forklift") == ["forklift"]
+
+def test_search_weights_topic_over_details():
+    index = _index(
+        ("topic", "Forklift inspection", "Daily checks", "Check the tyres."),
+        ("details", "Warehouse safety", "Daily checks", "Inspect the forklift before use."),
+    )
+    assert [sop_id for sop_id, _ in index.search("forklift")] == ["topic", "details"]
+
+def test_search_ignores_documents_without_query_terms():
+    index = _index(("a", "Forklift inspection", "", ""), ("b", "Lathe setup", "", ""))
+    assert [sop_id for sop_id, _ in index.search("lathe")] == ["b"]
+    assert index.search("conveyor") == []
+
+def test_rare_terms_score_higher():
+    index = _index(
+        ("common", "Safety check", "", ""),
+        ("both", "Safety check lockout", "", ""),
+        ("other", "Safety briefing", "", ""),
+    )
+    scores = dict(index.search("safety lockout"))
+    assert scores["both"] > scores["common"]
+
+def test_reindexing_replaces_the_previous_row():
+    index = _index(("a", "Forklift inspection", "", ""))
+    index.add("a", "Lathe setup", "", "")
+    assert index.search("forklift") == []
+    assert [sop_id for sop_id, _ in index.search("lathe")] == ["a"]
+    assert len(index) == 1
+
+def test_search_limit():
+    index = _index(*[(f"sop{i}", f"Forklift {'check ' * i}", "", "") for i in range(5)])
+    assert len(index.search("forklift", limit=2)) == 2
+    assert len(index.search("forklift", limit=None)) == 5
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion(["a", "b", "c"], ["b", "d"], k=60)
+    assert [sop_id for sop_id, _ in fused] == ["b", "a", "d", "c"]
+    assert dict(fused)["b"] == pytest.approx(1 / 62 + 1 / 61)
+    assert dict(fused)["c"] == pytest.approx(1 / 63)
+
+def test_reciprocal_rank_fusion_of_nothing():
+    assert reciprocal_rank_fusion() == []
+    assert reciprocal_rank_fusion([], []) == []
+
+def test_delta_versions_are_replayed_on_parents_in_the_same_read():
+    v1 = "Step one.\nStep two.\n"
+    v2 = "Step one.\nStep two, carefully.\n"
+    v3 = "Step one.\nStep two, carefully.\nStep three."
+    sops = [
+        {"sop_id": "v1", "details": v1},
+        {"sop_id": "v2", "parent_sop_id": "v1", "delta": make_delta(v1, v2)},
+        {"sop_id": "v3", "parent_sop_id": "v2", "delta": make_delta(v2, v3)},
+    ]
+    materialised = {}
+    details = [asyncio.run(KeywordIndex._details(sop, materialised)) for sop in sops]
+    assert details == [v1, v2, v3]
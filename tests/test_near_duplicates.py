@@ -0,0 +1,77 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("motor")
+
+from app.jobs.near_duplicates import blocked_pairs, cluster_pairs
+from app.utils.embedding_index import EmbeddingIndex, TOPIC_WEIGHT, SUMMARY_WEIGHT
+from app.utils.embedding_models import active_embedding_model
+
+def _library(count=11, dim=6, seed=0):
+    """Random SOPs plus near copies of rows 0, 4 and 9, so some duplicates straddle block boundaries"""
+    rng = np.random.default_rng(seed)
+    vectors = [(rng.normal(size=dim), rng.normal(size=dim)) for _ in range(count)]
+    for source in (0, 4, 9, 0):
+        topic, summary = vectors[source]
+        vectors.append((topic + rng.normal(scale=0.01, size=dim), summary + rng.normal(scale=0.01, size=dim)))
+    return vectors
+
+def _index(vectors):
+    index = EmbeddingIndex(prefix_dim=0, use_ann=False)
+    index._loaded = True
+    index.model = active_embedding_model()
+    for i, (topic, summary) in enumerate(vectors):
+        index.add(f"sop{i}", topic.tolist(), summary.tolist())
+    return index
+
+def _brute_force(vectors, rows, threshold):
+    unit = lambda vector: vector / np.linalg.norm(vector)
+    pairs = {}
+    for position, a in enumerate(rows):
+        for b in rows[position + 1:]:
+            score = TOPIC_WEIGHT * unit(vectors[a][0]) @ unit(vectors[b][0]) + SUMMARY_WEIGHT * unit(vectors[a][1]) @ unit(vectors[b][1])
+            if score >= threshold:
+                pairs[(min(a, b), max(a, b))] = score
+    return pairs
+
+def _found(a, b, scores):
+    return {(min(left, right), max(left, right)): score for left, right, score in zip(a.tolist(), b.tolist(), scores.tolist())}
+
+@pytest.mark.parametrize("block_size", [1, 4, 5, 100])
+@pytest.mark.parametrize("threshold", [0.95, 0.2])
+def test_blocked_pairs_match_brute_force(block_size, threshold):
+    vectors = _library()
+    index = _index(vectors)
+    rows = np.arange(len(index))
+
+    a, b, scores = blocked_pairs(index, rows, threshold, block_size)
+    expected = _brute_force(vectors, rows.tolist(), threshold)
+
+    # Every pair once, never a row with itself
+    assert len(a) == len(expected)
+    assert not np.any(a == b)
+    found = _found(a, b, scores)
+    assert found.keys() == expected.keys()
+    for pair, score in expected.items():
+        assert found[pair] == pytest.approx(score, abs=1e-5)
+
+def test_blocked_pairs_report_library_rows_of_a_subset():
+    vectors = _library()
+    index = _index(vectors)
+    # Skipping row 4, as a superseded version would be, drops its duplicate pair
+    rows = np.array([row for row in range(len(index)) if row != 4])
+
+    a, b, scores = blocked_pairs(index, rows, 0.95, block_size=3)
+    assert _found(a, b, scores).keys() == _brute_force(vectors, rows.tolist(), 0.95).keys() == {(0, 11), (0, 14), (11, 14), (9, 13)}
+
+def test_blocked_pairs_with_nothing_above_the_threshold():
+    index = _index(_library()[:4])
+    a, b, scores = blocked_pairs(index, np.arange(4), 1.5, block_size=2)
+    assert len(a) == len(b) == len(scores) == 0
+
+def test_cluster_pairs_are_components_largest_first():
+    a = np.array([5, 1, 7, 2])
+    b = np.array([6, 2, 8, 3])
+    # 5-6 and 7-8 join through 8-5, 1-2-3 chain through 2; 0 and 4 pair with nothing
+    assert cluster_pairs(9, np.append(a, 8), np.append(b, 5)) == [[5, 6, 7, 8], [1, 2, 3]]
+    assert cluster_pairs(3, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)) == []
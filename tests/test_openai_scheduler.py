@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+
+pytest.importorskip("dotenv")
+
+from app.utils import openai_scheduler
+from app.utils.openai_scheduler import OpenAIScheduler, TokenBucket, INTERACTIVE, BULK, estimate_tokens
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(openai_scheduler.time, "monotonic", fake)
+    return fake
+
+def test_bucket_starts_full_and_refills_per_minute(clock):
+    bucket = TokenBucket(60)
+    assert bucket.wait_time(60) == 0.0
+    bucket.consume(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    clock.now += 30
+    assert bucket.wait_time(30) == 0.0
+    assert bucket.wait_time(31) == pytest.approx(1.0)
+
+def test_bucket_never_exceeds_capacity(clock):
+    bucket = TokenBucket(60)
+    clock.now += 600
+    bucket.consume(0)
+    assert bucket.available == 60
+
+def test_oversized_request_waits_for_a_full_bucket(clock):
+    bucket = TokenBucket(60)
+    bucket.consume(60)
+    assert bucket.wait_time(1000) == pytest.approx(60.0)
+
+def test_underestimated_call_leaves_a_debt(clock):
+    bucket = TokenBucket(60)
+    bucket.consume(90)
+    assert bucket.wait_time(1) == pytest.approx(31.0)
+
+def test_limits_are_split_across_processes():
+    scheduler = OpenAIScheduler(rpm=500, tpm=200000, processes=4)
+    assert scheduler.requests.capacity == 125
+    assert scheduler.tokens.capacity == 50000
+
+def test_estimate_tokens():
+    # Ten tokens of text plus four of overhead per text
+    assert estimate_tokens("x" * 40, "") == 18
+
+def test_interactive_calls_are_admitted_before_queued_bulk_calls():
+    async def scenario():
+        # 100 requests a second, but the bucket starts empty so every call has to queue
+        scheduler = OpenAIScheduler(rpm=6000, tpm=10 ** 9, processes=1)
+        scheduler.requests.available = 0
+        admitted = []
+
+        async def call(name, priority):
+            await scheduler.run(lambda: asyncio.sleep(0), priority=priority)
+            admitted.append(name)
+
+        bulk = asyncio.ensure_future(call("bulk", BULK))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(call("interactive", INTERACTIVE))
+        await asyncio.gather(bulk, interactive)
+        return admitted
+
+    assert asyncio.run(scenario()) == ["interactive", "bulk"]
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        scheduler = OpenAIScheduler(rpm=1, tpm=10 ** 9, processes=1)
+        scheduler.requests.available = 0
+        waiter = asyncio.ensure_future(scheduler.run(lambda: asyncio.sleep(0)))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return scheduler._waiters
+
+    assert asyncio.run(scenario()) == []
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("motor")
+
+from app.main import app
+from app.routes import sop_routes
+from app.utils import request_deadline
+from app.utils.metrics import REQUEST_CANCELLATIONS
+
+def _cancellations(reason):
+    return REQUEST_CANCELLATIONS._values.get(("/generate_sop_direct", reason), 0)
+
+def _generate(monkeypatch, disconnect_after):
+    """Drive POST /api/generate_sop_direct through the whole app as raw ASGI; the client goes away after a delay"""
+    outcome = {}
+
+    async def create_sop_direct(topic, description):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            outcome["work_cancelled"] = True
+            raise
+
+    monkeypatch.setattr(sop_routes, "create_sop_direct", create_sop_direct)
+    monkeypatch.setattr(request_deadline, "DISCONNECT_POLL_INTERVAL", 0.02)
+
+    async def scenario():
+        body = json.dumps({"topic": "Forklift checks", "description": "Daily inspection"}).encode()
+        disconnected = asyncio.Event()
+        asyncio.get_running_loop().call_later(disconnect_after, disconnected.set)
+        sent_body = False
+        messages = []
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            if not disconnected.is_set():
+                await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": "/api/generate_sop_direct", "raw_path": b"/api/generate_sop_direct",
+            "root_path": "", "query_string": b"", "server": ("testserver", 80), "client": ("test", 1),
+            "headers": [(b"host", b"testserver"), (b"content-type", b"application/json")],
+        }
+        start = asyncio.get_running_loop().time()
+        await asyncio.wait_for(app(scope, receive, send), 4)
+        outcome["seconds"] = asyncio.get_running_loop().time() - start
+        outcome["status"] = next(m["status"] for m in messages if m["type"] == "http.response.start")
+
+    asyncio.run(scenario())
+    return outcome
+
+def test_client_disconnect_cancels_the_work_through_the_middleware(monkeypatch):
+    before = _cancellations("disconnect")
+    outcome = _generate(monkeypatch, disconnect_after=0.1)
+    assert outcome["work_cancelled"]
+    assert outcome["status"] == 499
+    assert outcome["seconds"] < 1
+    assert _cancellations("disconnect") == before + 1
+
+def test_deadline_cancels_the_work(monkeypatch):
+    monkeypatch.setattr(sop_routes, "GENERATE_SOP_DEADLINE_SECONDS", 0.1)
+    before = _cancellations("deadline")
+    outcome = _generate(monkeypatch, disconnect_after=30)
+    assert outcome["work_cancelled"]
+    assert outcome["status"] == 504
+    assert _cancellations("deadline") == before + 1
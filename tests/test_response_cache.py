@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+
+pytest.importorskip("fastapi")
+
+from starlette.requests import Request
+from app.utils import response_cache as response_cache_module
+from app.utils.response_cache import ResponseCache, etag_response, make_etag, render_json
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(response_cache_module.time, "monotonic", fake)
+    return fake
+
+def _request(headers=None):
+    raw = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw, "query_string": b""})
+
+def _load(cache, view, sop_id, value, depends_on=None):
+    async def loader():
+        return value
+    return asyncio.run(cache.get_or_load(view, sop_id, loader, depends_on))
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = ResponseCache(ttl=60)
+    cache.set(("details", "a"), b"{}", '"e"', ())
+    clock.now += 59
+    assert cache.get(("details", "a")) == (b"{}", '"e"')
+    clock.now += 2
+    assert cache.get(("details", "a")) is None
+    assert len(cache) == 0
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = ResponseCache(max_entries=2)
+    cache.set(("details", "a"), b"a", '"a"', ())
+    cache.set(("details", "b"), b"b", '"b"', ())
+    cache.get(("details", "a"))
+    cache.set(("details", "c"), b"c", '"c"', ())
+    assert cache.get(("details", "b")) is None
+    assert cache.get(("details", "a")) is not None
+    assert cache.get(("details", "c")) is not None
+
+def test_invalidating_a_sop_drops_views_built_from_it(clock):
+    cache = ResponseCache()
+    cache.set(("versions", "a"), b"[]", '"v"', ["a", "b"])
+    cache.set(("details", "b"), b"{}", '"d"', ())
+    cache.set(("details", "c"), b"{}", '"c"', ())
+    cache.invalidate("b")
+    assert cache.get(("versions", "a")) is None
+    assert cache.get(("details", "b")) is None
+    assert cache.get(("details", "c")) is not None
+
+def test_edit_changes_the_etag(clock):
+    cache = ResponseCache()
+    body, etag = _load(cache, "versions", "old", [{"sop_id": "old", "version": 1}])
+    assert body == render_json([{"sop_id": "old", "version": 1}]) and etag == make_etag(body)
+    # Served from the cache until an edit invalidates the old and new versions
+    assert _load(cache, "versions", "old", ["ignored"]) == (body, etag)
+    cache.invalidate("old", "new")
+    _, new_etag = _load(cache, "versions", "old", [{"sop_id": "old", "version": 1}, {"sop_id": "new", "version": 2}])
+    assert new_etag != etag
+
+def test_load_racing_an_invalidation_is_not_stored(clock):
+    cache = ResponseCache()
+
+    async def loader():
+        cache.invalidate("a")
+        return {"stale": True}
+
+    asyncio.run(cache.get_or_load("details", "a", loader))
+    assert cache.get(("details", "a")) is None
+
+def test_etag_response_revalidation():
+    body = b'{"a":1}'
+    etag = make_etag(body)
+    assert etag_response(_request({"If-None-Match": f'W/{etag}'}), body, etag).status_code == 304
+    fresh = etag_response(_request({"If-None-Match": '"other"'}), body, etag)
+    assert fresh.status_code == 200 and fresh.body == body
+    assert fresh.headers["etag"] == etag and fresh.headers["cache-control"] == "no-cache"
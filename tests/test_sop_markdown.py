@@ -0,0 +1,65 @@
+import re
+import pytest
+from app.utils.sop_markdown import Block, parse_sop_markdown, render_html, render_markdown
+
+DETAILS = """# Purpose
+Keep the packing line
+running safely.
+
+## Procedure
+1. Stop the **conveyor**.
+1.1. Lock out the main switch.
+1.1.1. Attach your tag.
+2. Clean <the> rollers.
+- Wear gloves
+* Wear goggles
+**Note:** report any damage.
+"""
+
+def test_parse_blocks():
+    assert parse_sop_markdown(DETAILS) == [
+        Block("heading", "Purpose", 1),
+        Block("paragraph", "Keep the packing line running safely."),
+        Block("heading", "Procedure", 2),
+        Block("numbered", "Stop the **conveyor**.", 1, "1"),
+        Block("numbered", "Lock out the main switch.", 2, "1.1"),
+        Block("numbered", "Attach your tag.", 3, "1.1.1"),
+        Block("numbered", "Clean <the> rollers.", 1, "2"),
+        Block("bullet", "Wear gloves"),
+        Block("bullet", "Wear goggles"),
+        Block("paragraph", "**Note:** report any damage."),
+    ]
+
+def test_render_html():
+    assert render_html(parse_sop_markdown(DETAILS)).split("\n") == [
+        "<h2>Purpose</h2>",
+        "<p>Keep the packing line running safely.</p>",
+        "<h3>Procedure</h3>",
+        '<p class="step level-1"><span class="number">1.</span> Stop the <strong>conveyor</strong>.</p>',
+        '<p class="step level-2"><span class="number">1.1.</span> Lock out the main switch.</p>',
+        '<p class="step level-3"><span class="number">1.1.1.</span> Attach your tag.</p>',
+        '<p class="step level-1"><span class="number">2.</span> Clean &lt;the&gt; rollers.</p>',
+        "<ul>",
+        "<li>Wear gloves</li>",
+        "<li>Wear goggles</li>",
+        "</ul>",
+        "<p><strong>Note:</strong> report any damage.</p>",
+    ]
+
+def test_render_markdown_round_trips_the_structure():
+    blocks = parse_sop_markdown(DETAILS)
+    assert parse_sop_markdown(render_markdown(blocks)) == blocks
+
+def test_html_preview_matches_the_pdf_text():
+    pytest.importorskip("reportlab")
+    from app.utils.pdf_generator import _create_custom_stylesheet, _format_markdown_content
+
+    pdf_texts = [paragraph.getPlainText() for paragraph in _format_markdown_content(DETAILS, _create_custom_stylesheet())]
+    html_texts = []
+    for line in render_html(parse_sop_markdown(DETAILS)).split("\n"):
+        if line in ("<ul>", "</ul>"):
+            continue
+        text = re.sub(r"<[^>]+>", "", line).replace("&lt;", "<").replace("&gt;", ">")
+        # The PDF draws bullets as text; HTML lists draw their own
+        html_texts.append(f"• {text}" if line.startswith("<li>") else text)
+    assert pdf_texts == html_texts
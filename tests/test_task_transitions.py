@@ -0,0 +1,47 @@
+import asyncio
+from datetime import datetime
+import pytest
+
+pytest.importorskip("fastapi")
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services import sop_service
+
+@pytest.fixture
+def client(monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient().sop_database
+    monkeypatch.setattr(sop_service, "db", db)
+    asyncio.run(db.tasks.insert_many([
+        {"id": task_id, "sop_id": "sop", "topic": "Topic", "created_at": datetime(2024, 1, 1), "status": status}
+        for task_id, status in (("pending", "pending"), ("completed", "completed"), ("legacy", "queued"))
+    ]))
+    # Not used as a context manager, so startup (indexes, embedding load) does not run
+    return TestClient(app)
+
+def _move(client, task_id, status):
+    return client.patch(f"/api/tasks/{task_id}/status", json={"status": status})
+
+def test_allowed_move(client):
+    response = _move(client, "pending", "in_progress")
+    assert response.status_code == 200
+    assert response.json()["status"] == "in_progress"
+
+def test_forbidden_move_is_409(client):
+    response = _move(client, "completed", "pending")
+    assert response.status_code == 409
+    assert "completed" in response.json()["detail"]
+    assert _move(client, "completed", "in_progress").status_code == 200
+
+def test_same_status_is_a_no_op(client):
+    response = _move(client, "completed", "completed")
+    assert response.status_code == 200
+    assert response.json()["status"] == "completed"
+
+def test_unknown_task_is_404(client):
+    assert _move(client, "missing", "completed").status_code == 404
+
+def test_statuses_outside_the_table_are_not_restricted(client):
+    assert _move(client, "legacy", "completed").status_code == 200
+    assert _move(client, "pending", "archived").status_code == 200
@@ -0,0 +1,30 @@
+import pytest
+from app.utils.version_delta import make_delta, apply_delta, delta_size
+
+PARENT = "# Purpose\nKeep the line running.\n\n# Steps\n1. Stop the belt.\n2. Clean the rollers.\n"
+
+@pytest.mark.parametrize("child", [
+    PARENT,
+    PARENT.replace("2. Clean the rollers.\n", "2. Clean and oil the rollers.\n3. Restart the belt.\n"),
+    "# Purpose\nNew text.\n" + PARENT,
+    PARENT.replace("\n# Steps\n", "\n"),
+    "",
+])
+def test_round_trip(child):
+    assert apply_delta(PARENT, make_delta(PARENT, child)) == child
+
+@pytest.mark.parametrize("parent, child", [
+    ("a\nb", "a\nc"),
+    ("a\nb", "a\nb\n"),
+    ("a\nb\n", "a\nb"),
+    ("", "only line"),
+    ("a\r\nb\r\n", "a\r\nc\r\n"),
+])
+def test_round_trip_line_endings(parent, child):
+    assert apply_delta(parent, make_delta(parent, child)) == child
+
+def test_unchanged_lines_are_referenced_not_copied():
+    child = PARENT + "3. Restart the belt.\n"
+    delta = make_delta(PARENT, child)
+    assert delta == [["=", len(PARENT.splitlines())], ["+", ["3. Restart the belt.\n"]]]
+    assert delta_size(delta) < len(child)